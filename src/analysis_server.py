@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Long-running server for analyzing saved heap snapshots.
+
+Running jsleakcheck.py for each snapshot pays for starting the interpreter,
+reading the suppressions and parsing the snapshot every time. The server keeps
+the compiled suppressions and the recently parsed snapshots in memory and
+analyzes snapshots on request.
+
+The server speaks HTTP, either on a localhost port or on a Unix socket:
+
+  analysis_server.py --port 8765
+  curl -d '{"snapshot": "/tmp/app.heapsnapshot.gz",
+            "definition": "closure-disposable"}' localhost:8765/analyze
+
+POST /analyze takes a JSON object with the keys:
+  snapshot: str, the heap snapshot file, possibly compressed.
+  definition: str or {}, the name of a predefined leak definition, or the
+      fields of a LeakDefinition ('containers', 'bad_nodes', 'suppressions',
+      'stacktrace_prefix', 'stacktrace_suffix').
+  time_budget: float, optional, see JSLeakCheck.Run.
+  max_leaks: int, optional, see JSLeakCheck.Run.
+It returns the report built by JSLeakCheck as a JSON object. GET /status
+returns the cache statistics.
+
+Parsed snapshots are kept in a least recently used cache with a memory limit.
+They are not pruned, so that the same snapshot can be analyzed with any leak
+definition. Suppression files are read again when they change.
+
+Requests are handled one at a time.
+"""
+
+import collections
+import http.client
+import http.server
+import json
+import logging
+import optparse
+import os
+import socket
+import socketserver
+import sys
+
+import heap_index
+import jsleakcheck
+import json_backends
+import leak_finder
+import suppressions
+
+
+# Rough memory usage of a parsed Node and Edge object, in bytes.
+_NODE_BYTES = 600
+_EDGE_BYTES = 400
+
+_DEFAULT_PORT = 8765
+_DEFAULT_CACHE_SIZE_MB = 1024
+
+# The LeakDefinition fields which can be given in a request.
+_DEFINITION_FIELDS = ('description', 'suppressions', 'containers', 'bad_nodes',
+                      'stacktrace_prefix', 'stacktrace_suffix')
+
+
+class Error(Exception):
+  """Base class for exceptions thrown by this module."""
+
+
+class LruCache(object):
+  """A cache evicting the least recently used values above a total size.
+
+  Attributes:
+    max_size: int, the maximum total size of the values.
+    size: int, the total size of the cached values.
+    _values: OrderedDict {key -> (value, int)}, the values and their sizes,
+        the least recently used first.
+  """
+
+  def __init__(self, max_size):
+    """Initializes the LruCache object.
+
+    Args:
+      max_size: int, the maximum total size of the values.
+    """
+    self.max_size = max_size
+    self.size = 0
+    self._values = collections.OrderedDict()
+
+  def __len__(self):
+    return len(self._values)
+
+  def Get(self, key):
+    """Returns a cached value, or None if it is not cached."""
+    if key not in self._values:
+      return None
+    self._values.move_to_end(key)
+    return self._values[key][0]
+
+  def Put(self, key, value, size):
+    """Caches a value, evicting the least recently used values if needed.
+
+    Args:
+      key: the key of the value.
+      value: the value.
+      size: int, the size of the value. A value larger than max_size is not
+          cached.
+    """
+    self.Remove(key)
+    if size > self.max_size:
+      return
+    while self._values and self.size + size > self.max_size:
+      _, (_, evicted_size) = self._values.popitem(last=False)
+      self.size -= evicted_size
+    self._values[key] = (value, size)
+    self.size += size
+
+  def Remove(self, key):
+    """Removes a value from the cache, if it is cached."""
+    if key in self._values:
+      self.size -= self._values.pop(key)[1]
+
+
+class _ParsedSnapshot(object):
+  """A parsed heap snapshot in the cache.
+
+  Attributes:
+    nodes: set(leak_finder.Node), the Node objects in the snapshot.
+    allocation_traces: leak_finder.AllocationTraces, the allocation stack
+        traces in the snapshot, or None.
+    dominator_tree: dominators.DominatorTree, the dominator tree of the
+        snapshot, or None if it hasn't been needed yet.
+    index: heap_index.HeapIndex, the index of the nodes.
+    size: int, the estimated memory usage of the snapshot in bytes.
+  """
+
+  def __init__(self, nodes, allocation_traces):
+    self.nodes = nodes
+    self.allocation_traces = allocation_traces
+    self.dominator_tree = None
+    self.index = heap_index.HeapIndex(nodes)
+    edge_count = sum(len(node.edges_from) for node in nodes)
+    self.size = len(nodes) * _NODE_BYTES + edge_count * _EDGE_BYTES
+
+
+class AnalysisServer(object):
+  """Analyzes heap snapshots, caching snapshots and suppressions.
+
+  Attributes:
+    _snapshots: LruCache, the parsed snapshots, keyed by the file name,
+        modification time and size of the snapshot file.
+    _suppressions: {str -> ((float, int), [suppressions.Suppression])}, the
+        modification time and size of each read suppression file, and the
+        suppressions read from it.
+    _json_backend: str, the JSON library for decoding the snapshots.
+    _stats: {str -> int}, counters reported by Status.
+  """
+
+  def __init__(self, cache_size, json_backend=None):
+    """Initializes the AnalysisServer object.
+
+    Args:
+      cache_size: int, the maximum estimated memory usage of the cached
+          snapshots in bytes.
+      json_backend: str, the JSON library for decoding the snapshots (see
+          json_backends), or None for the fastest installed one.
+    Raises:
+      json_backends.Error: The JSON library is not installed.
+    """
+    json_backends.GetBackend(json_backend)
+    self._snapshots = LruCache(cache_size)
+    self._suppressions = {}
+    self._json_backend = json_backend
+    self._stats = {'requests': 0, 'snapshot_hits': 0, 'snapshot_misses': 0,
+                   'suppression_reloads': 0}
+
+  @staticmethod
+  def _FileVersion(filename):
+    """Returns the modification time and size of a file.
+
+    Raises:
+      Error: The file doesn't exist.
+    """
+    try:
+      stat = os.stat(filename)
+    except OSError as e:
+      raise Error('Cannot read %s: %s' % (filename, e))
+    return stat.st_mtime, stat.st_size
+
+  def _GetSnapshot(self, filename):
+    """Returns a parsed snapshot, from the cache if possible.
+
+    Args:
+      filename: str, the heap snapshot file.
+    Returns:
+      _ParsedSnapshot, the parsed snapshot.
+    Raises:
+      Error: The snapshot cannot be read or parsed.
+    """
+    filename = os.path.realpath(filename)
+    key = (filename,) + AnalysisServer._FileVersion(filename)
+    snapshot = self._snapshots.Get(key)
+    if snapshot:
+      self._stats['snapshot_hits'] += 1
+      return snapshot
+
+    self._stats['snapshot_misses'] += 1
+    logging.info('Parsing heap snapshot %s', filename)
+    snapshotter = leak_finder.Snapshotter(json_backend=self._json_backend)
+    try:
+      nodes = list(snapshotter.GetSnapshotFromFile(filename))
+    except (IOError, KeyError, ValueError, leak_finder.Error) as e:
+      raise Error('Cannot parse %s: %s' % (filename, e))
+    snapshot = _ParsedSnapshot(nodes, snapshotter.allocation_traces)
+    self._snapshots.Put(key, snapshot, snapshot.size)
+    return snapshot
+
+  def _GetSuppressions(self, filename):
+    """Returns the suppressions in a file, reading it again if it changed.
+
+    Args:
+      filename: str, the suppressions file, relative to jsleakcheck.py.
+    Returns:
+      [suppressions.Suppression], the suppressions.
+    Raises:
+      Error: The suppressions cannot be read or parsed.
+    """
+    filename = os.path.join(os.path.dirname(jsleakcheck.__file__), filename)
+    version = AnalysisServer._FileVersion(filename)
+    cached = self._suppressions.get(filename)
+    if cached and cached[0] == version:
+      return cached[1]
+
+    logging.info('Reading suppressions from "%s"', filename)
+    try:
+      suppression_list = suppressions.ReadSuppressionsFromFile(filename)
+    except (IOError, suppressions.Error) as e:
+      raise Error('Cannot read suppressions from %s: %s' % (filename, e))
+    if cached:
+      self._stats['suppression_reloads'] += 1
+    self._suppressions[filename] = (version, suppression_list)
+    return suppression_list
+
+  @staticmethod
+  def _GetLeakDefinition(definition):
+    """Creates the LeakDefinition described in a request.
+
+    Raises:
+      Error: The definition is not valid.
+    """
+    if isinstance(definition, str):
+      if definition not in jsleakcheck.PREDEFINED_DEFINITIONS:
+        raise Error('Unknown leak definition %s' % definition)
+      return jsleakcheck.PREDEFINED_DEFINITIONS[definition]
+    if not isinstance(definition, dict):
+      raise Error('The leak definition must be a name or an object')
+    unknown = set(definition) - set(_DEFINITION_FIELDS)
+    if unknown:
+      raise Error('Unknown leak definition fields: %s' %
+                  ', '.join(sorted(unknown)))
+    leak_definition = jsleakcheck.LeakDefinition()
+    for field in _DEFINITION_FIELDS:
+      if field in definition:
+        setattr(leak_definition, field, definition[field])
+    if not leak_definition.containers:
+      raise Error('The leak definition must have at least one container')
+    return leak_definition
+
+  def Analyze(self, request):
+    """Analyzes a heap snapshot.
+
+    Args:
+      request: {}, the decoded request; see the module documentation.
+    Returns:
+      {}, the report built by JSLeakCheck.
+    Raises:
+      Error: The request is not valid or the snapshot cannot be analyzed.
+    """
+    self._stats['requests'] += 1
+    if not isinstance(request, dict) or 'snapshot' not in request:
+      raise Error('The request must be an object with a snapshot')
+    leak_definition = AnalysisServer._GetLeakDefinition(
+        request.get('definition'))
+    suppression_list = []
+    if leak_definition.suppressions:
+      suppression_list = self._GetSuppressions(leak_definition.suppressions)
+    for name, types, description in (
+        ('time_budget', (int, float), 'number'),
+        ('max_leaks', int, 'integer')):
+      value = request.get(name)
+      if value is not None and (isinstance(value, bool) or
+                                not isinstance(value, types) or value < 0):
+        raise Error('%s must be a non-negative %s' % (name, description))
+    snapshot = self._GetSnapshot(request['snapshot'])
+
+    checker = jsleakcheck.JSLeakCheck(leak_definition,
+                                      suppression_list=suppression_list)
+    try:
+      report = checker.AnalyzeNodes(snapshot.nodes, snapshot.allocation_traces,
+                                    request.get('time_budget'),
+                                    request.get('max_leaks'),
+                                    snapshot.dominator_tree, snapshot.index)
+    except leak_finder.Error as e:
+      raise Error('Cannot analyze %s: %s' % (request['snapshot'], e))
+    snapshot.dominator_tree = checker.dominator_tree
+    return report
+
+  def Status(self):
+    """Returns statistics about the server and its caches."""
+    status = dict(self._stats)
+    status['cached_snapshots'] = len(self._snapshots)
+    status['cache_size'] = self._snapshots.size
+    status['cache_max_size'] = self._snapshots.max_size
+    status['cached_suppression_files'] = len(self._suppressions)
+    return status
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+  """Handles the HTTP requests of the analysis server."""
+
+  def _SendJson(self, status, value):
+    data = json.dumps(value).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    if self.path != '/status':
+      self._SendJson(404, {'error': 'Unknown path %s' % self.path})
+      return
+    self._SendJson(200, self.server.analysis_server.Status())
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    if self.path != '/analyze':
+      self._SendJson(404, {'error': 'Unknown path %s' % self.path})
+      return
+    length = int(self.headers.get('Content-Length', 0))
+    try:
+      request = json.loads(self.rfile.read(length))
+      report = self.server.analysis_server.Analyze(request)
+    except ValueError as e:
+      self._SendJson(400, {'error': 'Cannot decode the request: %s' % e})
+      return
+    except Error as e:
+      self._SendJson(400, {'error': str(e)})
+      return
+    self._SendJson(200, report)
+
+  def address_string(self):
+    # Unix socket clients don't have an address.
+    if isinstance(self.client_address, tuple):
+      return self.client_address[0]
+    return 'unix socket'
+
+  def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+    logging.info('%s: %s', self.address_string(), format % args)
+
+
+class _TcpServer(http.server.HTTPServer):
+  """HTTP server listening on a localhost port."""
+
+  def __init__(self, port, analysis_server):
+    http.server.HTTPServer.__init__(self, ('127.0.0.1', port), _RequestHandler)
+    self.analysis_server = analysis_server
+
+
+class _UnixServer(socketserver.UnixStreamServer):
+  """HTTP server listening on a Unix socket."""
+
+  def __init__(self, socket_path, analysis_server):
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+    self.analysis_server = analysis_server
+
+
+def CreateServer(analysis_server, port=None, socket_path=None):
+  """Creates an HTTP server for an AnalysisServer.
+
+  Args:
+    analysis_server: AnalysisServer, the server handling the requests.
+    port: int, the localhost port to listen on; 0 for any free port.
+    socket_path: str, the Unix socket to listen on instead of a port.
+  Returns:
+    socketserver.BaseServer, the server; call serve_forever() to run it.
+  """
+  if socket_path:
+    return _UnixServer(socket_path, analysis_server)
+  return _TcpServer(port, analysis_server)
+
+
+class _UnixHttpConnection(http.client.HTTPConnection):
+  """HTTP connection over a Unix socket."""
+
+  def __init__(self, socket_path):
+    http.client.HTTPConnection.__init__(self, 'localhost')
+    self._socket_path = socket_path
+
+  def connect(self):
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.connect(self._socket_path)
+
+
+def SendRequest(path, request=None, port=None, socket_path=None):
+  """Sends a request to a running analysis server.
+
+  Args:
+    path: str, '/analyze' or '/status'.
+    request: {}, the request to POST, or None for a GET request.
+    port: int, the localhost port of the server.
+    socket_path: str, the Unix socket of the server instead of a port.
+  Returns:
+    {}, the decoded response.
+  Raises:
+    Error: The server rejected the request.
+  """
+  if socket_path:
+    connection = _UnixHttpConnection(socket_path)
+  else:
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+  try:
+    if request is None:
+      connection.request('GET', path)
+    else:
+      connection.request('POST', path, json.dumps(request),
+                         {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    value = json.loads(response.read())
+  finally:
+    connection.close()
+  if response.status != 200:
+    raise Error(value.get('error', 'HTTP status %d' % response.status))
+  return value
+
+
+def main():
+  parser = optparse.OptionParser(usage='usage: %prog [--port PORT | '
+                                 '--socket PATH]')
+  parser.add_option('--port', type='int', default=_DEFAULT_PORT,
+                    help='Localhost port to listen on (default: %default)')
+  parser.add_option('--socket', metavar='PATH', dest='socket_path',
+                    help='Listen on the Unix socket PATH instead of a port')
+  parser.add_option('--cache-size', type='int', metavar='MB',
+                    default=_DEFAULT_CACHE_SIZE_MB, dest='cache_size',
+                    help=('Estimated memory for keeping parsed heap snapshots '
+                          '(default: %default)'))
+  parser.add_option('--json-backend', type='choice', metavar='LIBRARY',
+                    dest='json_backend',
+                    choices=json_backends.AvailableBackends(),
+                    help=('JSON library for decoding the heap snapshots. '
+                          'Installed: %s' %
+                          ', '.join(json_backends.AvailableBackends())))
+  parser.add_option('-v', '--verbose', action='store_true', default=False,
+                    dest='verbose', help='more verbose output')
+  options = parser.parse_args()[0]
+
+  if options.verbose:
+    logging.basicConfig(level=logging.DEBUG)
+
+  server = CreateServer(
+      AnalysisServer(options.cache_size * 1024 * 1024, options.json_backend),
+      options.port, options.socket_path)
+  logging.info('Serving on %s', options.socket_path or
+               'localhost:%d' % options.port)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests AnalysisServer."""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import analysis_server
+import snapshot_testdata
+
+
+class LruCacheTest(unittest.TestCase):
+
+  def testEviction(self):
+    cache = analysis_server.LruCache(10)
+    cache.Put('a', 1, 4)
+    cache.Put('b', 2, 4)
+    self.assertEqual(1, cache.Get('a'))
+    cache.Put('c', 3, 4)
+    self.assertEqual(None, cache.Get('b'))
+    self.assertEqual(1, cache.Get('a'))
+    self.assertEqual(3, cache.Get('c'))
+    self.assertEqual(8, cache.size)
+
+    cache.Put('d', 4, 11)
+    self.assertEqual(None, cache.Get('d'))
+    self.assertEqual(2, len(cache))
+
+
+class AnalysisServerTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+    self._snapshot = os.path.join(self._directory, 'snapshot.heapsnapshot')
+    with open(self._snapshot, 'w') as f:
+      json.dump(snapshot_testdata.LeakSnapshotData(), f)
+    self._suppressions = os.path.join(self._directory, 'suppressions.txt')
+    self._server = analysis_server.AnalysisServer(1024 * 1024)
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _Request(self, suppressions=None):
+    definition = {'containers': ['lib.container'],
+                  'stacktrace_suffix': '.stack'}
+    if suppressions:
+      definition['suppressions'] = suppressions
+    return {'snapshot': self._snapshot, 'definition': definition}
+
+  def testAnalyze(self):
+    report = self._server.Analyze(self._Request())
+    self.assertEqual(1, len(report['new_leaks']))
+    leak = report['new_leaks'][0]
+    self.assertEqual('Leaked', leak['class_name'])
+    self.assertEqual(['createLeak'], leak['stack'])
+    self.assertEqual(20, leak['retained_size'])
+
+    self._server.Analyze(self._Request())
+    status = self._server.Status()
+    self.assertEqual(1, status['snapshot_misses'])
+    self.assertEqual(1, status['snapshot_hits'])
+    self.assertEqual(1, status['cached_snapshots'])
+
+  def testNodeNamesAreReset(self):
+    nodes = self._server._GetSnapshot(self._snapshot).nodes
+    request = self._Request()
+    other_request = self._Request()
+    other_request['definition']['containers'] = ['lib']
+    other_request['definition']['bad_nodes'] = ['lib.container']
+    for analyzed in (request, other_request):
+      self._server.Analyze(analyzed)
+      self.assertEqual([''] * len(nodes), [node.js_name for node in nodes])
+      self.assertEqual(set([None]), set(getattr(node, 'container_name', None)
+                                        for node in nodes))
+
+  def testInvalidLimits(self):
+    for name, value in (('time_budget', '1'), ('time_budget', -1),
+                        ('max_leaks', 1.5), ('max_leaks', True)):
+      request = self._Request()
+      request[name] = value
+      self.assertRaises(analysis_server.Error, self._server.Analyze, request)
+    request = self._Request()
+    request['time_budget'] = 60
+    request['max_leaks'] = 1
+    self.assertEqual(1, len(self._server.Analyze(request)['new_leaks']))
+
+  def testSuppressionsAreReloaded(self):
+    with open(self._suppressions, 'w') as f:
+      f.write('{\n  Other leak\n  Other\n  createOther\n}\n')
+    report = self._server.Analyze(self._Request(self._suppressions))
+    self.assertEqual(1, len(report['new_leaks']))
+
+    with open(self._suppressions, 'w') as f:
+      f.write('{\n  Known leak\n  Leaked\n  createLeak\n}\n')
+    report = self._server.Analyze(self._Request(self._suppressions))
+    self.assertEqual([], report['new_leaks'])
+    self.assertEqual([{'description': 'Known leak', 'count': 1,
+                       'retained_size': 20}], report['matched_suppressions'])
+    self.assertEqual(1, self._server.Status()['suppression_reloads'])
+
+  def testErrors(self):
+    self.assertRaises(analysis_server.Error, self._server.Analyze, {})
+    self.assertRaises(analysis_server.Error, self._server.Analyze,
+                      {'snapshot': self._snapshot, 'definition': 'unknown'})
+    self.assertRaises(analysis_server.Error, self._server.Analyze,
+                      {'snapshot': os.path.join(self._directory, 'missing'),
+                       'definition': {'containers': ['lib.container']}})
+
+  def testHttp(self):
+    server = analysis_server.CreateServer(self._server, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+      port = server.server_address[1]
+      report = analysis_server.SendRequest('/analyze', self._Request(),
+                                           port=port)
+      self.assertEqual('Leaked', report['new_leaks'][0]['class_name'])
+      self.assertEqual(1, analysis_server.SendRequest('/status',
+                                                      port=port)['requests'])
+      self.assertRaises(analysis_server.Error, analysis_server.SendRequest,
+                        '/analyze', {}, port=port)
+    finally:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Leak checks for test suites which don't stall the tests.
+
+Only taking the heap snapshot needs the application; parsing and analyzing it
+can happen while the next test is already running. The BackgroundLeakChecker
+takes the snapshot synchronously, writes it into a temporary file, and
+analyzes it in a pool of worker processes. The reports are kept per test id
+and can be collected at the end of the suite.
+
+With unittest, mix LeakCheckTestMixin into the test cases:
+
+  CHECKER = background_leakcheck.BackgroundLeakChecker(
+      jsleakcheck.CLOSURE_DISPOSABLE)
+
+  class MyTest(background_leakcheck.LeakCheckTestMixin, unittest.TestCase):
+    leak_checker = CHECKER
+
+    def GetInspectorClient(self):
+      return self.client
+
+    @classmethod
+    def tearDownClass(cls):
+      cls.leak_checker.AssertNoLeaks()
+
+With pytest, register the plugin in conftest.py:
+
+  def pytest_configure(config):
+    config.pluginmanager.register(background_leakcheck.PytestPlugin(
+        CHECKER, lambda item: item.funcargs.get('inspector_client')))
+"""
+
+import concurrent.futures
+import logging
+import os
+import shutil
+import tempfile
+
+import jsleakcheck
+import leak_finder
+
+
+# Analyzing a snapshot needs a multiple of its size in memory, so only few
+# snapshots are analyzed at the same time by default.
+_DEFAULT_MAX_WORKERS = 2
+
+
+class Error(Exception):
+  pass
+
+
+def _AnalyzeSnapshotFile(leak_definition, snapshot_filename, json_backend,
+                         time_budget, max_leaks, keep_snapshot):
+  """Analyzes a heap snapshot file in a worker process.
+
+  Args:
+    leak_definition: jsleakcheck.LeakDefinition, defines what kind of leaks to
+        check.
+    snapshot_filename: str, the heap snapshot file.
+    json_backend: str, the JSON library for decoding the heap snapshot, or
+        None for the fastest installed one.
+    time_budget: float, the number of seconds after which the analysis is
+        stopped, or None for no limit.
+    max_leaks: int, the number of leaks after which the analysis is stopped,
+        or None for no limit.
+    keep_snapshot: bool, if False, the file is removed after the analysis.
+  Returns:
+    {}, the report; see jsleakcheck.JSLeakCheck._BuildReport.
+  Raises:
+    leak_finder.Error: Something went wrong with analyzing the snapshot.
+  """
+  try:
+    checker = jsleakcheck.JSLeakCheck(leak_definition,
+                                      json_backend=json_backend)
+    return checker.AnalyzeFile(snapshot_filename, time_budget, max_leaks)
+  finally:
+    if not keep_snapshot:
+      os.remove(snapshot_filename)
+
+
+class BackgroundLeakChecker(object):
+  """Takes heap snapshots synchronously and analyzes them in the background.
+
+  Attributes:
+    _leak_definition: jsleakcheck.LeakDefinition, defines what kind of leaks
+        to check.
+    _json_backend: str, the JSON library for decoding the heap snapshots, or
+        None for the fastest installed one.
+    _time_budget: float, the analysis time budget per snapshot in seconds, or
+        None for no limit.
+    _max_leaks: int, the number of leaks after which the analysis of a
+        snapshot is stopped, or None for no limit.
+    _snapshot_dir: str, the directory of the snapshot files.
+    _keep_snapshots: bool, if True, the snapshot files are kept.
+    _executor: concurrent.futures.Executor, runs the analyses.
+    _futures: {str -> concurrent.futures.Future}, the analyses by test id, in
+        the order the snapshots were taken.
+  """
+
+  def __init__(self, leak_definition, max_workers=_DEFAULT_MAX_WORKERS,
+               json_backend=None, time_budget=None, max_leaks=None,
+               snapshot_dir=None, executor=None):
+    """Initializes the BackgroundLeakChecker object.
+
+    Args:
+      leak_definition: jsleakcheck.LeakDefinition, defines what kind of leaks
+          to check. It is sent to the worker processes, so the suppressions
+          are read from its suppressions file there.
+      max_workers: int, the number of worker processes.
+      json_backend: str, the JSON library for decoding the heap snapshots (see
+          json_backends), or None for the fastest installed one.
+      time_budget: float, the analysis time budget per snapshot in seconds, or
+          None for no limit.
+      max_leaks: int, the number of leaks after which the analysis of a
+          snapshot is stopped, or None for no limit.
+      snapshot_dir: str, if given, the snapshots are written into this
+          directory and kept. Otherwise they are written into a temporary
+          directory and removed once analyzed.
+      executor: concurrent.futures.Executor, if given, runs the analyses
+          instead of a new process pool.
+    """
+    self._leak_definition = leak_definition
+    self._json_backend = json_backend
+    self._time_budget = time_budget
+    self._max_leaks = max_leaks
+    self._keep_snapshots = snapshot_dir is not None
+    if snapshot_dir is None:
+      snapshot_dir = tempfile.mkdtemp(prefix='leakcheck')
+    elif not os.path.isdir(snapshot_dir):
+      os.makedirs(snapshot_dir)
+    self._snapshot_dir = snapshot_dir
+    self._executor = executor or concurrent.futures.ProcessPoolExecutor(
+        max_workers)
+    self._futures = {}
+
+  def _SnapshotFilename(self, test_id):
+    name = ''.join(c if c.isalnum() or c in '._-' else '_' for c in test_id)
+    return os.path.join(self._snapshot_dir,
+                        '%04d-%s.heapsnapshot' % (len(self._futures), name))
+
+  def Check(self, test_id, inspector_client):
+    """Takes a heap snapshot and starts analyzing it in the background.
+
+    Returns as soon as the snapshot is written into a file.
+
+    Args:
+      test_id: str, the test the snapshot belongs to.
+      inspector_client: RemoteInspectorClient, used to take the snapshot.
+    Raises:
+      Error: The test was already checked.
+    """
+    if test_id in self._futures:
+      raise Error('Test %s was already checked' % test_id)
+    snapshot_filename = self._SnapshotFilename(test_id)
+    logging.info('Taking heap snapshot after %s', test_id)
+    raw_data = inspector_client.HeapSnapshot(include_summary=False)['raw_data']
+    leak_finder.SaveSnapshotFile(raw_data, snapshot_filename)
+    self._futures[test_id] = self._executor.submit(
+        _AnalyzeSnapshotFile, self._leak_definition, snapshot_filename,
+        self._json_backend, self._time_budget, self._max_leaks,
+        self._keep_snapshots)
+
+  def Pending(self):
+    """Returns the ids of the tests whose snapshots are still analyzed."""
+    return [test_id for test_id, future in self._futures.items()
+            if not future.done()]
+
+  def Results(self, wait=True):
+    """Returns the reports of the checked tests.
+
+    Args:
+      wait: bool, if False, only the finished analyses are returned.
+    Returns:
+      {str -> {}}, the reports by test id. The report of a failed analysis is
+          {'error': message}.
+    """
+    results = {}
+    for test_id, future in self._futures.items():
+      if not wait and not future.done():
+        continue
+      try:
+        results[test_id] = future.result()
+      except (leak_finder.Error, IOError, KeyError, ValueError) as e:
+        results[test_id] = {'error': str(e)}
+      except Exception as e:  # pylint: disable=broad-except
+        # Any other failure, e.g., a worker process dying, only fails its
+        # test, so that the results of the others are kept.
+        results[test_id] = {'error': '%s: %s' % (type(e).__name__, e)}
+    return results
+
+  def Leaks(self, wait=True):
+    """Returns the new leaks of the checked tests.
+
+    Args:
+      wait: bool, if False, only the finished analyses are considered.
+    Returns:
+      [(str, {})], the tests with new leaks or failed analyses and their
+          reports, in the order the tests were checked.
+    """
+    return [(test_id, report)
+            for test_id, report in self.Results(wait).items()
+            if report.get('error') or report.get('new_leaks')]
+
+  def AssertNoLeaks(self):
+    """Waits for all analyses and fails if any test leaked.
+
+    Raises:
+      AssertionError: New leaks were found or an analysis failed.
+    """
+    leaks = self.Leaks()
+    if leaks:
+      raise AssertionError(FormatLeaks(leaks))
+
+  def Close(self):
+    """Waits for the analyses, stops the workers and removes the snapshots."""
+    self._executor.shutdown(wait=True)
+    if not self._keep_snapshots:
+      shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+
+
+def FormatLeaks(leaks):
+  """Formats the new leaks of tests for printing.
+
+  Args:
+    leaks: [(str, {})], the test ids and their reports; see
+        BackgroundLeakChecker.Leaks.
+  Returns:
+    str, one paragraph per test.
+  """
+  lines = []
+  for test_id, report in leaks:
+    if report.get('error'):
+      lines.append('%s: leak check failed: %s' % (test_id, report['error']))
+      continue
+    lines.append('%s: %d new leaks' % (test_id, len(report['new_leaks'])))
+    for leak in report['new_leaks']:
+      count = '%d' % leak['count']
+      # The retained sizes are unknown unless the checker computes them.
+      if leak['retained_size'] is not None:
+        count += ', %d bytes' % leak['retained_size']
+      lines.append('  %s (%s) created at %s' % (
+          leak['class_name'], count, ' <- '.join(leak['stack']) or 'unknown'))
+  return '\n'.join(lines)
+
+
+class LeakCheckTestMixin(object):
+  """Checks for leaks after each test of a unittest.TestCase.
+
+  The snapshot is taken in tearDown, after the test's own clean-up; the test
+  class provides the checker and the inspector client.
+
+  Attributes:
+    leak_checker: BackgroundLeakChecker, shared by the tests.
+  """
+
+  leak_checker = None
+
+  def GetInspectorClient(self):
+    """Returns the RemoteInspectorClient of the test, or None to skip."""
+    return None
+
+  def tearDown(self):
+    super(LeakCheckTestMixin, self).tearDown()
+    client = self.GetInspectorClient()
+    if self.leak_checker and client:
+      self.leak_checker.Check(self.id(), client)
+
+
+class PytestPlugin(object):
+  """Checks for leaks after each pytest test.
+
+  The plugin doesn't import pytest; register it with
+  config.pluginmanager.register in conftest.py. The tests with new leaks are
+  listed in the terminal summary and make the session fail.
+
+  Attributes:
+    _checker: BackgroundLeakChecker, analyzes the snapshots.
+    _get_client: function(item), returns the RemoteInspectorClient of a test
+        item, or None to skip it.
+  """
+
+  def __init__(self, checker, get_client):
+    self._checker = checker
+    self._get_client = get_client
+
+  def pytest_runtest_teardown(self, item):
+    client = self._get_client(item)
+    if client:
+      self._checker.Check(item.nodeid, client)
+
+  def pytest_sessionfinish(self, session, exitstatus):
+    if self._checker.Leaks() and not exitstatus:
+      session.exitstatus = 1
+
+  def pytest_terminal_summary(self, terminalreporter):
+    leaks = self._checker.Leaks()
+    if leaks:
+      terminalreporter.section('JavaScript leaks')
+      terminalreporter.write_line(FormatLeaks(leaks))
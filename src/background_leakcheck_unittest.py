@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests BackgroundLeakChecker."""
+
+import concurrent.futures
+import concurrent.futures.process
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import background_leakcheck
+import jsleakcheck
+import snapshot_testdata
+
+
+class FakeInspectorClient(object):
+  """Returns a fixed heap snapshot."""
+
+  def __init__(self, leaking):
+    self.leaking = leaking
+
+  def HeapSnapshot(self, **unused_kwargs):
+    """Returns a snapshot with or without a leak."""
+    data = snapshot_testdata.LeakSnapshotData(leaking=self.leaking)
+    return {'raw_data': json.dumps(data)}
+
+
+class FailingExecutor(object):
+  """Fails the analyses with the given exceptions, in turn."""
+
+  def __init__(self, exceptions):
+    self.exceptions = list(exceptions)
+
+  def submit(self, *unused_args):
+    future = concurrent.futures.Future()
+    future.set_exception(self.exceptions.pop(0))
+    return future
+
+  def shutdown(self, wait=True):
+    pass
+
+
+class BackgroundLeakCheckerTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+    self._definition = jsleakcheck.LeakDefinition(
+        containers=['lib.container'], stacktrace_suffix='.stack')
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def testResultsByTest(self):
+    checker = background_leakcheck.BackgroundLeakChecker(self._definition,
+                                                         max_workers=1)
+    try:
+      checker.Check('test.Leaking', FakeInspectorClient(True))
+      checker.Check('test.Clean', FakeInspectorClient(False))
+      self.assertRaises(background_leakcheck.Error, checker.Check,
+                        'test.Clean', FakeInspectorClient(False))
+      results = checker.Results()
+      self.assertEqual([], checker.Pending())
+    finally:
+      checker.Close()
+    self.assertEqual(['test.Leaking', 'test.Clean'], list(results))
+    self.assertEqual([], results['test.Clean']['new_leaks'])
+    leak = results['test.Leaking']['new_leaks'][0]
+    self.assertEqual('Leaked', leak['class_name'])
+    self.assertEqual(['createLeak'], leak['stack'])
+    self.assertEqual([('test.Leaking', results['test.Leaking'])],
+                     checker.Leaks())
+
+  def testFailedAnalyses(self):
+    checker = background_leakcheck.BackgroundLeakChecker(
+        self._definition, executor=FailingExecutor([
+            MemoryError(),
+            concurrent.futures.process.BrokenProcessPool('Worker died'),
+            ValueError('Snapshot too short')]))
+    try:
+      for test_id in ('test.a', 'test.b', 'test.c'):
+        checker.Check(test_id, FakeInspectorClient(False))
+      results = checker.Results()
+    finally:
+      checker.Close()
+    self.assertEqual({'test.a': {'error': 'MemoryError: '},
+                      'test.b': {'error': 'BrokenProcessPool: Worker died'},
+                      'test.c': {'error': 'Snapshot too short'}}, results)
+    self.assertRaises(AssertionError, checker.AssertNoLeaks)
+
+  def testKeepSnapshots(self):
+    checker = background_leakcheck.BackgroundLeakChecker(
+        self._definition, max_workers=1, snapshot_dir=self._directory)
+    checker.Check('test/Leaking', FakeInspectorClient(True))
+    checker.Close()
+    self.assertEqual(['0000-test_Leaking.heapsnapshot'],
+                     os.listdir(self._directory))
+    self.assertRaises(AssertionError, checker.AssertNoLeaks)
+
+  def testMixin(self):
+    checker = background_leakcheck.BackgroundLeakChecker(self._definition,
+                                                         max_workers=1)
+
+    class AppTest(background_leakcheck.LeakCheckTestMixin, unittest.TestCase):
+      leak_checker = checker
+
+      def GetInspectorClient(self):
+        return FakeInspectorClient(self._testMethodName == 'testLeaking')
+
+      def testLeaking(self):
+        pass
+
+      def testClean(self):
+        pass
+
+    try:
+      result = unittest.TestResult()
+      unittest.defaultTestLoader.loadTestsFromTestCase(AppTest).run(result)
+      self.assertTrue(result.wasSuccessful())
+      leaks = checker.Leaks()
+    finally:
+      checker.Close()
+    self.assertEqual(1, len(leaks))
+    self.assertTrue(leaks[0][0].endswith('AppTest.testLeaking'))
+    self.assertIn('Leaked (1, 20 bytes) created at createLeak',
+                  background_leakcheck.FormatLeaks(leaks))
+
+  def testFormatLeaksWithoutRetainedSize(self):
+    leaks = [('test/a', {'new_leaks': [{'class_name': 'Leaked', 'count': 2,
+                                        'retained_size': None,
+                                        'stack': []}]}),
+             ('test/b', {'error': 'Snapshot too short'})]
+    self.assertEqual('test/a: 1 new leaks\n'
+                     '  Leaked (2) created at unknown\n'
+                     'test/b: leak check failed: Snapshot too short',
+                     background_leakcheck.FormatLeaks(leaks))
+
+
+if __name__ == '__main__':
+  unittest.main()
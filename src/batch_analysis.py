@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Analyzes a directory of saved heap snapshots in parallel.
+
+The snapshots are analyzed in a pool of worker processes. Parsing a snapshot
+needs many times its size in memory, so the number of snapshots analyzed at
+the same time is limited by an estimate of their memory use as well as by the
+number of workers: the largest snapshots are started first, and a snapshot is
+only started if its estimate fits into what the running ones leave free.
+
+The report of each snapshot is written into the output directory, under the
+same relative path with a .json extension, together with a key identifying the
+snapshot version, the leak definition and the suppressions. When the batch is
+run again, the snapshots whose reports are current are not analyzed again.
+
+Used by jsleakcheck --batch.
+"""
+
+import concurrent.futures
+import concurrent.futures.process
+import json
+import logging
+import os
+
+import jsleakcheck
+import leak_finder
+
+
+_SNAPSHOT_EXTENSIONS = ('.heapsnapshot', '.heapsnapshot.gz',
+                        '.heapsnapshot.bz2', '.heapsnapshot.xz',
+                        '.heapsnapshot.lzma')
+
+# Rough memory use of the analysis per byte of the snapshot file. Compressed
+# snapshots are assumed to be compressed to an eighth of their size.
+_MEMORY_PER_BYTE = 20
+_MEMORY_PER_COMPRESSED_BYTE = _MEMORY_PER_BYTE * 8
+
+# The share of the physical memory used by default.
+_DEFAULT_MEMORY_SHARE = 0.5
+
+_REPORT_EXTENSION = '.json'
+
+
+def FindSnapshots(directory):
+  """Returns the heap snapshot files in a directory and its subdirectories.
+
+  Args:
+    directory: str, the directory.
+  Returns:
+    [str], the paths of the snapshots relative to directory, sorted.
+  """
+  snapshots = []
+  for dirpath, _, filenames in os.walk(directory):
+    for filename in filenames:
+      if filename.endswith(_SNAPSHOT_EXTENSIONS):
+        snapshots.append(os.path.relpath(os.path.join(dirpath, filename),
+                                         directory))
+  return sorted(snapshots)
+
+
+def EstimateMemory(filename):
+  """Estimates how much memory analyzing a snapshot file needs.
+
+  Args:
+    filename: str, the snapshot file.
+  Returns:
+    int, the estimate in bytes.
+  """
+  size = os.path.getsize(filename)
+  if filename.endswith('.heapsnapshot'):
+    return size * _MEMORY_PER_BYTE
+  return size * _MEMORY_PER_COMPRESSED_BYTE
+
+
+def DefaultMemoryLimit():
+  """Returns the default memory limit in bytes, or None if it is unknown."""
+  try:
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+  except (AttributeError, ValueError, OSError):
+    return None
+  return int(physical * _DEFAULT_MEMORY_SHARE)
+
+
+def _DefinitionArgs(leak_definition):
+  """Returns the arguments recreating a LeakDefinition in a worker."""
+  return {'description': leak_definition.description,
+          'suppression_filename': leak_definition.suppressions,
+          'containers': leak_definition.containers,
+          'bad_nodes': leak_definition.bad_nodes,
+          'stacktrace_prefix': leak_definition.stacktrace_prefix,
+          'stacktrace_suffix': leak_definition.stacktrace_suffix}
+
+
+def _AnalyzeSnapshotFile(definition_args, checker_args, snapshot_filename,
+                         time_budget, max_leaks):
+  """Analyzes a heap snapshot file in a worker process.
+
+  Args:
+    definition_args: {}, the arguments of the LeakDefinition.
+    checker_args: {}, the keyword arguments of the JSLeakCheck.
+    snapshot_filename: str, the heap snapshot file.
+    time_budget: float, the analysis time budget in seconds, or None.
+    max_leaks: int, the leak limit of the analysis, or None.
+  Returns:
+    {}, the report; see jsleakcheck.JSLeakCheck._BuildReport.
+  Raises:
+    leak_finder.Error: Something went wrong with analyzing the snapshot.
+  """
+  checker = jsleakcheck.JSLeakCheck(
+      jsleakcheck.LeakDefinition(**definition_args), **checker_args)
+  return checker.AnalyzeFile(snapshot_filename, time_budget, max_leaks)
+
+
+class BatchAnalyzer(object):
+  """Analyzes many heap snapshots with the same leak definition.
+
+  Attributes:
+    _definition_args: {}, the arguments of the LeakDefinition.
+    _checker: jsleakcheck.JSLeakCheck, computes the report keys.
+    _output_dir: str, the directory of the per-file reports.
+    _max_workers: int, the number of worker processes.
+    _memory_limit: int, the memory the analyses running at the same time may
+        use in bytes, or None for no limit.
+    _checker_args: {}, the keyword arguments of the JSLeakCheck of each
+        analysis.
+    _time_budget: float, the analysis time budget per snapshot in seconds.
+    _max_leaks: int, the leak limit per snapshot.
+    _executor: concurrent.futures.Executor, runs the analyses, or None for a
+        new process pool.
+  """
+
+  def __init__(self, leak_definition, output_dir, max_workers=None,
+               memory_limit=None, json_backend=None, time_budget=None,
+               max_leaks=None, executor=None, prune_snapshot=False,
+               sample_size=None, retaining_paths=None):
+    """Initializes the BatchAnalyzer object.
+
+    Args:
+      leak_definition: jsleakcheck.LeakDefinition, defines what kind of leaks
+          to check.
+      output_dir: str, the directory of the per-file reports. It is created
+          if needed.
+      max_workers: int, the number of worker processes, or None for the number
+          of processors.
+      memory_limit: int, the memory the analyses running at the same time may
+          use in bytes, or None for no limit. A snapshot whose estimate alone
+          exceeds the limit is analyzed when nothing else is running.
+      json_backend: str, the JSON library for decoding the heap snapshots (see
+          json_backends), or None for the fastest installed one.
+      time_budget: float, the analysis time budget per snapshot in seconds, or
+          None for no limit.
+      max_leaks: int, the leak limit per snapshot, or None for no limit.
+      executor: concurrent.futures.Executor, if given, runs the analyses
+          instead of a new process pool.
+      prune_snapshot: bool, see jsleakcheck.JSLeakCheck.
+      sample_size: int, see jsleakcheck.JSLeakCheck.
+      retaining_paths: int, see jsleakcheck.JSLeakCheck.
+    """
+    self._definition_args = _DefinitionArgs(leak_definition)
+    self._checker_args = {'json_backend': json_backend,
+                          'prune_snapshot': prune_snapshot,
+                          'sample_size': sample_size,
+                          'retaining_paths': retaining_paths}
+    self._checker = jsleakcheck.JSLeakCheck(leak_definition,
+                                            **self._checker_args)
+    self._output_dir = output_dir
+    self._max_workers = max_workers or os.cpu_count() or 1
+    self._memory_limit = memory_limit
+    self._time_budget = time_budget
+    self._max_leaks = max_leaks
+    self._executor = executor
+    if not os.path.isdir(output_dir):
+      os.makedirs(output_dir)
+
+  def _ReportPath(self, snapshot):
+    return os.path.join(self._output_dir, snapshot + _REPORT_EXTENSION)
+
+  def _ReportKey(self, filename):
+    """Returns the key of the report of a snapshot file.
+
+    The snapshot is identified by its size and modification time, so that
+    checking whether a report is current doesn't need to read the snapshot.
+    """
+    stat = os.stat(filename)
+    return self._checker.ResultKey('%d:%d' % (stat.st_size, stat.st_mtime_ns),
+                                   self._max_leaks)
+
+  def _CurrentReport(self, snapshot, key):
+    """Returns the stored report of a snapshot if it is current, or None."""
+    try:
+      with open(self._ReportPath(snapshot)) as f:
+        stored = json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+    if stored.get('key') != key:
+      return None
+    return stored.get('report')
+
+  def _WriteReport(self, snapshot, key, report):
+    path = self._ReportPath(snapshot)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      json.dump({'snapshot': snapshot, 'key': key, 'report': report}, f)
+
+  def _NextSnapshot(self, pending, used_memory):
+    """Chooses the next snapshot to analyze.
+
+    Args:
+      pending: [(int, str)], the memory estimates and the snapshots not yet
+          started, largest first.
+      used_memory: int, the estimated memory use of the running analyses.
+    Returns:
+      int, the index of the snapshot in pending, or None if none fits.
+    """
+    for ix, (estimate, _) in enumerate(pending):
+      if (self._memory_limit is None or not used_memory or
+          used_memory + estimate <= self._memory_limit):
+        return ix
+    return None
+
+  def Run(self, directory):
+    """Analyzes the snapshots in a directory.
+
+    Args:
+      directory: str, the directory; its subdirectories are included.
+    Returns:
+      {str -> {}}, the per-file results by the relative path of the snapshot,
+          with the keys 'report' (the report or None) and either 'skipped'
+          (True if the report was current) or 'error' (why the analysis
+          failed).
+    """
+    results = {}
+    pending = []
+    keys = {}
+    for snapshot in FindSnapshots(directory):
+      filename = os.path.join(directory, snapshot)
+      keys[snapshot] = self._ReportKey(filename)
+      report = self._CurrentReport(snapshot, keys[snapshot])
+      if report is not None:
+        logging.info('The report of %s is current', snapshot)
+        results[snapshot] = {'report': report, 'skipped': True}
+      else:
+        pending.append((EstimateMemory(filename), snapshot))
+    pending.sort(key=lambda item: item[0], reverse=True)
+
+    executor = self._executor or concurrent.futures.ProcessPoolExecutor(
+        self._max_workers)
+    running = {}
+    used_memory = 0
+    # Whether a worker process died; the pool is rebuilt once the analyses
+    # running in it have failed.
+    broken = False
+    try:
+      while pending or running:
+        while pending and not broken and len(running) < self._max_workers:
+          ix = self._NextSnapshot(pending, used_memory)
+          if ix is None:
+            break
+          estimate, snapshot = pending.pop(ix)
+          logging.info('Analyzing %s', snapshot)
+          try:
+            future = executor.submit(
+                _AnalyzeSnapshotFile, self._definition_args,
+                self._checker_args, os.path.join(directory, snapshot),
+                self._time_budget, self._max_leaks)
+          except concurrent.futures.process.BrokenProcessPool as e:
+            logging.error('Cannot analyze %s: %s', snapshot, e)
+            results[snapshot] = {'report': None, 'error': str(e)}
+            continue
+          running[future] = (estimate, snapshot)
+          used_memory += estimate
+        if not running:
+          continue
+        done, _ = concurrent.futures.wait(
+            running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          estimate, snapshot = running.pop(future)
+          used_memory -= estimate
+          try:
+            report = future.result()
+          except concurrent.futures.process.BrokenProcessPool as e:
+            # A worker process died, e.g., killed for using too much memory,
+            # which fails all the analyses running in the pool.
+            logging.error('Cannot analyze %s: %s', snapshot, e)
+            results[snapshot] = {'report': None, 'error': str(e)}
+            broken = True
+            continue
+          except (leak_finder.Error, IOError, KeyError, ValueError) as e:
+            logging.error('Cannot analyze %s: %s', snapshot, e)
+            results[snapshot] = {'report': None, 'error': str(e)}
+            continue
+          except Exception as e:  # pylint: disable=broad-except
+            # Any other failure, e.g., MemoryError, only fails its snapshot,
+            # so that the results of the others are kept.
+            error = '%s: %s' % (type(e).__name__, e)
+            logging.error('Cannot analyze %s: %s', snapshot, error)
+            results[snapshot] = {'report': None, 'error': error}
+            continue
+          # Partial results depend on the timing, so they are not stored.
+          if not report['stop_reason']:
+            self._WriteReport(snapshot, keys[snapshot], report)
+          results[snapshot] = {'report': report, 'skipped': False}
+        if broken and not running:
+          broken = False
+          # A passed-in executor is the caller's to replace.
+          if not self._executor:
+            executor.shutdown(wait=False)
+            executor = concurrent.futures.ProcessPoolExecutor(
+                self._max_workers)
+    finally:
+      if not self._executor:
+        executor.shutdown()
+    return dict(sorted(results.items()))
+
+
+def AggregateResults(results):
+  """Combines the per-file results of a batch into one report.
+
+  The same leak (class and stack trace) found in several snapshots is listed
+  once, with the snapshots it was found in.
+
+  Args:
+    results: {str -> {}}, the per-file results; see BatchAnalyzer.Run.
+  Returns:
+    {}, the aggregated report, with the keys:
+        'snapshots': int, the number of snapshots.
+        'skipped': int, the number of snapshots whose reports were current.
+        'errors': {str -> str}, why the failed analyses failed, by snapshot.
+        'matched_suppressions': [{}], with the keys 'description', 'count',
+            'retained_size' and 'snapshots'.
+        'new_leaks': [{}], with the keys 'class_name', 'stack', 'count',
+            'retained_size' and 'snapshots'.
+        Both lists are sorted by the number of bytes retained.
+  """
+  matched = {}
+  new_leaks = {}
+  errors = {}
+  for snapshot, result in sorted(results.items()):
+    if result.get('error'):
+      errors[snapshot] = result['error']
+      continue
+    report = result['report']
+    for match in report['matched_suppressions']:
+      total = matched.setdefault(match['description'], {
+          'description': match['description'], 'count': 0,
+          'retained_size': 0, 'snapshots': []})
+      total['count'] += match['count']
+      total['retained_size'] += match['retained_size'] or 0
+      total['snapshots'].append(snapshot)
+    for leak in report['new_leaks']:
+      total = new_leaks.setdefault(
+          (leak['class_name'], tuple(leak['stack'])), {
+              'class_name': leak['class_name'], 'stack': leak['stack'],
+              'count': 0, 'retained_size': 0, 'snapshots': []})
+      total['count'] += leak['count']
+      total['retained_size'] += leak['retained_size'] or 0
+      total['snapshots'].append(snapshot)
+
+  def BySize(items):
+    return sorted(items, key=lambda item: (item['retained_size'],
+                                           item['count']),
+                  reverse=True)
+
+  return {'snapshots': len(results),
+          'skipped': len([result for result in results.values()
+                          if result.get('skipped')]),
+          'errors': errors,
+          'matched_suppressions': BySize(matched.values()),
+          'new_leaks': BySize(new_leaks.values())}
+
+
+def PrintBatchReport(results, aggregated):
+  """Prints the per-file results and the aggregated report of a batch.
+
+  Args:
+    results: {str -> {}}, the per-file results; see BatchAnalyzer.Run.
+    aggregated: {}, the aggregated report; see AggregateResults.
+  """
+  print('Analyzed %d snapshots (%d reports were current):' % (
+      aggregated['snapshots'], aggregated['skipped']))
+  for snapshot, result in sorted(results.items()):
+    if result.get('error'):
+      print(' %s: failed: %s' % (snapshot, result['error']))
+      continue
+    report = result['report']
+    partial = ''
+    if report['stop_reason']:
+      partial = ' (partial: %s)' % report['stop_reason']
+    print(' %s: %d new leaks, %d suppressed%s' % (
+        snapshot, sum(leak['count'] for leak in report['new_leaks']),
+        sum(match['count'] for match in report['matched_suppressions']),
+        partial))
+  print('')
+
+  if aggregated['new_leaks']:
+    print('New memory leaks found:')
+    for leak in aggregated['new_leaks']:
+      print('Leak: %d %s (%d bytes retained) in %d snapshots' % (
+          leak['count'], leak['class_name'], leak['retained_size'],
+          len(leak['snapshots'])))
+      print('allocated at:')
+      print('  ' + '\n  '.join(leak['stack']))
+      print('found in:')
+      print('  ' + '\n  '.join(leak['snapshots']))
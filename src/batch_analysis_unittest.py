@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests BatchAnalyzer."""
+
+import concurrent.futures
+import concurrent.futures.process
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch_analysis
+import jsleakcheck
+import progress
+import snapshot_testdata
+
+
+class FailingExecutor(object):
+  """Runs the analyses in this process, but the first one fails."""
+
+  def __init__(self, exception):
+    self.calls = 0
+    self.exception = exception
+
+  def submit(self, fn, *args):
+    self.calls += 1
+    future = concurrent.futures.Future()
+    if self.calls == 1:
+      future.set_exception(self.exception)
+    else:
+      future.set_result(fn(*args))
+    return future
+
+
+class BatchAnalyzerTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+    self._snapshots = os.path.join(self._directory, 'snapshots')
+    self._output = os.path.join(self._directory, 'results')
+    os.makedirs(os.path.join(self._snapshots, 'app'))
+    self._definition = jsleakcheck.LeakDefinition(
+        containers=['lib.container'], stacktrace_suffix='.stack')
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _WriteSnapshot(self, name, leaking):
+    """Helper for creating a heap snapshot file.
+
+    Args:
+      name: str, the file name relative to the snapshot directory.
+      leaking: bool, if False, the array is empty.
+    """
+    with open(os.path.join(self._snapshots, name), 'w') as f:
+      json.dump(snapshot_testdata.LeakSnapshotData(leaking=leaking), f)
+
+  def testRun(self):
+    self._WriteSnapshot('a.heapsnapshot', True)
+    self._WriteSnapshot(os.path.join('app', 'b.heapsnapshot'), True)
+    self._WriteSnapshot(os.path.join('app', 'c.heapsnapshot'), False)
+    self._WriteSnapshot('ignored.json', True)
+
+    analyzer = batch_analysis.BatchAnalyzer(self._definition, self._output,
+                                            max_workers=2)
+    results = analyzer.Run(self._snapshots)
+    self.assertEqual(['a.heapsnapshot', 'app/b.heapsnapshot',
+                      'app/c.heapsnapshot'], list(results))
+    self.assertFalse(any(result['skipped'] for result in results.values()))
+    self.assertEqual([], results['app/c.heapsnapshot']['report']['new_leaks'])
+    self.assertTrue(os.path.exists(
+        os.path.join(self._output, 'app', 'b.heapsnapshot.json')))
+
+    aggregated = batch_analysis.AggregateResults(results)
+    self.assertEqual(3, aggregated['snapshots'])
+    self.assertEqual([{'class_name': 'Leaked', 'stack': ['createLeak'],
+                       'count': 2, 'retained_size': 40,
+                       'snapshots': ['a.heapsnapshot', 'app/b.heapsnapshot']}],
+                     aggregated['new_leaks'])
+
+    # Only the changed snapshot is analyzed again.
+    self._WriteSnapshot('a.heapsnapshot', False)
+    os.utime(os.path.join(self._snapshots, 'a.heapsnapshot'), (1, 1))
+    results = analyzer.Run(self._snapshots)
+    self.assertEqual(
+        {'a.heapsnapshot': False, 'app/b.heapsnapshot': True,
+         'app/c.heapsnapshot': True},
+        dict((snapshot, result['skipped'])
+             for snapshot, result in results.items()))
+    self.assertEqual(1, batch_analysis.AggregateResults(
+        results)['new_leaks'][0]['count'])
+
+  def testNextSnapshotRespectsMemoryLimit(self):
+    analyzer = batch_analysis.BatchAnalyzer(self._definition, self._output,
+                                            memory_limit=100)
+    pending = [(150, 'huge'), (60, 'large'), (30, 'small')]
+    # Anything can run alone.
+    self.assertEqual(0, analyzer._NextSnapshot(pending, 0))
+    self.assertEqual(1, analyzer._NextSnapshot(pending, 40))
+    self.assertEqual(2, analyzer._NextSnapshot(pending, 70))
+    self.assertEqual(None, analyzer._NextSnapshot(pending, 80))
+
+  def testFailedAnalysis(self):
+    with open(os.path.join(self._snapshots, 'broken.heapsnapshot'), 'w') as f:
+      f.write('{"snapshot": {}}')
+    analyzer = batch_analysis.BatchAnalyzer(self._definition, self._output,
+                                            max_workers=1)
+    results = analyzer.Run(self._snapshots)
+    self.assertTrue(results['broken.heapsnapshot']['error'])
+    self.assertEqual(['broken.heapsnapshot'],
+                     list(batch_analysis.AggregateResults(results)['errors']))
+
+  def testWorkerFailed(self):
+    self._WriteSnapshot('a.heapsnapshot', True)
+    self._WriteSnapshot('b.heapsnapshot', True)
+    for exception, error in (
+        (concurrent.futures.process.BrokenProcessPool(
+            'A process in the process pool was terminated abruptly'),
+         'terminated abruptly'),
+        (MemoryError(), 'MemoryError'),
+        (progress.Cancelled('The analysis was cancelled'), 'cancelled')):
+      analyzer = batch_analysis.BatchAnalyzer(
+          self._definition, os.path.join(self._output, error), max_workers=1,
+          executor=FailingExecutor(exception))
+      results = analyzer.Run(self._snapshots)
+      self.assertIn(error, results['a.heapsnapshot']['error'])
+      self.assertEqual(1,
+                       len(results['b.heapsnapshot']['report']['new_leaks']))
+      self.assertEqual(['a.heapsnapshot'], list(
+          batch_analysis.AggregateResults(results)['errors']))
+
+  def testAnalysisOptions(self):
+    self._WriteSnapshot('a.heapsnapshot', True)
+    analyzer = batch_analysis.BatchAnalyzer(self._definition, self._output,
+                                            max_workers=1, sample_size=1,
+                                            retaining_paths=1)
+    report = analyzer.Run(self._snapshots)['a.heapsnapshot']['report']
+    self.assertEqual(['Leaked'], [estimate['class_name']
+                                  for estimate in report['estimates']])
+    self.assertEqual(1, len(report['new_leaks'][0]['retaining_paths']))
+
+
+if __name__ == '__main__':
+  unittest.main()
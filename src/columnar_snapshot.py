@@ -0,0 +1,1423 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Disk-backed analysis of heap snapshots larger than the memory.
+
+Snapshotter constructs a Node and an Edge object per snapshot entry, which
+needs many times the size of the snapshot in memory. Here the snapshot is
+instead converted into column files, one per node and edge field, which are
+memory mapped; the operating system keeps in memory only the parts in use.
+
+The column directory contains:
+  node_type, node_name, node_id, self_size: the node fields, by node index.
+  edge_start: the index of the first edge of each node, and the edge count.
+  edge_type, edge_name, edge_to: the edge fields; edge_to is a node index.
+  retainer_start, retainer_node: the reverse index in the compressed sparse
+      row layout; the retainers of node i are retainer_node[retainer_start[i]:
+      retainer_start[i + 1]]. Only the edges included in the analysis are
+      indexed (see leak_finder.UNINTERESTING_NODE_TYPES).
+  strings, string_offsets: the string table, not decoded.
+  meta.json: the counts, the types, and the size and modification time of
+      the snapshot the columns were built from. It is written last.
+
+The columns are built in one streaming pass over the snapshot, plus passes
+over the edge columns for the reverse index. The reverse index is filled for
+a range of nodes at a time, so that the writes stay within a bounded region.
+An uncompressed snapshot can instead be converted by several processes: the
+node and edge arrays are split into ranges of whole rows which are decoded
+in parallel straight into the shared, memory mapped columns, and the reverse
+index is built by a parallel counting sort.
+
+ColumnarLeakFinder classifies the container elements without following
+retaining paths backwards one element at a time. Instead, the nodes retained
+by a good path are found by a breadth first search from the Window objects and
+the unretained nodes which doesn't enter the bad stop nodes; the elements not
+found are the leaks. Each level of the search is processed in node order, so
+the edge columns are read mostly sequentially. Unlike LeakFinder, the length
+of the retaining paths is not limited.
+
+Example:
+
+  snapshot = columnar_snapshot.OpenColumns('huge.heapsnapshot', '/tmp/huge')
+  finder = columnar_snapshot.ColumnarLeakFinder(['goog.events.listeners_'],
+                                                ['goog.events'], '', '')
+  leaks = list(finder.FindLeaks(snapshot))
+"""
+
+import array
+import bisect
+import concurrent.futures
+import itertools
+import json
+import mmap
+import os
+import time
+
+import json_backends
+import leak_finder
+
+
+_FORMAT_VERSION = 1
+
+_META_FILENAME = 'meta.json'
+
+# The node columns and their array typecodes.
+_NODE_COLUMNS = (('node_type', 'b'), ('node_name', 'q'), ('node_id', 'q'),
+                 ('self_size', 'q'))
+_EDGE_COLUMNS = (('edge_type', 'b'), ('edge_name', 'q'), ('edge_to', 'q'))
+
+# The maximum number of reverse index entries filled in one pass over the
+# edges.
+_PARTITION_SIZE = 1 << 24
+
+# The number of bytes of the node and edge arrays decoded by one task when
+# building the columns in parallel. The arrays are split into many more ranges
+# than there are workers, so that the ranges are spread evenly over them.
+_RANGE_SIZE = 1 << 22
+
+# The number of bytes of the snapshot a task counts or parses at a time, which
+# bounds the memory of a worker.
+_CHUNK_SIZE = 1 << 16
+
+# The edge types whose name is an index instead of a string.
+_INDEX_EDGE_TYPES = ('element', 'hidden')
+
+
+class Error(Exception):
+  pass
+
+
+class _ColumnWriter(object):
+  """Appends integers to a column file."""
+
+  def __init__(self, directory, name, typecode):
+    self._file = open(os.path.join(directory, name), 'wb')
+    self._typecode = typecode
+
+  def Append(self, values):
+    array.array(self._typecode, values).tofile(self._file)
+
+  def Close(self):
+    self._file.close()
+
+
+def _FieldIndex(field_name, fields):
+  """Returns the index of a field in the snapshot meta information.
+
+  Raises:
+    Error: The field is missing.
+  """
+  if field_name not in fields:
+    raise Error('Cannot find field %s from the snapshot' % field_name)
+  return fields.index(field_name)
+
+
+def _Rows(chunks, field_count):
+  """Splits arrays streamed in chunks into whole rows.
+
+  Args:
+    chunks: iterable of [int], the array in consecutive parts.
+    field_count: int, the number of fields per row.
+  Yields:
+    [int], the next whole rows.
+  Raises:
+    Error: The array doesn't consist of whole rows.
+  """
+  pending = []
+  for values in chunks:
+    if pending:
+      values = pending + values
+    end = len(values) - len(values) % field_count
+    pending = values[end:]
+    if end:
+      yield values[:end]
+  if pending:
+    raise Error('Snapshot array too short')
+
+
+def _SourceVersion(snapshot_filename):
+  """Identifies the version of a snapshot file by its size and mtime."""
+  stat = os.stat(snapshot_filename)
+  return [stat.st_size, stat.st_mtime_ns]
+
+
+def _NodeLayout(meta):
+  """Describes where the node columns are in the rows of the nodes array.
+
+  Args:
+    meta: {}, the meta information of the snapshot.
+  Returns:
+    {}, with the keys:
+        'field_count': int, the number of fields per node.
+        'indices': [int], the field of each of _NODE_COLUMNS, or None for
+            the sizes if the snapshot doesn't contain them.
+        'edges_ix': int, the edge_count or edges_index field.
+        'edge_count_format': bool, whether the nodes have edge counts rather
+            than edge indices.
+        'edge_field_count': int, the number of fields per edge.
+  Raises:
+    Error: A field is missing.
+  """
+  node_fields = meta['node_fields']
+  indices = [_FieldIndex(name, node_fields) for name in ('type', 'name', 'id')]
+  indices.append(None)
+  if 'self_size' in node_fields:
+    indices[3] = node_fields.index('self_size')
+  edge_count_format = 'edges_index' not in node_fields
+  if edge_count_format:
+    edges_ix = _FieldIndex('edge_count', node_fields)
+  else:
+    edges_ix = node_fields.index('edges_index')
+  return {'field_count': len(node_fields), 'indices': indices,
+          'edges_ix': edges_ix, 'edge_count_format': edge_count_format,
+          'edge_field_count': len(meta['edge_fields'])}
+
+
+def _EdgeLayout(meta):
+  """Describes where the edge columns are in the rows of the edges array.
+
+  Args:
+    meta: {}, the meta information of the snapshot.
+  Returns:
+    {}, with the keys:
+        'field_count': int, the number of fields per edge.
+        'indices': [int], the field of each of _EDGE_COLUMNS.
+        'node_field_count': int, the number of fields per node.
+  Raises:
+    Error: A field is missing.
+  """
+  edge_fields = meta['edge_fields']
+  return {'field_count': len(edge_fields),
+          'indices': [_FieldIndex(name, edge_fields)
+                      for name in ('type', 'name_or_index', 'to_node')],
+          'node_field_count': len(meta['node_fields'])}
+
+
+def _WriteNodeColumns(directory, meta, chunks):
+  """Writes the node columns.
+
+  Args:
+    directory: str, the column directory.
+    meta: {}, the meta information of the snapshot.
+    chunks: iterable of [int], the nodes array in consecutive parts.
+  Returns:
+    int, the number of nodes.
+  """
+  layout = _NodeLayout(meta)
+  field_count = layout['field_count']
+  edge_field_count = layout['edge_field_count']
+  edges_ix = layout['edges_ix']
+
+  writers = [_ColumnWriter(directory, name, typecode)
+             for name, typecode in _NODE_COLUMNS]
+  edge_start = _ColumnWriter(directory, 'edge_start', 'q')
+  node_count = 0
+  edge_total = 0
+  try:
+    for rows in _Rows(chunks, field_count):
+      row_count = len(rows) // field_count
+      node_count += row_count
+      for writer, ix in zip(writers, layout['indices']):
+        if ix is None:
+          writer.Append([0] * row_count)
+        else:
+          writer.Append(rows[ix::field_count])
+      if layout['edge_count_format']:
+        starts = []
+        for edge_count in rows[edges_ix::field_count]:
+          starts.append(edge_total)
+          edge_total += edge_count
+      else:
+        starts = [start // edge_field_count
+                  for start in rows[edges_ix::field_count]]
+      edge_start.Append(starts)
+  finally:
+    for writer in writers + [edge_start]:
+      writer.Close()
+  return node_count
+
+
+def _WriteEdgeColumns(directory, meta, chunks):
+  """Writes the edge columns and the edge count at the end of edge_start.
+
+  Args:
+    directory: str, the column directory.
+    meta: {}, the meta information of the snapshot.
+    chunks: iterable of [int], the edges array in consecutive parts.
+  Returns:
+    int, the number of edges.
+  """
+  layout = _EdgeLayout(meta)
+  field_count = layout['field_count']
+  node_field_count = layout['node_field_count']
+  indices = layout['indices']
+  writers = [_ColumnWriter(directory, name, typecode)
+             for name, typecode in _EDGE_COLUMNS]
+  edge_count = 0
+  try:
+    for rows in _Rows(chunks, field_count):
+      edge_count += len(rows) // field_count
+      writers[0].Append(rows[indices[0]::field_count])
+      writers[1].Append(rows[indices[1]::field_count])
+      writers[2].Append([to_node // node_field_count
+                         for to_node in rows[indices[2]::field_count]])
+  finally:
+    for writer in writers:
+      writer.Close()
+  with open(os.path.join(directory, 'edge_start'), 'ab') as f:
+    array.array('q', [edge_count]).tofile(f)
+  return edge_count
+
+
+def _WriteStrings(directory, strings):
+  """Writes the string table without decoding it.
+
+  Args:
+    directory: str, the column directory.
+    strings: iterable of bytes, the contents of the strings.
+  """
+  offsets = _ColumnWriter(directory, 'string_offsets', 'q')
+  position = 0
+  try:
+    with open(os.path.join(directory, 'strings'), 'wb') as f:
+      batch = []
+      for raw in strings:
+        f.write(raw)
+        batch.extend((position, position + len(raw)))
+        position += len(raw)
+        if len(batch) >= 1 << 16:
+          offsets.Append(batch)
+          batch = []
+      offsets.Append(batch)
+  finally:
+    offsets.Close()
+
+
+def _MapFile(path, writable=False):
+  """Memory maps a file.
+
+  Returns:
+    mmap or bytes, the content; b'' for an empty file, which cannot be mapped.
+  """
+  if not os.path.getsize(path):
+    return b''
+  with open(path, 'r+b' if writable else 'rb') as f:
+    return mmap.mmap(f.fileno(), 0, access=(
+        mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ))
+
+
+def _AllocateColumn(path, length, typecode='q'):
+  """Creates a column file of zeros."""
+  with open(path, 'wb') as f:
+    f.truncate(length * array.array(typecode).itemsize)
+
+
+def _CreateColumn(path, length):
+  """Creates a column file of zeros and maps it for writing."""
+  _AllocateColumn(path, length)
+  return _MapFile(path, writable=True)
+
+
+def _Column(data, typecode):
+  """Returns a view of mapped data as integers."""
+  if not data:
+    return array.array(typecode)
+  return memoryview(data).cast(typecode)
+
+
+class ColumnarSnapshot(object):
+  """A heap snapshot stored in memory mapped column files.
+
+  The columns are available as attributes (e.g., snapshot.edge_to), indexed by
+  the node or edge index; see the module documentation.
+
+  Attributes:
+    node_count: int, the number of nodes.
+    edge_count: int, the number of edges.
+    node_types: [str], the node type names.
+    edge_types: [str], the edge type names.
+    strings: leak_finder.LazyStringTable, the string table.
+    _maps: [mmap], the mapped files.
+    _views: [memoryview], the views of the mapped files.
+  """
+
+  def __init__(self, directory):
+    """Opens the columns in a directory.
+
+    Args:
+      directory: str, the column directory.
+    Raises:
+      IOError: The columns cannot be read.
+      ValueError: meta.json is malformed.
+    """
+    with open(os.path.join(directory, _META_FILENAME)) as f:
+      meta = json.load(f)
+    self.node_count = meta['node_count']
+    self.edge_count = meta['edge_count']
+    self.node_types = meta['node_types']
+    self.edge_types = meta['edge_types']
+    self._maps = []
+    self._views = []
+    columns = _NODE_COLUMNS + _EDGE_COLUMNS + (
+        ('edge_start', 'q'), ('retainer_start', 'q'), ('retainer_node', 'q'))
+    for name, typecode in columns:
+      setattr(self, name, self._Map(os.path.join(directory, name), typecode))
+    string_data = _MapFile(os.path.join(directory, 'strings'))
+    if string_data:
+      self._maps.append(string_data)
+    self.strings = leak_finder.LazyStringTable(
+        string_data,
+        self._Map(os.path.join(directory, 'string_offsets'), 'q'))
+
+  def _Map(self, path, typecode):
+    data = _MapFile(path)
+    if not data:
+      return array.array(typecode)
+    view = memoryview(data).cast(typecode)
+    self._maps.append(data)
+    self._views.append(view)
+    return view
+
+  def Close(self):
+    """Unmaps the column files; the columns cannot be used afterwards."""
+    for view in self._views:
+      view.release()
+    for data in self._maps:
+      data.close()
+    self._views = []
+    self._maps = []
+
+  def ClassName(self, node):
+    """Returns the class name of a node, as leak_finder.Node.class_name."""
+    type_string = self.node_types[self.node_type[node]]
+    if type_string == 'object':
+      return self.strings[self.node_name[node]]
+    return '(%s)' % type_string
+
+  def InterestingEdges(self, node):
+    """Returns the edges of a node which are included in the analysis.
+
+    Args:
+      node: int, the node index.
+    Returns:
+      [int], the edge indices.
+    """
+    if self.node_types[self.node_type[node]] in (
+        leak_finder.UNINTERESTING_NODE_TYPES):
+      return []
+    return [edge for edge in range(self.edge_start[node],
+                                   self.edge_start[node + 1])
+            if self._IsEdgeInteresting(edge)]
+
+  def _IsEdgeInteresting(self, edge):
+    if self.edge_types[self.edge_type[edge]] in (
+        leak_finder.UNINTERESTING_EDGE_TYPES):
+      return False
+    return self.node_types[self.node_type[self.edge_to[edge]]] not in (
+        leak_finder.UNINTERESTING_NODE_TYPES)
+
+  def EdgeName(self, edge):
+    """Returns the name of an edge, as leak_finder.Edge.name_string."""
+    name = self.edge_name[edge]
+    if (self.edge_types[self.edge_type[edge]] in _INDEX_EDGE_TYPES or
+        name >= len(self.strings)):
+      return str(name)
+    return self.strings[name]
+
+  def MakeNode(self, node):
+    """Constructs a leak_finder.Node with its outgoing edges.
+
+    The nodes the edges point to are constructed without their edges. Used
+    for the leaks, so that e.g. their stack traces can be retrieved.
+
+    Args:
+      node: int, the node index.
+    Returns:
+      leak_finder.Node, the node.
+    """
+    result = self._MakeNodeWithoutEdges(node)
+    for edge in self.InterestingEdges(node):
+      to_node = self._MakeNodeWithoutEdges(self.edge_to[edge])
+      edge_object = leak_finder.Edge(
+          result.node_id, to_node.node_id,
+          self.edge_types[self.edge_type[edge]], self.EdgeName(edge))
+      edge_object.SetFromNode(result).SetToNode(to_node)
+      result.AddEdgeFrom(edge_object)
+      to_node.AddEdgeTo(edge_object)
+    return result
+
+  def _MakeNodeWithoutEdges(self, node):
+    type_string = self.node_types[self.node_type[node]]
+    result = leak_finder.Node(self.node_id[node], type_string,
+                              self.ClassName(node), self.self_size[node])
+    if type_string == 'string':
+      result.SetStringIndex(self.strings, self.node_name[node])
+    return result
+
+
+def BuildColumns(snapshot_filename, directory, json_backend=None,
+                 max_workers=1, executor=None):
+  """Converts a heap snapshot file into column files.
+
+  An uncompressed snapshot is converted by several worker processes if
+  max_workers allows; see _BuildColumnsInParallel. A compressed one can only
+  be decompressed sequentially, and is converted in this process.
+
+  Args:
+    snapshot_filename: str, the heap snapshot file, possibly compressed.
+    directory: str, the column directory. It is created if needed; existing
+        columns are overwritten.
+    json_backend: str, the JSON library for decoding the snapshot header, or
+        None for the fastest installed one.
+    max_workers: int, the number of worker processes.
+    executor: concurrent.futures.Executor, if given, runs the workers instead
+        of a new process pool.
+  Raises:
+    IOError: The files cannot be read or written.
+    KeyError: The snapshot doesn't contain the required data fields.
+    ValueError: The snaphost cannot be parsed.
+    Error: The snapshot format cannot be parsed.
+    leak_finder.Error: The snapshot file is truncated.
+  """
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  meta_path = os.path.join(directory, _META_FILENAME)
+  if os.path.exists(meta_path):
+    os.remove(meta_path)
+  source = _SourceVersion(snapshot_filename)
+
+  if (max_workers > 1 and source[0] > _RANGE_SIZE and
+      not leak_finder.IsSnapshotFileCompressed(snapshot_filename)):
+    data = _MapSnapshot(snapshot_filename)
+    pool = executor or concurrent.futures.ProcessPoolExecutor(max_workers)
+    try:
+      # V8 writes the meta information before the nodes.
+      header = data[:data.find(b'"nodes"')].rstrip().rstrip(b',') + b'}'
+      meta = json_backends.GetBackend(json_backend).Loads(header)
+      meta = meta['snapshot']['meta']
+      node_count, edge_count = _BuildColumnsInParallel(
+          snapshot_filename, directory, data, meta, max_workers, pool)
+    finally:
+      if not executor:
+        pool.shutdown()
+      data.close()
+    _WriteMeta(directory, source, meta, node_count, edge_count)
+    return
+
+  f = leak_finder.OpenSnapshotFile(snapshot_filename)
+  try:
+    stream = leak_finder.SnapshotStream(f)
+    # V8 writes the meta information before the nodes, and the string table
+    # last.
+    header = stream.ReadUntil(b'"nodes"').rstrip().rstrip(b',') + b'}'
+    meta = json_backends.GetBackend(json_backend).Loads(header)
+    meta = meta['snapshot']['meta']
+    stream.ReadUntil(b'[')
+    node_count = _WriteNodeColumns(directory, meta, stream.Integers())
+    stream.ReadUntil(b'"edges"')
+    stream.ReadUntil(b'[')
+    edge_count = _WriteEdgeColumns(directory, meta, stream.Integers())
+    stream.ReadUntil(b'"strings"', keep=False)
+    stream.ReadUntil(b'[')
+    _WriteStrings(directory, stream.Strings())
+  finally:
+    f.close()
+
+  _BuildRetainerIndex(directory, node_count, edge_count,
+                      meta['node_types'][0], meta['edge_types'][0])
+  _WriteMeta(directory, source, meta, node_count, edge_count)
+
+
+def _WriteMeta(directory, source, meta, node_count, edge_count):
+  """Writes meta.json, which marks the columns complete."""
+  with open(os.path.join(directory, _META_FILENAME), 'w') as f:
+    json.dump({'version': _FORMAT_VERSION, 'source': source,
+               'node_count': node_count, 'edge_count': edge_count,
+               'node_types': meta['node_types'][0],
+               'edge_types': meta['edge_types'][0]}, f)
+
+
+def _InterestingTypes(node_types, edge_types):
+  """Returns the node and edge types included in the analysis.
+
+  Args:
+    node_types: [str], the node type names.
+    edge_types: [str], the edge type names.
+  Returns:
+    (set(int), set(int)), the node and the edge types.
+  """
+  return (set(ix for ix, name in enumerate(node_types)
+              if name not in leak_finder.UNINTERESTING_NODE_TYPES),
+          set(ix for ix, name in enumerate(edge_types)
+              if name not in leak_finder.UNINTERESTING_EDGE_TYPES))
+
+
+def _InterestingEdges(node_type, edge_start, edge_type, edge_to,
+                      interesting_types, first_node, last_node):
+  """Yields the edges included in the analysis from a range of nodes.
+
+  Args:
+    node_type: the node_type column.
+    edge_start: the edge_start column.
+    edge_type: the edge_type column.
+    edge_to: the edge_to column.
+    interesting_types: (set(int), set(int)), see _InterestingTypes.
+    first_node: int, the first node whose edges are yielded.
+    last_node: int, the node after the last one whose edges are yielded.
+  Yields:
+    (int, int), the from and to node indices of the edges.
+  """
+  interesting_node_types, interesting_edge_types = interesting_types
+  for from_node in range(first_node, last_node):
+    if node_type[from_node] not in interesting_node_types:
+      continue
+    for edge in range(edge_start[from_node], edge_start[from_node + 1]):
+      to_node = edge_to[edge]
+      if (edge_type[edge] in interesting_edge_types and
+          node_type[to_node] in interesting_node_types):
+        yield from_node, to_node
+
+
+def _BuildRetainerIndex(directory, node_count, edge_count, node_types,
+                        edge_types):
+  """Builds the reverse index of the edges included in the analysis.
+
+  Args:
+    directory: str, the column directory with the node and edge columns.
+    node_count: int, the number of nodes.
+    edge_count: int, the number of edges.
+    node_types: [str], the node type names.
+    edge_types: [str], the edge type names.
+  """
+  sources = [_MapFile(os.path.join(directory, name))
+             for name in ('node_type', 'edge_start', 'edge_type', 'edge_to')]
+  node_type = _Column(sources[0], 'b')
+  edge_start = _Column(sources[1], 'q')
+  edge_type = _Column(sources[2], 'b')
+  edge_to = _Column(sources[3], 'q')
+  interesting_types = _InterestingTypes(node_types, edge_types)
+
+  def InterestingEdges():
+    return _InterestingEdges(node_type, edge_start, edge_type, edge_to,
+                             interesting_types, 0, node_count)
+
+  starts_data = _CreateColumn(os.path.join(directory, 'retainer_start'),
+                              node_count + 1)
+  starts = _Column(starts_data, 'q')
+  retainers_data = None
+  retainers = None
+  try:
+    # Count the retainers of each node into starts[node + 1], and sum the
+    # counts up into the start of each node's retainers.
+    for _, to_node in InterestingEdges():
+      starts[to_node + 1] += 1
+    for node in range(1, node_count + 1):
+      starts[node] += starts[node - 1]
+    retainer_count = starts[node_count]
+
+    retainers_data = _CreateColumn(os.path.join(directory, 'retainer_node'),
+                                   retainer_count)
+    retainers = _Column(retainers_data, 'q')
+    # Fill in the retainers of a range of nodes per pass over the edges.
+    low = 0
+    while retainer_count and low < node_count:
+      high = low + 1
+      while high < node_count and (
+          high - low < _PARTITION_SIZE and
+          starts[high + 1] - starts[low] <= _PARTITION_SIZE):
+        high += 1
+      cursors = array.array('q', starts[low:high])
+      for from_node, to_node in InterestingEdges():
+        if low <= to_node < high:
+          retainers[cursors[to_node - low]] = from_node
+          cursors[to_node - low] += 1
+      low = high
+  finally:
+    for view in (starts, retainers, node_type, edge_start, edge_type,
+                 edge_to):
+      if isinstance(view, memoryview):
+        view.release()
+    for data in sources + [starts_data, retainers_data]:
+      if data:
+        data.close()
+
+
+class _MappedColumns(object):
+  """Maps column files, e.g., in a worker process, until closed."""
+
+  def __init__(self, directory):
+    self._directory = directory
+    self._maps = []
+    self._views = []
+
+  def Map(self, name, typecode, writable=False):
+    """Returns a view of a column file as integers.
+
+    Args:
+      name: str, the column.
+      typecode: str, the array typecode of the column.
+      writable: bool, whether the view is writable; the writes are shared
+          with the other processes mapping the file.
+    Returns:
+      memoryview or array, the column.
+    """
+    data = _MapFile(os.path.join(self._directory, name), writable)
+    if not data:
+      return array.array(typecode)
+    view = memoryview(data).cast(typecode)
+    self._maps.append(data)
+    self._views.append(view)
+    return view
+
+  def Close(self):
+    for view in self._views:
+      view.release()
+    for data in self._maps:
+      data.close()
+    self._views = []
+    self._maps = []
+
+
+def _MapSnapshot(snapshot_filename):
+  """Memory maps an uncompressed heap snapshot file for reading."""
+  with open(snapshot_filename, 'rb') as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _ArrayRange(data, key, position):
+  """Finds the contents of an integer array in the snapshot data.
+
+  Args:
+    data: mmap, the snapshot.
+    key: bytes, the key of the array, e.g., b'"nodes"'.
+    position: int, where to start looking for the key.
+  Returns:
+    (int, int), the byte range between the brackets.
+  Raises:
+    Error: The array cannot be found.
+  """
+  begin = end = -1
+  key_position = data.find(key, position)
+  if key_position >= 0:
+    begin = data.find(b'[', key_position + len(key))
+  if begin >= 0:
+    end = data.find(b']', begin)
+  if end < 0:
+    raise Error('Cannot find the %s array in the snapshot' %
+                key.decode('utf-8'))
+  return begin + 1, end
+
+
+def _CountCommas(snapshot_filename, begin, end):
+  """Counts the commas in a byte range of a snapshot file.
+
+  The range is read _CHUNK_SIZE bytes at a time.
+  """
+  data = _MapSnapshot(snapshot_filename)
+  try:
+    count = 0
+    for position in range(begin, end, _CHUNK_SIZE):
+      count += data[position:min(position + _CHUNK_SIZE, end)].count(b',')
+    return count
+  finally:
+    data.close()
+
+
+def _SplitArray(snapshot_filename, data, array_range, field_count, executor):
+  """Splits an integer array into byte ranges of whole rows.
+
+  The array is first cut at the commas after every _RANGE_SIZE bytes, and the
+  values in each part are counted in parallel. The prefix sums of the counts
+  tell the index of the first value of each part, and the cuts are moved
+  forward to the next row boundary.
+
+  Args:
+    snapshot_filename: str, the heap snapshot file.
+    data: mmap, the snapshot.
+    array_range: (int, int), the byte range of the array contents.
+    field_count: int, the number of values per row.
+    executor: concurrent.futures.Executor, counts the values.
+  Returns:
+    ([(int, int, int, int)], int), the byte range, the first row and the row
+        count of each range, and the total number of rows.
+  Raises:
+    Error: The array doesn't consist of whole rows.
+  """
+  begin, end = array_range
+  cuts = [begin]
+  for position in range(begin + _RANGE_SIZE, end, _RANGE_SIZE):
+    cut = data.find(b',', max(position, cuts[-1]), end)
+    if cut < 0:
+      break
+    cuts.append(cut + 1)
+  cuts.append(end)
+  # Each part but the last ends with a comma.
+  counts = list(executor.map(_CountCommas, [snapshot_filename] * len(cuts[1:]),
+                             cuts[:-1], cuts[1:]))
+  starts = [0]
+  for count in counts:
+    starts.append(starts[-1] + count)
+  if starts[-1] or data[cuts[-2]:end].strip():
+    starts[-1] += 1
+  total = starts[-1]
+  if total % field_count:
+    raise Error('Snapshot array too short')
+
+  aligned = [(begin, 0)]
+  for cut, start in zip(cuts[1:-1], starts[1:-1]):
+    skip = -start % field_count
+    if start + skip >= total or start + skip <= aligned[-1][1]:
+      continue
+    for _ in range(skip):
+      cut = data.find(b',', cut, end) + 1
+    aligned.append((cut, start + skip))
+  aligned.append((end, total))
+  ranges = [(range_begin, range_end, first // field_count,
+             (last - first) // field_count)
+            for (range_begin, first), (range_end, last)
+            in zip(aligned, aligned[1:])]
+  return ranges, total // field_count
+
+
+def _ParseRange(snapshot_filename, byte_range, row_count, field_count):
+  """Parses the rows of integers in a byte range of a snapshot file.
+
+  The range is parsed in chunks of about _CHUNK_SIZE bytes, so that only the
+  values of one chunk are in memory at a time.
+
+  Args:
+    snapshot_filename: str, the heap snapshot file.
+    byte_range: (int, int), the byte range.
+    row_count: int, the number of rows in the range.
+    field_count: int, the number of values per row.
+  Yields:
+    (int, array), the index of the first row of a chunk in the range, and the
+        values of the whole rows of the chunk.
+  Raises:
+    Error: The range doesn't contain row_count rows.
+  """
+  begin, end = byte_range
+  data = _MapSnapshot(snapshot_filename)
+  try:
+    row = 0
+    pending = array.array('q')
+    while begin < end:
+      stop = data.find(b',', min(begin + _CHUNK_SIZE, end), end) + 1 or end
+      text = data[begin:stop].rstrip().rstrip(b',')
+      begin = stop
+      if text.strip():
+        pending.extend(int(value) for value in text.split(b','))
+      whole = len(pending) - len(pending) % field_count
+      if whole:
+        yield row, pending[:whole]
+        row += whole // field_count
+        del pending[:whole]
+  finally:
+    data.close()
+  if pending or row != row_count:
+    raise Error('Snapshot array changed while reading it')
+
+
+def _DecodeNodes(snapshot_filename, directory, node_range, layout):
+  """Writes the node columns of a range of nodes; runs in a worker.
+
+  In the edge_count format, the edge counts are written into edge_start,
+  shifted by one node, to be summed up by _AccumulateEdgeStarts.
+
+  Args:
+    snapshot_filename: str, the heap snapshot file.
+    directory: str, the column directory.
+    node_range: (int, int, int, int), see _SplitArray.
+    layout: {}, see _NodeLayout.
+  Returns:
+    int, the sum of the edge counts of the nodes, or 0 in the edges_index
+        format.
+  """
+  begin, end, first, count = node_range
+  field_count = layout['field_count']
+  edge_field_count = layout['edge_field_count']
+  columns = _MappedColumns(directory)
+  try:
+    targets = [(columns.Map(name, typecode, writable=True), typecode, ix)
+               for (name, typecode), ix in zip(_NODE_COLUMNS,
+                                               layout['indices'])
+               if ix is not None]
+    edge_start = columns.Map('edge_start', 'q', writable=True)
+    total = 0
+    for row, rows in _ParseRange(snapshot_filename, (begin, end), count,
+                                 field_count):
+      low = first + row
+      high = low + len(rows) // field_count
+      for column, typecode, ix in targets:
+        column[low:high] = array.array(typecode, rows[ix::field_count])
+      values = rows[layout['edges_ix']::field_count]
+      if layout['edge_count_format']:
+        edge_start[low + 1:high + 1] = values
+        total += sum(values)
+      else:
+        edge_start[low:high] = array.array(
+            'q', [start // edge_field_count for start in values])
+    return total
+  finally:
+    columns.Close()
+
+
+def _DecodeEdges(snapshot_filename, directory, edge_range, layout):
+  """Writes the edge columns of a range of edges; runs in a worker.
+
+  Args:
+    snapshot_filename: str, the heap snapshot file.
+    directory: str, the column directory.
+    edge_range: (int, int, int, int), see _SplitArray.
+    layout: {}, see _EdgeLayout.
+  """
+  begin, end, first, count = edge_range
+  field_count = layout['field_count']
+  type_ix, name_ix, to_node_ix = layout['indices']
+  node_field_count = layout['node_field_count']
+  columns = _MappedColumns(directory)
+  try:
+    targets = [(columns.Map(name, typecode, writable=True), typecode)
+               for name, typecode in _EDGE_COLUMNS]
+    for row, rows in _ParseRange(snapshot_filename, (begin, end), count,
+                                 field_count):
+      low = first + row
+      high = low + len(rows) // field_count
+      for (column, typecode), values in zip(targets, (
+          rows[type_ix::field_count], rows[name_ix::field_count],
+          [to_node // node_field_count
+           for to_node in rows[to_node_ix::field_count]])):
+        column[low:high] = array.array(typecode, values)
+  finally:
+    columns.Close()
+
+
+def _AccumulateEdgeStarts(directory, first, count, offset):
+  """Sums up the edge counts of a range of nodes into edge_start.
+
+  Args:
+    directory: str, the column directory.
+    first: int, the first node of the range.
+    count: int, the number of nodes in the range.
+    offset: int, the number of edges of the nodes before the range.
+  """
+  columns = _MappedColumns(directory)
+  try:
+    edge_start = columns.Map('edge_start', 'q', writable=True)
+    edge_start[first + 1:first + 1 + count] = array.array(
+        'q', itertools.accumulate(itertools.chain(
+            [offset], edge_start[first + 1:first + 1 + count])))[1:]
+  finally:
+    columns.Close()
+
+
+def _RetainerCountColumn(shard):
+  return 'retainer_count.%d' % shard
+
+
+def _CountRetainers(directory, interesting_types, first_node, last_node,
+                    shard):
+  """Counts the retainers among a range of nodes of each node.
+
+  Args:
+    directory: str, the column directory.
+    interesting_types: (set(int), set(int)), see _InterestingTypes.
+    first_node: int, the first retaining node.
+    last_node: int, the node after the last retaining node.
+    shard: int, the range; the counts are written into its column.
+  """
+  columns = _MappedColumns(directory)
+  try:
+    counts = columns.Map(_RetainerCountColumn(shard), 'q', writable=True)
+    for _, to_node in _InterestingEdges(
+        columns.Map('node_type', 'b'), columns.Map('edge_start', 'q'),
+        columns.Map('edge_type', 'b'), columns.Map('edge_to', 'q'),
+        interesting_types, first_node, last_node):
+      counts[to_node] += 1
+  finally:
+    columns.Close()
+
+
+def _SumRetainerCounts(directory, shard_count, low, high):
+  """Writes the retainer counts of a range of nodes into retainer_start.
+
+  Args:
+    directory: str, the column directory.
+    shard_count: int, the number of retainer count columns.
+    low: int, the first node of the range.
+    high: int, the node after the last node of the range.
+  Returns:
+    int, the number of retainers of the nodes in the range.
+  """
+  columns = _MappedColumns(directory)
+  try:
+    starts = columns.Map('retainer_start', 'q', writable=True)
+    shards = [columns.Map(_RetainerCountColumn(shard), 'q')
+              for shard in range(shard_count)]
+    total = 0
+    for node in range(low, high):
+      starts[node] = sum(counts[node] for counts in shards)
+      total += starts[node]
+    return total
+  finally:
+    columns.Close()
+
+
+def _AssignRetainerSlots(directory, shard_count, low, high, offset):
+  """Turns the retainer counts of a range of nodes into positions.
+
+  The retainer counts in retainer_start become the starts of the retainers of
+  each node, and the counts of each shard become the positions where the
+  shard writes the retainers, so that the retainers of a node are in node
+  order.
+
+  Args:
+    directory: str, the column directory.
+    shard_count: int, the number of retainer count columns.
+    low: int, the first node of the range.
+    high: int, the node after the last node of the range.
+    offset: int, the number of retainers of the nodes before the range.
+  """
+  columns = _MappedColumns(directory)
+  try:
+    starts = columns.Map('retainer_start', 'q', writable=True)
+    shards = [columns.Map(_RetainerCountColumn(shard), 'q', writable=True)
+              for shard in range(shard_count)]
+    position = offset
+    for node in range(low, high):
+      starts[node] = position
+      for counts in shards:
+        position, counts[node] = position + counts[node], position
+  finally:
+    columns.Close()
+
+
+def _FillRetainers(directory, interesting_types, first_node, last_node,
+                   shard):
+  """Writes a range of retaining nodes into retainer_node.
+
+  Args:
+    directory: str, the column directory.
+    interesting_types: (set(int), set(int)), see _InterestingTypes.
+    first_node: int, the first retaining node.
+    last_node: int, the node after the last retaining node.
+    shard: int, the range; its column holds the positions to write at.
+  """
+  columns = _MappedColumns(directory)
+  try:
+    positions = columns.Map(_RetainerCountColumn(shard), 'q', writable=True)
+    retainers = columns.Map('retainer_node', 'q', writable=True)
+    for from_node, to_node in _InterestingEdges(
+        columns.Map('node_type', 'b'), columns.Map('edge_start', 'q'),
+        columns.Map('edge_type', 'b'), columns.Map('edge_to', 'q'),
+        interesting_types, first_node, last_node):
+      retainers[positions[to_node]] = from_node
+      positions[to_node] += 1
+  finally:
+    columns.Close()
+
+
+def _Wait(futures):
+  """Waits for futures, raising the first exception."""
+  return [future.result() for future in futures]
+
+
+def _BuildRetainerIndexInParallel(directory, node_count, edge_count,
+                                  node_types, edge_types, range_count,
+                                  executor):
+  """Builds the reverse index as _BuildRetainerIndex, in parallel.
+
+  This is a parallel counting sort: each worker counts the retainers in its
+  range of retaining nodes into its own column; the counts are summed up per
+  range of retained nodes into the retainer starts and the positions where
+  each worker writes; and each worker writes its retainers.
+
+  Args:
+    directory: str, the column directory with the node and edge columns.
+    node_count: int, the number of nodes.
+    edge_count: int, the number of edges.
+    node_types: [str], the node type names.
+    edge_types: [str], the edge type names.
+    range_count: int, the number of node ranges.
+    executor: concurrent.futures.Executor, runs the passes.
+  """
+  interesting_types = _InterestingTypes(node_types, edge_types)
+  columns = _MappedColumns(directory)
+  try:
+    # The retaining nodes are split so that each range has as many edges.
+    edge_start = columns.Map('edge_start', 'q')
+    bounds = [0]
+    for k in range(1, range_count):
+      bound = bisect.bisect_left(edge_start, edge_count * k // range_count,
+                                 bounds[-1], node_count)
+      if bound > bounds[-1]:
+        bounds.append(bound)
+    bounds.append(node_count)
+  finally:
+    columns.Close()
+  shards = list(zip(bounds, bounds[1:]))
+  # The retained nodes are split evenly.
+  retained = [(node_count * k // range_count,
+               node_count * (k + 1) // range_count)
+              for k in range(range_count)]
+
+  _AllocateColumn(os.path.join(directory, 'retainer_start'), node_count + 1)
+  for shard in range(len(shards)):
+    _AllocateColumn(os.path.join(directory, _RetainerCountColumn(shard)),
+                    node_count)
+  try:
+    _Wait([executor.submit(_CountRetainers, directory, interesting_types,
+                           first, last, shard)
+           for shard, (first, last) in enumerate(shards)])
+    totals = _Wait([executor.submit(_SumRetainerCounts, directory,
+                                    len(shards), low, high)
+                    for low, high in retained])
+    offsets = list(itertools.accumulate([0] + totals))
+    _Wait([executor.submit(_AssignRetainerSlots, directory, len(shards), low,
+                           high, offset)
+           for (low, high), offset in zip(retained, offsets)])
+    columns = _MappedColumns(directory)
+    try:
+      columns.Map('retainer_start', 'q', writable=True)[node_count] = (
+          offsets[-1])
+    finally:
+      columns.Close()
+    _AllocateColumn(os.path.join(directory, 'retainer_node'), offsets[-1])
+    _Wait([executor.submit(_FillRetainers, directory, interesting_types,
+                           first, last, shard)
+           for shard, (first, last) in enumerate(shards)])
+  finally:
+    for shard in range(len(shards)):
+      os.remove(os.path.join(directory, _RetainerCountColumn(shard)))
+
+
+def _BuildColumnsInParallel(snapshot_filename, directory, data, meta,
+                            max_workers, executor):
+  """Writes the columns of an uncompressed snapshot in parallel.
+
+  The node and edge arrays are split into ranges of whole rows (see
+  _SplitArray), which the workers decode a chunk at a time (see _ParseRange)
+  straight into the memory mapped column files, shared by all the processes.
+  In the edge_count format, the edge starts are the prefix sums of the edge
+  counts, computed per range and offset by the sums of the ranges before. The
+  string table is written meanwhile, and the reverse index is built last.
+
+  Args:
+    snapshot_filename: str, the heap snapshot file.
+    directory: str, the column directory.
+    data: mmap, the snapshot.
+    meta: {}, the meta information of the snapshot.
+    max_workers: int, the number of worker processes.
+    executor: concurrent.futures.Executor, runs the workers.
+  Returns:
+    (int, int), the number of nodes and edges.
+  Raises:
+    Error: The snapshot cannot be parsed.
+  """
+  node_layout = _NodeLayout(meta)
+  edge_layout = _EdgeLayout(meta)
+  nodes = _ArrayRange(data, b'"nodes"', 0)
+  edges = _ArrayRange(data, b'"edges"', nodes[1])
+  strings_key = data.find(b'"strings"', edges[1])
+  if strings_key < 0:
+    raise Error('Cannot find the strings array in the snapshot')
+
+  node_ranges, node_count = _SplitArray(
+      snapshot_filename, data, nodes, node_layout['field_count'], executor)
+  edge_ranges, edge_count = _SplitArray(
+      snapshot_filename, data, edges, edge_layout['field_count'], executor)
+  for name, typecode in _NODE_COLUMNS:
+    _AllocateColumn(os.path.join(directory, name), node_count, typecode)
+  _AllocateColumn(os.path.join(directory, 'edge_start'), node_count + 1)
+  for name, typecode in _EDGE_COLUMNS:
+    _AllocateColumn(os.path.join(directory, name), edge_count, typecode)
+
+  node_futures = [executor.submit(_DecodeNodes, snapshot_filename, directory,
+                                  node_range, node_layout)
+                  for node_range in node_ranges]
+  edge_futures = [executor.submit(_DecodeEdges, snapshot_filename, directory,
+                                  edge_range, edge_layout)
+                  for edge_range in edge_ranges]
+  with open(snapshot_filename, 'rb') as f:
+    f.seek(strings_key + len(b'"strings"'))
+    stream = leak_finder.SnapshotStream(f)
+    stream.ReadUntil(b'[')
+    _WriteStrings(directory, stream.Strings())
+  totals = _Wait(node_futures)
+  _Wait(edge_futures)
+
+  if node_layout['edge_count_format']:
+    offsets = itertools.accumulate([0] + totals)
+    _Wait([executor.submit(_AccumulateEdgeStarts, directory, first, count,
+                           offset)
+           for (_, _, first, count), offset in zip(node_ranges, offsets)])
+  columns = _MappedColumns(directory)
+  try:
+    edge_start = columns.Map('edge_start', 'q', writable=True)
+    if node_layout['edge_count_format']:
+      if edge_start[node_count] != edge_count:
+        raise Error('The edge counts of the nodes don\'t match the edges')
+    else:
+      edge_start[node_count] = edge_count
+  finally:
+    columns.Close()
+
+  _BuildRetainerIndexInParallel(
+      directory, node_count, edge_count, meta['node_types'][0],
+      meta['edge_types'][0], max_workers, executor)
+  return node_count, edge_count
+
+
+def OpenColumns(snapshot_filename, directory, json_backend=None,
+                max_workers=1, executor=None):
+  """Opens the columns of a snapshot, building them if they are not current.
+
+  Args:
+    snapshot_filename: str, the heap snapshot file, possibly compressed.
+    directory: str, the column directory.
+    json_backend: str, the JSON library for decoding the snapshot header, or
+        None for the fastest installed one.
+    max_workers: int, the number of worker processes building the columns.
+    executor: concurrent.futures.Executor, see BuildColumns.
+  Returns:
+    ColumnarSnapshot, the opened columns.
+  Raises:
+    See BuildColumns.
+  """
+  try:
+    with open(os.path.join(directory, _META_FILENAME)) as f:
+      meta = json.load(f)
+  except (IOError, OSError, ValueError):
+    meta = {}
+  if (meta.get('version') != _FORMAT_VERSION or
+      meta.get('source') != _SourceVersion(snapshot_filename)):
+    BuildColumns(snapshot_filename, directory, json_backend, max_workers,
+                 executor)
+  return ColumnarSnapshot(directory)
+
+
+class ColumnarLeakFinder(object):
+  """Finds potentially leaking objects in a ColumnarSnapshot.
+
+  Uses the same leak definition as leak_finder.LeakFinder, including the
+  maximum length of the good retaining paths. LeakFinder also ends the paths
+  at the nodes on the good paths it has already found, so depending on the
+  order of the elements it may accept a longer good path than this finder.
+
+  Attributes:
+    coverage: {str -> (int, int)}, maps the container names to the number of
+        container elements examined by the last FindLeaks call and the total
+        number of elements in the container.
+    stop_reason: str, describes why the last FindLeaks call stopped before
+        examining all the container elements, or None.
+  """
+
+  def __init__(self, containers, bad_stop_nodes, stacktrace_prefix,
+               stacktrace_suffix):
+    """Initializes the ColumnarLeakFinder object.
+
+    Args:
+      containers: [str], describes the container JavaScript objects, e.g.,
+          ['mylibrary.all_objects_array'].
+      bad_stop_nodes: [str], describes the bad stop nodes, e.g.,
+          ['mylibrary.secondary_array'].
+      stacktrace_prefix: str, prefix to add to the container name for
+          retrieving the stack trace.
+      stacktrace_suffix: str, name of the member variable where the stack
+          trace is stored.
+    """
+    self._container_description = [c.split('.') for c in containers]
+    self._bad_stop_node_description = [b.split('.') for b in bad_stop_nodes]
+    self._stacktrace_prefix = stacktrace_prefix
+    self._stacktrace_suffix = stacktrace_suffix
+    self.coverage = {}
+    self.stop_reason = None
+
+  @staticmethod
+  def _FindByPath(snapshot, path):
+    """Finds the nodes reachable by a property path from any node.
+
+    Args:
+      snapshot: ColumnarSnapshot, the snapshot.
+      path: [str], the property names.
+    Returns:
+      set(int), the node indices at the end of the path.
+    """
+    name_ixs = snapshot.strings.IndicesOf(path[0])
+
+    def Matches(edge, name, name_ixs):
+      if snapshot.edge_types[snapshot.edge_type[edge]] in _INDEX_EDGE_TYPES:
+        return str(snapshot.edge_name[edge]) == name
+      return snapshot.edge_name[edge] in name_ixs
+
+    found = set(snapshot.edge_to[edge] for node in range(snapshot.node_count)
+                for edge in snapshot.InterestingEdges(node)
+                if Matches(edge, path[0], name_ixs))
+    for name in path[1:]:
+      name_ixs = snapshot.strings.IndicesOf(name)
+      found = set(snapshot.edge_to[edge] for node in sorted(found)
+                  for edge in snapshot.InterestingEdges(node)
+                  if Matches(edge, name, name_ixs))
+    return found
+
+  @staticmethod
+  def _FindWindows(snapshot):
+    """Returns the node indices of the Window objects."""
+    if 'object' not in snapshot.node_types:
+      return set()
+    object_type = snapshot.node_types.index('object')
+    windows = set()
+    names = {}
+    for node in range(snapshot.node_count):
+      if snapshot.node_type[node] != object_type:
+        continue
+      name = snapshot.node_name[node]
+      is_window = names.get(name)
+      if is_window is None:
+        is_window = names[name] = leak_finder.LeakFinder.IsWindowClass(
+            snapshot.strings[name])
+      if is_window:
+        windows.add(node)
+    return windows
+
+  @staticmethod
+  def _FindRetainedByGoodPaths(snapshot, windows, bad_stop_nodes, deadline,
+                               max_depth=30):
+    """Finds the nodes retained by a path which avoids the bad stop nodes.
+
+    The good paths start from the Window objects and from the nodes without
+    retainers. As in LeakFinder._FindRetainingPaths, a path has at most
+    max_depth nodes, so a node retained only by longer paths is a leak.
+
+    Args:
+      snapshot: ColumnarSnapshot, the snapshot.
+      windows: set(int), the Window objects.
+      bad_stop_nodes: set(int), the bad stop nodes.
+      deadline: float, the time.time() value after which the search is
+          stopped, or None for no limit.
+      max_depth: int, the maximum number of nodes on a good path.
+    Returns:
+      bytearray, 1 for the nodes retained by a good path, or None if the
+          deadline was reached.
+    """
+    good = bytearray(snapshot.node_count)
+    frontier = []
+    for node in range(snapshot.node_count):
+      if node in bad_stop_nodes:
+        continue
+      if node in windows or (
+          snapshot.retainer_start[node] == snapshot.retainer_start[node + 1] and
+          snapshot.node_types[snapshot.node_type[node]] not in
+          leak_finder.UNINTERESTING_NODE_TYPES):
+        good[node] = 1
+        frontier.append(node)
+    for _ in range(max_depth - 1):
+      if not frontier:
+        break
+      if deadline is not None and time.time() >= deadline:
+        return None
+      next_frontier = []
+      # The frontier is in node order, so the edge columns are read in order.
+      for node in frontier:
+        for edge in snapshot.InterestingEdges(node):
+          to_node = snapshot.edge_to[edge]
+          if not good[to_node] and to_node not in bad_stop_nodes:
+            good[to_node] = 1
+            next_frontier.append(to_node)
+      next_frontier.sort()
+      frontier = next_frontier
+    return good
+
+  def FindLeaks(self, snapshot, time_budget=None, max_leaks=None):
+    """Finds the potentially leaking container elements.
+
+    Args:
+      snapshot: ColumnarSnapshot, the snapshot.
+      time_budget: float, the number of seconds after which the search is
+          stopped, or None for no limit.
+      max_leaks: int, the number of leaks after which the search is stopped,
+          or None for no limit.
+    Yields:
+      leak_finder.LeakNode objects representing the potential leaks.
+    Raises:
+      leak_finder.Error: A container cannot be found.
+    """
+    deadline = None
+    if time_budget is not None:
+      deadline = time.time() + time_budget
+    self.coverage = {}
+    self.stop_reason = None
+
+    windows = ColumnarLeakFinder._FindWindows(snapshot)
+    bad_stop_nodes = set()
+    for path in self._bad_stop_node_description:
+      bad_stop_nodes.update(
+          ColumnarLeakFinder._FindByPath(snapshot, path) - windows)
+    containers = []
+    for path in self._container_description:
+      container_name = '.'.join(path)
+      found = ColumnarLeakFinder._FindByPath(snapshot, path) - windows
+      if not found:
+        raise leak_finder.Error('Container not found: %s' % container_name)
+      for container in sorted(found):
+        bad_stop_nodes.add(container)
+        containers.append((container_name, container))
+
+    # The elements are ordered so that different classes come first, as in
+    # LeakFinder.
+    elements = []
+    class_order = {}
+    class_counts = {}
+    for container_name, container in containers:
+      edges = [edge for edge in snapshot.InterestingEdges(container)
+               if snapshot.edge_types[snapshot.edge_type[edge]] == 'element']
+      examined, total = self.coverage.get(container_name, (0, 0))
+      self.coverage[container_name] = (examined, total + len(edges))
+      for edge in edges:
+        to_node = snapshot.edge_to[edge]
+        class_key = (snapshot.node_type[to_node], snapshot.node_name[to_node])
+        class_order.setdefault(class_key, len(class_order))
+        rank = class_counts.get(class_key, 0)
+        class_counts[class_key] = rank + 1
+        elements.append(((rank, class_order[class_key]), container_name,
+                         edge))
+    elements.sort(key=lambda element: element[0])
+
+    good = ColumnarLeakFinder._FindRetainedByGoodPaths(
+        snapshot, windows, bad_stop_nodes, deadline)
+    if good is None:
+      self.stop_reason = 'time budget exhausted'
+      return
+
+    leak_count = 0
+    for _, container_name, edge in elements:
+      if deadline is not None and time.time() >= deadline:
+        self.stop_reason = 'time budget exhausted'
+        return
+      if max_leaks is not None and leak_count >= max_leaks:
+        self.stop_reason = 'leak limit reached'
+        return
+      examined, total = self.coverage[container_name]
+      self.coverage[container_name] = (examined + 1, total)
+      to_node = snapshot.edge_to[edge]
+      if good[to_node]:
+        continue
+      node_description = '%s%s[%s]' % (self._stacktrace_prefix,
+                                       container_name,
+                                       snapshot.EdgeName(edge))
+      leak_count += 1
+      yield leak_finder.LeakNode(snapshot.MakeNode(to_node), 'Leak',
+                                 node_description, self._stacktrace_suffix)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests ColumnarSnapshot and ColumnarLeakFinder."""
+
+import concurrent.futures
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import columnar_snapshot
+import leak_finder
+import snapshot_testdata
+
+
+class ColumnarSnapshotTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+    self._snapshot = os.path.join(self._directory, 'snapshot.heapsnapshot')
+    self._columns = os.path.join(self._directory, 'columns')
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _SnapshotData(self, edges_index=False):
+    """Helper for creating heap snapshot data.
+
+    (window) - lib -> (lib) - container -> (array) - [0] -> (leaked)
+      | | |                                   | |              |
+      | | `- weakref (weak) ------------------|-|-------->     stack -> (str)
+      | `- other -> (kept) <- [1] ------------' |
+      `- goog -> (events) - ref -> (leaked2) <- [2]
+
+    Args:
+      edges_index: bool, whether to use the edges_index format.
+    Returns:
+      The heap snapshot data.
+    """
+    strings = ['Window', 'Lib', 'Array', 'Leaked', snapshot_testdata.LEAK_STACK,
+               'lib', 'container', 'stack', 'Kept', 'other', 'goog', 'events',
+               'Events', 'weakref', 'ref']
+    nodes = [0, 0, 1, 10, 4,   # 0: window
+             0, 1, 2, 10, 1,   # 5: lib
+             2, 2, 3, 10, 3,   # 10: array
+             0, 3, 4, 10, 1,   # 15: leaked
+             1, 4, 5, 10, 0,   # 20: stack string
+             0, 8, 6, 10, 0,   # 25: kept
+             0, 12, 7, 10, 1,  # 30: events
+             0, 3, 8, 10, 0]   # 35: leaked2
+    edges = [0, 5, 5, 0, 9, 25, 0, 10, 30, 2, 13, 15,  # window
+             0, 6, 10,                                 # lib.container
+             1, 0, 15, 1, 1, 25, 1, 2, 35,             # array[0..2]
+             0, 7, 20,                                 # leaked.stack
+             0, 14, 35]                                # events.ref
+    node_fields = ['type', 'name', 'id', 'self_size', 'edge_count']
+    if edges_index:
+      node_fields[4] = 'edges_index'
+      start = 0
+      for ix in range(4, len(nodes), 5):
+        start, nodes[ix] = start + nodes[ix] * 3, start
+    return snapshot_testdata.HeapSnapshotData(
+        ['object', 'string', 'array'], ['property', 'element', 'weak'],
+        node_fields, ['type', 'name_or_index', 'to_node'], nodes, edges,
+        strings)
+
+  def _WriteSnapshot(self, data):
+    with open(self._snapshot, 'w') as f:
+      json.dump(data, f)
+
+  def _FindLeaks(self, snapshot):
+    finder = columnar_snapshot.ColumnarLeakFinder(['lib.container'], ['goog'],
+                                                  '', '.stack')
+    return list(finder.FindLeaks(snapshot)), finder
+
+  def testColumns(self):
+    self._WriteSnapshot(self._SnapshotData())
+    snapshot = columnar_snapshot.OpenColumns(self._snapshot, self._columns)
+    try:
+      self.assertEqual(8, snapshot.node_count)
+      self.assertEqual(10, snapshot.edge_count)
+      self.assertEqual([1, 2, 3, 4, 5, 6, 7, 8], list(snapshot.node_id))
+      self.assertEqual([0, 4, 5, 8, 9, 9, 9, 10, 10],
+                       list(snapshot.edge_start))
+      self.assertEqual('Lib', snapshot.ClassName(1))
+      self.assertEqual('(string)', snapshot.ClassName(4))
+      self.assertEqual('0', snapshot.EdgeName(5))
+      # The retainers of leaked and leaked2, without the weak edge.
+      starts = snapshot.retainer_start
+      self.assertEqual([2], list(snapshot.retainer_node[starts[3]:starts[4]]))
+      self.assertEqual([2, 6],
+                       sorted(snapshot.retainer_node[starts[7]:starts[8]]))
+      self.assertEqual(starts[0], starts[1])
+    finally:
+      snapshot.Close()
+
+  def testSameLeaksAsLeakFinder(self):
+    for edges_index in (False, True):
+      data = self._SnapshotData(edges_index)
+      nodes = leak_finder.Snapshotter().GetSnapshotFromHeap(data)
+      finder = leak_finder.LeakFinder(['lib.container'], ['goog'], '',
+                                      '.stack')
+      expected = sorted(leak.node.node_id for leak in finder.FindLeaks(nodes))
+      self.assertEqual([4, 8], expected)
+
+      self._WriteSnapshot(data)
+      columnar_snapshot.BuildColumns(self._snapshot, self._columns)
+      snapshot = columnar_snapshot.ColumnarSnapshot(self._columns)
+      try:
+        leaks, finder = self._FindLeaks(snapshot)
+        self.assertEqual(expected,
+                         sorted(leak.node.node_id for leak in leaks))
+        self.assertEqual({'lib.container': (3, 3)}, finder.coverage)
+        leak = [leak for leak in leaks if leak.node.node_id == 4][0]
+        self.assertEqual('Leaked', leak.node.class_name)
+        self.assertEqual('lib.container[0]', leak.how_to_find_node)
+        leak.RetrieveStackTrace()
+        self.assertEqual(['createLeak'], leak.stack.frames)
+      finally:
+        snapshot.Close()
+
+  def _DeepSnapshotData(self, near_links, far_links):
+    """Helper for creating heap snapshot data with long retaining paths.
+
+    (window) - lib -> (lib) - container -> (array) - [0] -> (near)
+        |                                     |                ^
+        |- next -> (link) - next -> ... ------|-- value -------'
+        |                                     `- [1] -> (far)
+        `- next -> (link) - next -> ... - value ---------> ^
+
+    Args:
+      near_links: int, the number of links retaining the near object.
+      far_links: int, the number of links retaining the far object.
+    Returns:
+      The heap snapshot data.
+    """
+    strings = ['Window', 'Lib', 'Array', 'Near', 'Far', 'Link', 'lib',
+               'container', 'next', 'value']
+    near_first = 5
+    far_first = near_first + near_links
+    node_list = [0, 0, 1, 10, 3,   # 0: window
+                 0, 1, 2, 10, 1,   # 1: lib
+                 2, 2, 3, 10, 2,   # 2: array
+                 0, 3, 4, 10, 0,   # 3: near
+                 0, 4, 5, 10, 0]   # 4: far
+    edge_list = [0, 6, 5,                  # window.lib
+                 0, 8, near_first * 5,     # window.next
+                 0, 8, far_first * 5,      # window.next
+                 0, 7, 10,                 # lib.container
+                 1, 0, 15,                 # array[0]
+                 1, 1, 20]                 # array[1]
+    for first, count, element in ((near_first, near_links, 3),
+                                  (far_first, far_links, 4)):
+      for ix in range(first, first + count):
+        node_list.extend([0, 5, ix + 1, 10, 1])
+        if ix + 1 < first + count:
+          edge_list.extend([0, 8, (ix + 1) * 5])
+        else:
+          edge_list.extend([0, 9, element * 5])
+    return snapshot_testdata.HeapSnapshotData(
+        ['object', 'string', 'array'], ['property', 'element'],
+        ['type', 'name', 'id', 'self_size', 'edge_count'],
+        ['type', 'name_or_index', 'to_node'], node_list, edge_list, strings)
+
+  def testRetainingPathDepth(self):
+    # The good path of near has 30 nodes, that of far has 31.
+    data = self._DeepSnapshotData(28, 29)
+    nodes = leak_finder.Snapshotter().GetSnapshotFromHeap(data)
+    finder = leak_finder.LeakFinder(['lib.container'], [], '', '')
+    self.assertEqual(['Far'], [leak.node.class_name
+                               for leak in finder.FindLeaks(nodes)])
+
+    self._WriteSnapshot(data)
+    snapshot = columnar_snapshot.OpenColumns(self._snapshot, self._columns)
+    try:
+      finder = columnar_snapshot.ColumnarLeakFinder(['lib.container'], [], '',
+                                                    '')
+      self.assertEqual(['Far'], [leak.node.class_name
+                                 for leak in finder.FindLeaks(snapshot)])
+    finally:
+      snapshot.Close()
+
+  def testPartitionedRetainerIndex(self):
+    self._WriteSnapshot(self._SnapshotData())
+    partition_size = columnar_snapshot._PARTITION_SIZE
+    columnar_snapshot._PARTITION_SIZE = 1
+    try:
+      snapshot = columnar_snapshot.OpenColumns(self._snapshot, self._columns)
+    finally:
+      columnar_snapshot._PARTITION_SIZE = partition_size
+    try:
+      starts = snapshot.retainer_start
+      self.assertEqual([2, 6],
+                       sorted(snapshot.retainer_node[starts[7]:starts[8]]))
+      self.assertEqual([4, 8], sorted(leak.node.node_id
+                                      for leak in self._FindLeaks(snapshot)[0]))
+    finally:
+      snapshot.Close()
+
+  def testParallelBuild(self):
+    names = ('node_type', 'node_name', 'node_id', 'self_size', 'edge_start',
+             'edge_type', 'edge_name', 'edge_to', 'retainer_start',
+             'retainer_node', 'strings', 'string_offsets', 'meta.json')
+    serial = os.path.join(self._directory, 'serial')
+    range_size = columnar_snapshot._RANGE_SIZE
+    chunk_size = columnar_snapshot._CHUNK_SIZE
+    try:
+      for edges_index in (False, True):
+        self._WriteSnapshot(self._SnapshotData(edges_index))
+        columnar_snapshot.BuildColumns(self._snapshot, serial)
+        for max_workers, size in ((2, 1), (3, 7), (8, 30)):
+          columnar_snapshot._RANGE_SIZE = size
+          columnar_snapshot._CHUNK_SIZE = size // 2 + 1
+          executor = concurrent.futures.ProcessPoolExecutor(2)
+          try:
+            columnar_snapshot.BuildColumns(self._snapshot, self._columns,
+                                           max_workers=max_workers,
+                                           executor=executor)
+          finally:
+            executor.shutdown()
+          for name in names:
+            with open(os.path.join(serial, name), 'rb') as f:
+              expected = f.read()
+            with open(os.path.join(self._columns, name), 'rb') as f:
+              self.assertEqual(expected, f.read(), name)
+          self.assertEqual(sorted(names), sorted(os.listdir(self._columns)))
+    finally:
+      columnar_snapshot._RANGE_SIZE = range_size
+      columnar_snapshot._CHUNK_SIZE = chunk_size
+
+  def testColumnsAreRebuiltWhenStale(self):
+    self._WriteSnapshot(self._SnapshotData())
+    columnar_snapshot.OpenColumns(self._snapshot, self._columns).Close()
+    meta = os.path.join(self._columns, 'meta.json')
+    os.utime(meta, (1, 1))
+    columnar_snapshot.OpenColumns(self._snapshot, self._columns).Close()
+    self.assertEqual(1, os.path.getmtime(meta))
+
+    os.utime(self._snapshot, (2, 2))
+    columnar_snapshot.OpenColumns(self._snapshot, self._columns).Close()
+    self.assertNotEqual(1, os.path.getmtime(meta))
+
+
+if __name__ == '__main__':
+  unittest.main()
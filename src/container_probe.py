@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Cheap probes for deciding when a heap snapshot is worth taking.
+
+Taking a heap snapshot pauses the application, and analyzing it takes seconds
+to minutes. Evaluating the lengths of the containers of a leak definition
+(e.g., goog.Disposable.instances_.length) takes milliseconds, and if they
+haven't grown since the last analysis, a new snapshot cannot contain new
+leaks in them.
+
+GrowthTrigger compares the probed lengths to the lengths at the last analysis,
+and triggers a new one when a container has grown by a threshold, or has
+grown in each of the last few probes. Replacing elements without changing the
+length is not noticed.
+"""
+
+
+DEFAULT_MIN_GROWTH = 10
+DEFAULT_TREND_PROBES = 3
+
+# Evaluates the length of a container: the length of an array, or the number
+# of properties of an object used as a map. The container is evaluated once,
+# in case its expression has side effects.
+_LENGTH_EXPRESSION = ('(function(x) { return x.length !== undefined ? '
+                      'x.length : Object.keys(x).length; })(%s)')
+
+
+class Error(Exception):
+  pass
+
+
+def ProbeContainers(inspector_client, leak_definition):
+  """Evaluates the lengths of the containers of a leak definition.
+
+  The length of an object container is its number of own enumerable
+  properties.
+
+  Args:
+    inspector_client: RemoteInspectorClient, evaluates the JavaScript.
+    leak_definition: jsleakcheck.LeakDefinition, defines the containers; its
+        stacktrace_prefix is prepended to their names.
+  Returns:
+    {str -> int}, maps the container names to their lengths.
+  Raises:
+    Error: The length of a container is not a number, e.g., because the
+        container doesn't exist.
+  """
+  lengths = {}
+  for container in leak_definition.containers:
+    expression = _LENGTH_EXPRESSION % (leak_definition.stacktrace_prefix +
+                                       container)
+    value = inspector_client.EvaluateJavaScript(expression)
+    try:
+      lengths[container] = int(value)
+    except (TypeError, ValueError):
+      raise Error('Cannot probe the length of %s: got %r' % (container, value))
+  return lengths
+
+
+class GrowthTrigger(object):
+  """Decides whether the containers have grown enough for a new analysis.
+
+  Attributes:
+    baseline: {str -> int}, the container lengths at the last analysis, or
+        lower if the containers have shrunk since; None before the first
+        analysis.
+    _min_growth: int, the growth of a container since the baseline which
+        triggers an analysis.
+    _trend_probes: int, the number of consecutive probes a container must
+        grow in to trigger an analysis, or None for not following the trend.
+    _history: {str -> [int]}, the probed lengths of each container since the
+        last analysis.
+  """
+
+  def __init__(self, min_growth=DEFAULT_MIN_GROWTH,
+               trend_probes=DEFAULT_TREND_PROBES):
+    """Initializes the GrowthTrigger object.
+
+    Args:
+      min_growth: int, an analysis is triggered when a container has grown by
+          at least this many elements since the last analysis.
+      trend_probes: int, an analysis is also triggered when a container has
+          grown in each of this many consecutive probes, however little; None
+          disables this.
+    """
+    self._min_growth = min_growth
+    self._trend_probes = trend_probes
+    self.baseline = None
+    self._history = {}
+
+  def Decide(self, lengths):
+    """Records a probe and decides whether to analyze the heap.
+
+    Args:
+      lengths: {str -> int}, the probed container lengths.
+    Returns:
+      (bool, str), whether to analyze the heap, and why.
+    """
+    if self.baseline is None:
+      return True, 'no earlier analysis'
+    for container in sorted(lengths):
+      if container not in self.baseline:
+        return True, 'no earlier analysis of %s' % container
+      self._history.setdefault(container, []).append(lengths[container])
+      # Growth is measured from the lowest length, so that the elements
+      # removed since the analysis don't hide the elements added.
+      self.baseline[container] = min(self.baseline[container],
+                                     lengths[container])
+    reasons = []
+    for container in sorted(lengths):
+      growth = lengths[container] - self.baseline[container]
+      if growth >= self._min_growth:
+        return True, '%s grew by %d elements (threshold %d)' % (
+            container, growth, self._min_growth)
+      history = self._history[container]
+      if self._trend_probes and len(history) > self._trend_probes:
+        recent = history[-self._trend_probes - 1:]
+        if all(a < b for a, b in zip(recent, recent[1:])):
+          return True, '%s grew in each of the last %d probes' % (
+              container, self._trend_probes)
+      reasons.append('%s grew by %d' % (container, growth))
+    return False, 'growth below threshold %d: %s' % (self._min_growth,
+                                                     ', '.join(reasons))
+
+  def Reset(self, lengths):
+    """Records the container lengths at an analysis.
+
+    Args:
+      lengths: {str -> int}, the container lengths probed before the analysis.
+    """
+    self.baseline = dict(lengths)
+    self._history = dict((container, [length])
+                         for container, length in lengths.items())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests the container probes and GrowthTrigger."""
+
+import json
+import unittest
+
+import container_probe
+import jsleakcheck
+import leak_finder
+import snapshot_testdata
+
+
+class FakeInspectorClient(object):
+  """Returns a fixed heap snapshot and the given container length.
+
+  The length is either the length of an array container, or a dict of the
+  properties of an object container.
+  """
+
+  def __init__(self):
+    self.length = 1
+    self.expressions = []
+    self.snapshot_count = 0
+
+  def HeapSnapshot(self, **unused_kwargs):
+    """Returns a snapshot with a leak.
+
+    (window) - lib -> (lib) - container -> (array) - [0] -> (leaked)
+    """
+    self.snapshot_count += 1
+    data = snapshot_testdata.LeakSnapshotData(stack=False)
+    return {'raw_data': json.dumps(data)}
+
+  def EvaluateJavaScript(self, expression):
+    if 'Object.keys' in expression:
+      self.expressions.append(expression)
+      if isinstance(self.length, dict):
+        return len(self.length)
+      return self.length
+    return snapshot_testdata.LEAK_STACK
+
+
+class ContainerProbeTest(unittest.TestCase):
+
+  def testProbeContainers(self):
+    client = FakeInspectorClient()
+    client.length = 5
+    definition = jsleakcheck.LeakDefinition(containers=['a.b', 'c'],
+                                            stacktrace_prefix='frame.')
+    self.assertEqual({'a.b': 5, 'c': 5},
+                     container_probe.ProbeContainers(client, definition))
+    self.assertEqual([container_probe._LENGTH_EXPRESSION % 'frame.a.b',
+                      container_probe._LENGTH_EXPRESSION % 'frame.c'],
+                     client.expressions)
+    client.length = {'id1': 1, 'id2': 2}
+    self.assertEqual({'a.b': 2, 'c': 2},
+                     container_probe.ProbeContainers(client, definition))
+    client.length = None
+    self.assertRaises(container_probe.Error, container_probe.ProbeContainers,
+                      client, definition)
+
+  def testGrowthTrigger(self):
+    trigger = container_probe.GrowthTrigger(min_growth=10, trend_probes=3)
+    self.assertTrue(trigger.Decide({'a': 100})[0])
+    trigger.Reset({'a': 100})
+    self.assertEqual((False, 'growth below threshold 10: a grew by 5'),
+                     trigger.Decide({'a': 105}))
+    self.assertEqual((True, 'a grew by 10 elements (threshold 10)'),
+                     trigger.Decide({'a': 110}))
+
+    # Growth is measured from the lowest length since the analysis.
+    trigger.Reset({'a': 100})
+    self.assertFalse(trigger.Decide({'a': 50})[0])
+    self.assertFalse(trigger.Decide({'a': 50})[0])
+    self.assertTrue(trigger.Decide({'a': 60})[0])
+
+    # A steady trend triggers below the threshold.
+    trigger.Reset({'a': 100})
+    self.assertFalse(trigger.Decide({'a': 101})[0])
+    self.assertFalse(trigger.Decide({'a': 102})[0])
+    self.assertEqual((True, 'a grew in each of the last 3 probes'),
+                     trigger.Decide({'a': 103}))
+
+    trigger = container_probe.GrowthTrigger(min_growth=10, trend_probes=None)
+    trigger.Reset({'a': 100})
+    for length in range(101, 110):
+      self.assertFalse(trigger.Decide({'a': length})[0])
+    self.assertTrue(trigger.Decide({'b': 0})[0])
+
+  def testRunOnGrowth(self):
+    client = FakeInspectorClient()
+    definition = jsleakcheck.LeakDefinition(containers=['lib.container'],
+                                            stacktrace_suffix='.stack')
+    checker = jsleakcheck.JSLeakCheck(definition, incremental=True)
+    trigger = container_probe.GrowthTrigger(min_growth=2, trend_probes=None)
+    self.assertEqual(1, checker.RunOnGrowth(client, trigger))
+    self.assertEqual(1, client.snapshot_count)
+    client.length = 2
+    self.assertEqual(None, checker.RunOnGrowth(client, trigger))
+    self.assertEqual(1, client.snapshot_count)
+    client.length = 3
+    self.assertEqual(1, checker.RunOnGrowth(client, trigger))
+    self.assertEqual(2, client.snapshot_count)
+    self.assertEqual({'lib.container': 3}, trigger.baseline)
+
+    client.length = 'undefined'
+    self.assertRaises(leak_finder.Error, checker.RunOnGrowth, client, trigger)
+
+
+if __name__ == '__main__':
+  unittest.main()
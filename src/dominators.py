@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Dominator tree and retained sizes for a parsed heap snapshot.
+
+A node A dominates a node B if every retaining path of B goes through A. The
+retained size of A is the sum of the self sizes of the nodes A dominates
+(including A itself); it is the amount of memory which would be freed if A was
+released.
+
+The dominators are computed with the iterative algorithm by Cooper, Harvey and
+Kennedy ("A Simple, Fast Dominance Algorithm"), which is close to linear for
+graphs like heap snapshots.
+"""
+
+
+class DominatorTree(object):
+  """The dominator tree of a set of Node objects.
+
+  The parsed snapshot doesn't contain the synthetic root of the heap, so a
+  virtual root is used instead. It retains all nodes which don't have
+  retainers, and one node of each cycle which is not reachable from them.
+
+  Attributes:
+    _nodes: [Node], the nodes in the post order of a depth first search from
+        the virtual root. The virtual root is not included; its post order
+        number is len(_nodes).
+    _post_order: {Node -> int}, maps nodes to their post order numbers.
+    _idoms: [int], the post order number of the immediate dominator for each
+        post order number.
+    _retained_sizes: [int], the retained size for each post order number.
+  """
+
+  def __init__(self, nodes):
+    """Initializes the DominatorTree object and computes the dominators.
+
+    Args:
+      nodes: set(Node), Node objects in the snapshot.
+    """
+    nodes = list(nodes)
+    self._nodes = []
+    self._post_order = {}
+    roots = set()
+    for node in nodes:
+      if not node.edges_to:
+        roots.add(node)
+        self._DepthFirstSearch(node)
+    for node in nodes:
+      if node not in self._post_order:
+        roots.add(node)
+        self._DepthFirstSearch(node)
+
+    root = len(self._nodes)
+    predecessors = []
+    for node in self._nodes:
+      node_predecessors = [self._post_order[edge.from_node]
+                           for edge in node.edges_to]
+      if node in roots:
+        node_predecessors.append(root)
+      predecessors.append(node_predecessors)
+
+    idoms = [None] * (root + 1)
+    idoms[root] = root
+    changed = True
+    while changed:
+      changed = False
+      for node in range(root - 1, -1, -1):
+        new_idom = None
+        for predecessor in predecessors[node]:
+          if idoms[predecessor] is None:
+            continue
+          if new_idom is None:
+            new_idom = predecessor
+          else:
+            new_idom = DominatorTree._Intersect(idoms, predecessor, new_idom)
+        if idoms[node] != new_idom:
+          idoms[node] = new_idom
+          changed = True
+    self._idoms = idoms
+
+    # A node is always visited before its dominator in the post order.
+    self._retained_sizes = [node.self_size for node in self._nodes] + [0]
+    for node in range(root):
+      self._retained_sizes[idoms[node]] += self._retained_sizes[node]
+
+  def _DepthFirstSearch(self, start):
+    """Assigns post order numbers to the nodes reachable from start.
+
+    Args:
+      start: Node, the node to start the search from.
+    """
+    self._post_order[start] = None
+    stack = [(start, iter(start.edges_from))]
+    while stack:
+      node, edges = stack[-1]
+      for edge in edges:
+        child = edge.to_node
+        if child not in self._post_order:
+          self._post_order[child] = None
+          stack.append((child, iter(child.edges_from)))
+          break
+      else:
+        stack.pop()
+        self._post_order[node] = len(self._nodes)
+        self._nodes.append(node)
+
+  @staticmethod
+  def _Intersect(idoms, node1, node2):
+    """Finds the closest common dominator of two nodes.
+
+    Args:
+      idoms: [int], the immediate dominators computed so far.
+      node1: int, post order number of a node.
+      node2: int, post order number of a node.
+    Returns:
+      int, the post order number of the common dominator.
+    """
+    while node1 != node2:
+      while node1 < node2:
+        node1 = idoms[node1]
+      while node2 < node1:
+        node2 = idoms[node2]
+    return node1
+
+  def ImmediateDominator(self, node):
+    """Returns the immediate dominator of a node.
+
+    Args:
+      node: Node, a node in the snapshot.
+    Returns:
+      Node, the immediate dominator, or None if the node is only dominated by
+          the virtual root.
+    """
+    idom = self._idoms[self._post_order[node]]
+    if idom == len(self._nodes):
+      return None
+    return self._nodes[idom]
+
+  def Dominates(self, dominator, node):
+    """Returns True if dominator dominates node.
+
+    Args:
+      dominator: Node, a node in the snapshot.
+      node: Node, a node in the snapshot.
+    Returns:
+      bool, True if all retaining paths of node go through dominator.
+    """
+    dominator = self._post_order[dominator]
+    node = self._post_order[node]
+    root = len(self._nodes)
+    while node < dominator and node != root:
+      node = self._idoms[node]
+    return node == dominator
+
+  def RetainedSize(self, node):
+    """Returns the retained size of a node.
+
+    Args:
+      node: Node, a node in the snapshot.
+    Returns:
+      int, the number of bytes which would be freed if node was released.
+    """
+    return self._retained_sizes[self._post_order[node]]
+
+  def RetainedSizeOfSet(self, nodes):
+    """Returns the retained size of a set of nodes.
+
+    The retained sizes of the nodes dominated by other nodes in the set are
+    included in the retained sizes of their dominators, so they are not counted
+    twice.
+
+    Args:
+      nodes: set(Node), nodes in the snapshot.
+    Returns:
+      int, the number of bytes which would be freed if all of the nodes were
+          released.
+    """
+    members = set(self._post_order[node] for node in nodes)
+    root = len(self._nodes)
+    size = 0
+    for node in members:
+      dominator = self._idoms[node]
+      while dominator != root and dominator not in members:
+        dominator = self._idoms[dominator]
+      if dominator == root:
+        size += self._retained_sizes[node]
+    return size
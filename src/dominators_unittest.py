@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests DominatorTree."""
+
+import unittest
+
+import dominators
+import leak_finder
+
+
+class DominatorTreeTest(unittest.TestCase):
+
+  def _CreatePropertyEdge(self, n1, n2, name):
+    """Helper for creating test data."""
+
+    edge = leak_finder.Edge(n1.node_id, n2.node_id, 'property', name)
+    edge.SetFromNode(n1).SetToNode(n2)
+    n1.AddEdgeFrom(edge)
+    n2.AddEdgeTo(edge)
+
+  def _DataDiamond(self):
+    """Helper for creating test data.
+
+    (n1) - a -> (n2) - c -> (n4) - e -> (n5)
+       \\                  /
+        - b -> (n3) - d -
+
+    Returns:
+      List of Nodes in the data.
+    """
+    n1 = leak_finder.Node(1, 'object', 'Object', 1)
+    n2 = leak_finder.Node(2, 'object', 'Object', 10)
+    n3 = leak_finder.Node(3, 'object', 'Object', 100)
+    n4 = leak_finder.Node(4, 'object', 'Object', 1000)
+    n5 = leak_finder.Node(5, 'object', 'Object', 10000)
+    self._CreatePropertyEdge(n1, n2, 'a')
+    self._CreatePropertyEdge(n1, n3, 'b')
+    self._CreatePropertyEdge(n2, n4, 'c')
+    self._CreatePropertyEdge(n3, n4, 'd')
+    self._CreatePropertyEdge(n4, n5, 'e')
+    return [n1, n2, n3, n4, n5]
+
+  def testImmediateDominator(self):
+    [n1, n2, n3, n4, n5] = self._DataDiamond()
+    tree = dominators.DominatorTree([n5, n4, n3, n2, n1])
+    self.assertEqual(None, tree.ImmediateDominator(n1))
+    self.assertEqual(n1, tree.ImmediateDominator(n2))
+    self.assertEqual(n1, tree.ImmediateDominator(n3))
+    self.assertEqual(n1, tree.ImmediateDominator(n4))
+    self.assertEqual(n4, tree.ImmediateDominator(n5))
+    self.assertTrue(tree.Dominates(n1, n5))
+    self.assertTrue(tree.Dominates(n4, n4))
+    self.assertFalse(tree.Dominates(n2, n4))
+    self.assertFalse(tree.Dominates(n5, n4))
+
+  def testRetainedSize(self):
+    [n1, n2, n3, n4, n5] = self._DataDiamond()
+    tree = dominators.DominatorTree([n1, n2, n3, n4, n5])
+    self.assertEqual(11111, tree.RetainedSize(n1))
+    self.assertEqual(10, tree.RetainedSize(n2))
+    self.assertEqual(100, tree.RetainedSize(n3))
+    self.assertEqual(11000, tree.RetainedSize(n4))
+    self.assertEqual(10000, tree.RetainedSize(n5))
+
+  def testRetainedSizeOfSet(self):
+    [n1, n2, n3, n4, n5] = self._DataDiamond()
+    tree = dominators.DominatorTree([n1, n2, n3, n4, n5])
+    self.assertEqual(11110, tree.RetainedSizeOfSet([n2, n3, n4]))
+    self.assertEqual(11000, tree.RetainedSizeOfSet([n4, n5]))
+
+  def testUnreachableCycle(self):
+    n1 = leak_finder.Node(1, 'object', 'Object', 1)
+    n2 = leak_finder.Node(2, 'object', 'Object', 2)
+    n3 = leak_finder.Node(3, 'object', 'Object', 4)
+    self._CreatePropertyEdge(n1, n2, 'next')
+    self._CreatePropertyEdge(n2, n1, 'next')
+    self._CreatePropertyEdge(n2, n3, 'child')
+    tree = dominators.DominatorTree([n1, n2, n3])
+    self.assertEqual(None, tree.ImmediateDominator(n1))
+    self.assertEqual(n1, tree.ImmediateDominator(n2))
+    self.assertEqual(n2, tree.ImmediateDominator(n3))
+    self.assertEqual(7, tree.RetainedSize(n1))
+
+
+if __name__ == '__main__':
+  unittest.main()
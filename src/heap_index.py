@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Indexes and queries over a parsed heap snapshot.
+
+Finding objects in a parsed snapshot otherwise means scanning all nodes. The
+HeapIndex is built in one pass over the nodes and their edges, and answers
+questions like "all instances of a class" or "the objects reachable by the
+property path goog.Disposable.instances_" without scanning.
+
+Example:
+
+  index = heap_index.HeapIndex(leak_finder.Snapshotter().GetSnapshotFromFile(
+      'app.heapsnapshot'))
+  listeners = index.InstancesOf('goog.events.Listener')
+  for array in index.FindByPath('goog.Disposable.instances_'):
+    print(len(array.edges_from))
+"""
+
+
+class HeapIndex(object):
+  """Indexes the Node objects of a parsed heap snapshot.
+
+  Attributes:
+    _nodes_by_id: {int -> Node}, maps node ids to nodes.
+    _nodes_by_class: {str -> [Node]}, maps class names to their instances.
+    _edges_by_name: {str -> [Edge]}, maps edge names to the edges.
+  """
+
+  def __init__(self, nodes):
+    """Initializes the HeapIndex object.
+
+    Args:
+      nodes: set(Node), Node objects in the snapshot.
+    """
+    self._nodes_by_id = {}
+    self._nodes_by_class = {}
+    self._edges_by_name = {}
+    for node in nodes:
+      self._nodes_by_id[node.node_id] = node
+      self._nodes_by_class.setdefault(node.class_name, []).append(node)
+      for edge in node.edges_from:
+        self._edges_by_name.setdefault(edge.name_string, []).append(edge)
+
+  def __len__(self):
+    return len(self._nodes_by_id)
+
+  def Nodes(self):
+    """Returns all the indexed nodes."""
+    return self._nodes_by_id.values()
+
+  def NodeById(self, node_id):
+    """Returns the node with the given id, or None if there is no such node."""
+    return self._nodes_by_id.get(node_id)
+
+  def ClassNames(self):
+    """Returns the class names of the nodes, sorted."""
+    return sorted(self._nodes_by_class)
+
+  def InstancesOf(self, class_name):
+    """Returns the nodes of a class.
+
+    Args:
+      class_name: str, the class name, e.g., 'goog.events.Listener'.
+    Returns:
+      [Node], the instances of the class.
+    """
+    return list(self._nodes_by_class.get(class_name, []))
+
+  def EdgesNamed(self, name):
+    """Returns the edges with a given name.
+
+    Args:
+      name: str, the property name, or the index of an element as a string.
+    Returns:
+      [Edge], the edges.
+    """
+    return list(self._edges_by_name.get(name, []))
+
+  def FindByPath(self, path, start_nodes=None):
+    """Finds the nodes reachable by a property path.
+
+    Args:
+      path: str or [str], the property names, e.g., 'goog.events.listeners_'
+          or ['goog', 'events', 'listeners_'].
+      start_nodes: set(Node), the nodes the path starts from. If None, the
+          path may start from any node, i.e., the result are the nodes X for
+          which some object has the property path.X.
+    Returns:
+      set(Node), the nodes at the end of the path.
+    """
+    if isinstance(path, str):
+      path = path.split('.')
+    if not path:
+      return set(start_nodes if start_nodes is not None else self.Nodes())
+    if start_nodes is None:
+      found = set(edge.to_node for edge in self._edges_by_name.get(path[0], []))
+    else:
+      found = HeapIndex._Follow(start_nodes, path[0])
+    for name in path[1:]:
+      found = HeapIndex._Follow(found, name)
+    return found
+
+  @staticmethod
+  def _Follow(nodes, name):
+    """Returns the nodes pointed to by edges called name from nodes."""
+    return set(edge.to_node for node in nodes for edge in node.edges_from
+               if edge.name_string == name)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests HeapIndex."""
+
+import unittest
+
+import heap_index
+import leak_finder
+
+
+class HeapIndexTest(unittest.TestCase):
+
+  def _CreateEdge(self, n1, n2, edge_type, name):
+    """Helper for creating test data."""
+
+    edge = leak_finder.Edge(n1.node_id, n2.node_id, edge_type, name)
+    edge.SetFromNode(n1).SetToNode(n2)
+    n1.AddEdgeFrom(edge)
+    n2.AddEdgeTo(edge)
+
+  def _DataLibrary(self):
+    """Helper for creating test data.
+
+    (window) - goog -> (goog) - events -> (events) - listeners_ -> (array)
+        |                                                            |
+        `- other -> (events2) - listeners_ -> (array2)   (listener) <- [0]
+
+    Returns:
+      List of Nodes in the data.
+    """
+    window = leak_finder.Node(1, 'object', 'Window')
+    goog = leak_finder.Node(2, 'object', 'Object')
+    events = leak_finder.Node(3, 'object', 'Object')
+    array = leak_finder.Node(4, 'array', 'Array')
+    listener = leak_finder.Node(5, 'object', 'goog.events.Listener')
+    events2 = leak_finder.Node(6, 'object', 'Object')
+    array2 = leak_finder.Node(7, 'array', 'Array')
+    self._CreateEdge(window, goog, 'property', 'goog')
+    self._CreateEdge(goog, events, 'property', 'events')
+    self._CreateEdge(events, array, 'property', 'listeners_')
+    self._CreateEdge(array, listener, 'element', '0')
+    self._CreateEdge(window, events2, 'property', 'other')
+    self._CreateEdge(events2, array2, 'property', 'listeners_')
+    return [window, goog, events, array, listener, events2, array2]
+
+  def testLookups(self):
+    nodes = self._DataLibrary()
+    index = heap_index.HeapIndex(nodes)
+    self.assertEqual(7, len(index))
+    self.assertEqual(nodes[3], index.NodeById(4))
+    self.assertEqual(None, index.NodeById(8))
+    self.assertEqual(['Array', 'Object', 'Window', 'goog.events.Listener'],
+                     index.ClassNames())
+    self.assertEqual([nodes[3], nodes[6]], index.InstancesOf('Array'))
+    self.assertEqual([], index.InstancesOf('Missing'))
+    self.assertEqual([nodes[4]],
+                     [edge.to_node for edge in index.EdgesNamed('0')])
+
+  def testFindByPath(self):
+    nodes = self._DataLibrary()
+    [window, _, _, array, listener, _, array2] = nodes
+    index = heap_index.HeapIndex(nodes)
+    self.assertEqual(set([array]), index.FindByPath('goog.events.listeners_'))
+    self.assertEqual(set([array]),
+                     index.FindByPath(['events', 'listeners_']))
+    self.assertEqual(set([array, array2]), index.FindByPath('listeners_'))
+    self.assertEqual(set([listener]),
+                     index.FindByPath('events.listeners_.0'))
+    self.assertEqual(set([array]),
+                     index.FindByPath('goog.events.listeners_', [window]))
+    self.assertEqual(set(), index.FindByPath('events.listeners_', [window]))
+    self.assertEqual(set([window]), index.FindByPath([], [window]))
+
+
+if __name__ == '__main__':
+  unittest.main()
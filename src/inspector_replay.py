@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Records remote inspector sessions and replays them without a browser.
+
+RecordingClient wraps a RemoteInspectorClient and records the heap snapshots
+and the JavaScript evaluations of a session into a directory. ReplayClient has
+the same interface as RemoteInspectorClient and serves the recorded session
+back, optionally with simulated latency, so that the whole JSLeakCheck.Run
+pipeline, including the round trips for retrieving the stack traces, can be
+timed, profiled and tested offline.
+
+The directory contains the heap snapshots as separate files, and session.json
+describing the calls:
+
+  {"version": 1,
+   "calls": [{"method": "HeapSnapshot", "snapshot": "snapshot-0.heapsnapshot",
+              "duration": 2.5},
+             {"method": "EvaluateJavaScript", "expression": "a[0].stack",
+              "result": "Error\\n    at f (a.js:1:1)", "duration": 0.01}]}
+"""
+
+import json
+import logging
+import os
+import time
+
+import leak_finder
+
+
+_SESSION_FILE = 'session.json'
+_SESSION_VERSION = 1
+
+
+class Error(Exception):
+  pass
+
+
+class RecordingClient(object):
+  """Records the calls made to a RemoteInspectorClient.
+
+  The session file is rewritten after every call, so that an interrupted
+  session can still be replayed up to that point.
+  """
+
+  def __init__(self, client, directory, snapshot_extension='.heapsnapshot'):
+    """Initializes the RecordingClient object.
+
+    Args:
+      client: RemoteInspectorClient, the client whose calls are recorded.
+      directory: str, the directory to record the session into; created if
+          needed.
+      snapshot_extension: str, the extension of the heap snapshot files; they
+          are compressed if it ends in .gz, .bz2 or .xz.
+    Raises:
+      OSError: The directory cannot be created.
+    """
+    self._client = client
+    self._directory = directory
+    self._snapshot_extension = snapshot_extension
+    self._calls = []
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def HeapSnapshot(self, **kwargs):
+    """Takes a heap snapshot with the client and records it.
+
+    Args:
+      **kwargs: passed to the client.
+    Returns:
+      {}, what the client returned.
+    Raises:
+      IOError: The snapshot cannot be written.
+    """
+    start = time.time()
+    result = self._client.HeapSnapshot(**kwargs)
+    duration = time.time() - start
+    filename = 'snapshot-%d%s' % (
+        sum(1 for call in self._calls if call['method'] == 'HeapSnapshot'),
+        self._snapshot_extension)
+    leak_finder.SaveSnapshotFile(result['raw_data'],
+                                 os.path.join(self._directory, filename))
+    self._Record({'method': 'HeapSnapshot', 'snapshot': filename,
+                  'duration': duration})
+    return result
+
+  def EvaluateJavaScript(self, expression):
+    """Evaluates a JavaScript expression with the client and records it.
+
+    Args:
+      expression: str, the expression.
+    Returns:
+      What the client returned.
+    Raises:
+      IOError: The session file cannot be written.
+    """
+    start = time.time()
+    result = self._client.EvaluateJavaScript(expression)
+    self._Record({'method': 'EvaluateJavaScript', 'expression': expression,
+                  'result': result, 'duration': time.time() - start})
+    return result
+
+  def Stop(self):
+    self._client.Stop()
+
+  def _Record(self, call):
+    """Appends a call to the session file."""
+    self._calls.append(call)
+    path = os.path.join(self._directory, _SESSION_FILE)
+    with open(path + '.tmp', 'w') as f:
+      json.dump({'version': _SESSION_VERSION, 'calls': self._calls}, f,
+                indent=1)
+    os.rename(path + '.tmp', path)
+
+
+class ReplayClient(object):
+  """Serves a recorded session through the RemoteInspectorClient interface.
+
+  The heap snapshots are served in the recorded order. The JavaScript
+  evaluations are matched by their expressions, since the order in which the
+  leaks are examined may change; an expression evaluated several times is
+  served its recorded results in order, and the last one after that.
+
+  Attributes:
+    call_count: int, the number of calls served.
+    simulated_latency: float, the total number of seconds slept for simulating
+        the latency.
+  """
+
+  def __init__(self, directory, latency=0.0, recorded_latency=False,
+               sleep=time.sleep):
+    """Initializes the ReplayClient object.
+
+    Args:
+      directory: str, the directory the session was recorded into.
+      latency: float, the number of seconds each call is delayed by.
+      recorded_latency: bool, if True, each call is also delayed by the time
+          it took when it was recorded.
+      sleep: function, sleeps for the given number of seconds.
+    Raises:
+      Error: The session cannot be read.
+    """
+    self._directory = directory
+    self._latency = latency
+    self._recorded_latency = recorded_latency
+    self._sleep = sleep
+    self.call_count = 0
+    self.simulated_latency = 0.0
+    try:
+      with open(os.path.join(directory, _SESSION_FILE)) as f:
+        session = json.load(f)
+    except (IOError, ValueError) as e:
+      raise Error('Cannot read the recorded session in %s: %s' %
+                  (directory, e))
+    if session.get('version') != _SESSION_VERSION:
+      raise Error('Unsupported session version in %s: %s' %
+                  (directory, session.get('version')))
+    self._snapshots = []
+    self._evaluations = {}
+    for call in session['calls']:
+      if call['method'] == 'HeapSnapshot':
+        self._snapshots.append(call)
+      else:
+        self._evaluations.setdefault(call['expression'], []).append(call)
+
+  def HeapSnapshot(self, **unused_kwargs):
+    """Returns the next recorded heap snapshot.
+
+    Returns:
+      {}, with the key 'raw_data': str, the heap snapshot JSON.
+    Raises:
+      Error: All the recorded snapshots have been served, or the snapshot file
+          cannot be read.
+    """
+    if not self._snapshots:
+      raise Error('No more recorded heap snapshots')
+    call = self._snapshots.pop(0)
+    self._Wait(call)
+    try:
+      f = leak_finder.OpenSnapshotFile(os.path.join(self._directory,
+                                                    call['snapshot']))
+      try:
+        raw_data = f.read()
+      finally:
+        f.close()
+    except (IOError, leak_finder.Error) as e:
+      raise Error('Cannot read the recorded heap snapshot: %s' % e)
+    return {'raw_data': raw_data.decode('utf-8')}
+
+  def EvaluateJavaScript(self, expression):
+    """Returns the recorded result of evaluating a JavaScript expression.
+
+    Args:
+      expression: str, the expression.
+    Returns:
+      The recorded result, or None if the expression was not evaluated in the
+          recorded session, as for an expression evaluating to undefined. The
+          callers then treat e.g. the stack trace as missing.
+    """
+    calls = self._evaluations.get(expression)
+    if not calls:
+      logging.warning('Expression not evaluated in the recorded session: %s',
+                      expression)
+      return None
+    call = calls[0]
+    if len(calls) > 1:
+      calls.pop(0)
+    self._Wait(call)
+    return call['result']
+
+  def Stop(self):
+    pass
+
+  def _Wait(self, call):
+    """Simulates the latency of a call."""
+    self.call_count += 1
+    delay = self._latency
+    if self._recorded_latency:
+      delay += call['duration']
+    if delay > 0:
+      self._sleep(delay)
+      self.simulated_latency += delay
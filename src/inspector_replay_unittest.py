@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests RecordingClient and ReplayClient."""
+
+import json
+import shutil
+import tempfile
+import unittest
+
+import inspector_replay
+import jsleakcheck
+import snapshot_testdata
+
+
+class FakeInspectorClient(object):
+  """Returns a fixed heap snapshot and stack trace."""
+
+  def __init__(self):
+    self.expressions = []
+    self.stopped = False
+
+  def HeapSnapshot(self, **unused_kwargs):
+    """Returns a snapshot with a leak.
+
+    (window) - lib -> (lib) - container -> (array) - [0] -> (leaked)
+    """
+    data = snapshot_testdata.LeakSnapshotData(stack=False)
+    return {'raw_data': json.dumps(data)}
+
+  def EvaluateJavaScript(self, expression):
+    self.expressions.append(expression)
+    return snapshot_testdata.LEAK_STACK
+
+  def Stop(self):
+    self.stopped = True
+
+
+class InspectorReplayTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+    self._definition = jsleakcheck.LeakDefinition(
+        containers=['lib.container'], stacktrace_suffix='.stack')
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _Analyze(self, client):
+    checker = jsleakcheck.JSLeakCheck(self._definition)
+    leaks = checker._FindLeaks(client)
+    return [(leak.node.class_name, leak.stack.frames) for leak in leaks]
+
+  def testRecordAndReplay(self):
+    fake = FakeInspectorClient()
+    recorder = inspector_replay.RecordingClient(fake, self._directory)
+    expected = self._Analyze(recorder)
+    self.assertEqual([('Leaked', ['createLeak'])], expected)
+    self.assertEqual(['lib.container[0].stack'], fake.expressions)
+    recorder.Stop()
+    self.assertTrue(fake.stopped)
+
+    sleeps = []
+    replay = inspector_replay.ReplayClient(self._directory, latency=0.5,
+                                           sleep=sleeps.append)
+    self.assertEqual(expected, self._Analyze(replay))
+    self.assertEqual([0.5, 0.5], sleeps)
+    self.assertEqual(2, replay.call_count)
+    self.assertEqual(1.0, replay.simulated_latency)
+
+    # The session had a single snapshot.
+    self.assertRaises(inspector_replay.Error, replay.HeapSnapshot)
+
+  def testReplayedEvaluations(self):
+    fake = FakeInspectorClient()
+    recorder = inspector_replay.RecordingClient(fake, self._directory)
+    fake.EvaluateJavaScript = lambda expression: expression + '!'
+    recorder.EvaluateJavaScript('a')
+    recorder.EvaluateJavaScript('b')
+    fake.EvaluateJavaScript = lambda expression: expression + '?'
+    recorder.EvaluateJavaScript('a')
+
+    sleeps = []
+    replay = inspector_replay.ReplayClient(self._directory, latency=0.1,
+                                           recorded_latency=True,
+                                           sleep=sleeps.append)
+    self.assertEqual('b!', replay.EvaluateJavaScript('b'))
+    self.assertEqual('a!', replay.EvaluateJavaScript('a'))
+    self.assertEqual('a?', replay.EvaluateJavaScript('a'))
+    self.assertEqual('a?', replay.EvaluateJavaScript('a'))
+    self.assertIsNone(replay.EvaluateJavaScript('c'))
+    self.assertEqual(4, len(sleeps))
+    self.assertTrue(all(sleep >= 0.1 for sleep in sleeps))
+
+  def testUnrecordedStackTrace(self):
+    fake = FakeInspectorClient()
+    recorder = inspector_replay.RecordingClient(fake, self._directory)
+    recorder.HeapSnapshot()
+    recorder.Stop()
+
+    replay = inspector_replay.ReplayClient(self._directory)
+    checker = jsleakcheck.JSLeakCheck(self._definition)
+    leaks = checker._FindLeaks(replay)
+    self.assertEqual([('Leaked', None)],
+                     [(leak.node.class_name, leak.stack) for leak in leaks])
+
+  def testMissingSession(self):
+    self.assertRaises(inspector_replay.Error, inspector_replay.ReplayClient,
+                      self._directory)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -21,20 +21,43 @@ flags:
 
   --remote-debugging-port=9222 --js-flags=--stack_trace_limit=-1
 
+If the heap snapshot contains allocation stack traces (allocation tracking was
+enabled in the inspected tab), the creation stack traces of the leaking objects
+are read from them. Then the application doesn't need to store the stack
+traces into the objects.
 """
 
+import json
 import logging
+import math
 import optparse
 import os
 import re
+import signal
 import sys
+import time
 
+import columnar_snapshot
+import container_probe
+import dominators
+import inspector_replay
 import leak_finder
+import leak_history
 
-sys.path.append("../../pyautolib/")
-import remote_inspector_client
+import json_backends
+import progress
+import result_cache
+import snapshot_export
 import suppressions
 
+sys.path.append("../../pyautolib/")
+try:
+  import remote_inspector_client  # pylint: disable=g-import-not-at-top
+except ImportError:
+  # Only needed for taking heap snapshots; saved snapshots can be analyzed
+  # without it.
+  remote_inspector_client = None
+
 
 class LeakDefinition(object):
   """Holds the necessary configuration parameters to find a class of leaks.
@@ -99,6 +122,9 @@ CLOSURE_EVENT_LISTENERS = LeakDefinition(
     '',
     '.creationStack')
 
+_DEFAULT_RESULT_CACHE_SIZE_MB = 100
+_DEFAULT_RESULT_CACHE_AGE_DAYS = 30
+
 PREDEFINED_DEFINITIONS = {
     'closure-disposable': CLOSURE_DISPOSABLE,
     'closure-event-listeners': CLOSURE_EVENT_LISTENERS
@@ -106,35 +132,145 @@ PREDEFINED_DEFINITIONS = {
 
 
 class JSLeakCheck(object):
-  """Given a definition, take a heap snapshot, analyze and report new leaks."""
+  """Given a definition, take a heap snapshot, analyze and report new leaks.
 
-  def __init__(self, leak_definition):
+  Attributes:
+    dominator_tree: dominators.DominatorTree, the dominator tree of the last
+        analyzed snapshot, or None if it was not computed.
+  """
+
+  def __init__(self, leak_definition, prune_snapshot=False,
+               save_snapshot_to=None, incremental=False, json_backend=None,
+               suppression_list=None, results=None, export_leaks_to=None,
+               external_memory_dir=None, progress_reporter=None,
+               external_memory_workers=None, sample_size=None, history=None,
+               run_id=None, retaining_paths=None):
     """Initializes the JSLeakCheck object.
 
     Args:
       leak_definition: LeakDefinition, defines what kind of leaks to check.
+      prune_snapshot: bool, if True, the parts of the heap snapshot which are
+          irrelevant for leak_definition are discarded while parsing it.
+      save_snapshot_to: str, if given, the heap snapshots taken are written
+          into this file. The file is compressed if its name ends in .gz, .bz2
+          or .xz.
+      incremental: bool, if True, successive Run calls are assumed to analyze
+          the same application. Container elements whose retainers haven't
+          changed keep their classification and stack traces from the
+          previous run.
+      json_backend: str, the JSON library for decoding the heap snapshots
+          (see json_backends), or None for the fastest installed one.
+      suppression_list: [suppressions.Suppression], if given, these
+          suppressions are used instead of reading the suppressions file of
+          leak_definition.
+      results: result_cache.ResultCache, if given, the reports of saved heap
+          snapshots are cached in it, and replayed when the same snapshot is
+          analyzed again with the same definition and suppressions.
+      export_leaks_to: str, if given, the leaking objects, their retaining
+          paths and the objects near them are written into this file as a
+          small heap snapshot (see snapshot_export). The file is compressed if
+          its name ends in .gz, .bz2 or .xz.
+      external_memory_dir: str, if given, saved heap snapshots are converted
+          into memory mapped column files in this directory and analyzed
+          there (see columnar_snapshot), so that snapshots larger than the
+          memory can be analyzed. The retained sizes are not computed, and
+          the leaks cannot be exported.
+      progress_reporter: progress.ProgressReporter, if given, receives the
+          progress of parsing the heap snapshots, classifying the container
+          elements, computing the retained sizes and retrieving the stack
+          traces. Its cancellation token stops the analysis by raising
+          progress.Cancelled; the inspector clients created by Run are stopped
+          first.
+      external_memory_workers: int, the number of processes converting an
+          uncompressed snapshot into column files in the external memory
+          mode, or None for the number of processors.
+      sample_size: int, if given, only a sample of about this many container
+          elements, stratified by class, is classified, and the report
+          estimates the number of leaks of each class. Not supported in the
+          external memory mode.
+      history: leak_history.LeakHistory, if given, the unsuppressed leaks of
+          each run are recorded into it, and the report tells which of them
+          were seen by earlier runs and which leaks of the previous run were
+          not found any more.
+      run_id: str, identifies the first run in the history, e.g., the CI
+          build number; later runs append .2, .3 and so on. By default, the
+          time and the process id.
+      retaining_paths: int, if given, the report shows up to this many
+          distinct retaining paths of each new leak; see
+          leak_finder.LeakFinder.FindTopRetainingPaths. Not supported in the
+          external memory mode.
     """
     self.leak_definition = leak_definition
+    self._prune_snapshot = prune_snapshot
+    self._save_snapshot_to = save_snapshot_to
+    self._json_backend = json_backend
+    self._results = results
+    self._export_leaks_to = export_leaks_to
+    self._external_memory_dir = external_memory_dir
+    self._external_memory_workers = (external_memory_workers or
+                                     os.cpu_count() or 1)
+    self._sample_size = sample_size
+    self._history = history
+    self._run_id = run_id or '%s-%d' % (time.strftime('%Y%m%d-%H%M%S'),
+                                        os.getpid())
+    self._run_count = 0
+    self._retaining_paths = retaining_paths
+    # The LeakFinder whose last FindLeaks call found the leaks, for finding
+    # their retaining paths; None in the external memory mode.
+    self._paths_finder = None
+    self._progress = progress_reporter or progress.ProgressReporter()
+    self._suppressions_fingerprint = None
+    self._leak_finder = leak_finder.LeakFinder(
+        leak_definition.containers,
+        leak_definition.bad_nodes,
+        leak_definition.stacktrace_prefix,
+        leak_definition.stacktrace_suffix,
+        incremental,
+        self._progress)
+    self.dominator_tree = None
+    self._coverage = {}
+    self._stop_reason = None
+    self._estimates = []
+    self._groups = []
     self._suppressions = []
+    if suppression_list is not None:
+      self._suppressions = suppression_list
+      return
     if not self.leak_definition.suppressions:
       return
     logging.info('Reading suppressions from "%s"',
                  self.leak_definition.suppressions)
+    suppressions_filename = os.path.join(os.path.dirname(__file__),
+                                         self.leak_definition.suppressions)
     try:
       self._suppressions = suppressions.ReadSuppressionsFromFile(
-          os.path.join(os.path.dirname(__file__),
-                       self.leak_definition.suppressions))
+          suppressions_filename)
+      self._suppressions_fingerprint = result_cache.FileFingerprint(
+          suppressions_filename)
     except suppressions.Error as e:
       logging.error('Could not load suppressions: %s', str(e))
     except IOError as e:
       logging.warning('Could not read suppressions file: %s', str(e))
 
-  def Run(self, inspector_client=None):
+  def Run(self, inspector_client=None, time_budget=None, max_leaks=None,
+          snapshot_filename=None):
     """Runs all necessary steps to detect new leaks.
 
+    If a budget runs out, the analysis is stopped and the leaks found so far
+    are reported, together with how much of each container was examined.
+
     Args:
       inspector_client: RemoteInspectorClient, used to retrieve the heap
-          snapshot. If none is given, a new client is created.
+          snapshot. If none is given, a new client is created, unless
+          snapshot_filename is given.
+      time_budget: float, the number of seconds after which the analysis is
+          stopped, or None for no limit. Taking the heap snapshot cannot be
+          interrupted, but it counts towards the budget.
+      max_leaks: int, the number of leaks after which the analysis is stopped,
+          or None for no limit.
+      snapshot_filename: str, if given, a previously saved heap snapshot is
+          analyzed instead of taking a new one. The stack traces are read from
+          the snapshot, unless inspector_client is given.
     Returns:
       int, the number of new leaks found.
     Raises:
@@ -142,89 +278,585 @@ class JSLeakCheck(object):
           heap snapshot.
     """
 
+    cache_key = None
+    # A replayed report doesn't export the leaks.
+    if (self._results and snapshot_filename and not inspector_client and
+        not self._export_leaks_to):
+      cache_key = self._ResultCacheKey(snapshot_filename, max_leaks)
+      report = self._results.Get(cache_key)
+      if report:
+        logging.info('Replaying the cached report of %s', snapshot_filename)
+        self._ApplyHistory(report)
+        PrintReport(report)
+        return len(report['new_leaks'])
+
+    client = inspector_client
+    if not client and not snapshot_filename and not remote_inspector_client:
+      raise leak_finder.Error(
+          'Cannot take a heap snapshot: the remote_inspector_client module is '
+          'not available')
     try:
-      client = (inspector_client or
-                remote_inspector_client.RemoteInspectorClient())
+      if not client and not snapshot_filename:
+        client = remote_inspector_client.RemoteInspectorClient()
     except RuntimeError as e:
       raise leak_finder.Error(
           'Cannot create RemoteInspectorClient; most probably you have '
           'DevTools open on the tab we\'re trying to inspect. Original error '
           'message: %s' % e.__str__())
 
+    deadline = None
+    if time_budget is not None:
+      deadline = time.time() + time_budget
+
     try:
-      leaks = self._FindLeaks(client)
+      leaks = self._FindLeaks(client, deadline, max_leaks, snapshot_filename)
     finally:
       # We don't want to stop a passed-in inspector client so it can be reused.
-      if not inspector_client:
+      if client and not inspector_client:
         client.Stop()
 
-    if not leaks:
-      logging.info('No leaks found.')
-      return 0
+    report = self._BuildReport(leaks)
+    # Partial results depend on the timing, so they are not cached.
+    if cache_key and not report['stop_reason']:
+      self._results.Put(cache_key, report)
+    self._ApplyHistory(report)
+    PrintReport(report)
+    return len(report['new_leaks'])
 
-    logging.info('Scanning for new leaks.')
-    return len(self._MatchSuppressions(leaks))
+  def RunOnGrowth(self, inspector_client, trigger, time_budget=None,
+                  max_leaks=None):
+    """Runs the leak detection if the containers have grown enough.
 
-  def _FindLeaks(self, inspector_client):
+    The lengths of the containers are probed first, which is much cheaper than
+    taking a heap snapshot; the heap snapshot is only taken and analyzed if
+    trigger decides so. Best used in the incremental mode, so that the
+    analyses only examine the elements added since the previous one.
+
+    Args:
+      inspector_client: RemoteInspectorClient, used for probing the containers
+          and taking the heap snapshot.
+      trigger: container_probe.GrowthTrigger, decides whether the growth
+          warrants an analysis, and is reset after each analysis.
+      time_budget: float, see Run.
+      max_leaks: int, see Run.
+    Returns:
+      int, the number of new leaks found, or None if the heap was not
+          analyzed.
+    Raises:
+      leak_finder.Error: Something went wrong with probing the containers, or
+          taking or analyzing the heap snapshot.
+    """
+    try:
+      lengths = container_probe.ProbeContainers(inspector_client,
+                                                self.leak_definition)
+    except container_probe.Error as e:
+      raise leak_finder.Error(str(e))
+    logging.info('Container lengths: %s', ', '.join(
+        '%s=%d' % (container, lengths[container])
+        for container in sorted(lengths)))
+    analyze, reason = trigger.Decide(lengths)
+    if not analyze:
+      logging.info('Not taking a heap snapshot: %s', reason)
+      return None
+    logging.info('Taking a heap snapshot: %s', reason)
+    new_leaks = self.Run(inspector_client, time_budget, max_leaks)
+    trigger.Reset(lengths)
+    return new_leaks
+
+  def _ResultCacheKey(self, snapshot_filename, max_leaks):
+    """Returns the key of the report of a saved snapshot in the cache.
+
+    Args:
+      snapshot_filename: str, the heap snapshot file.
+      max_leaks: int, the leak limit of the analysis, or None.
+    Returns:
+      str, the key.
+    Raises:
+      leak_finder.Error: The snapshot file cannot be read.
+    """
+    try:
+      snapshot_fingerprint = result_cache.FileFingerprint(snapshot_filename)
+    except IOError as e:
+      raise leak_finder.Error('Cannot read %s: %s' % (snapshot_filename, e))
+    return self.ResultKey(snapshot_fingerprint, max_leaks)
+
+  def ResultKey(self, snapshot_fingerprint, max_leaks=None):
+    """Returns a key identifying the report of an analysis.
+
+    The key depends on the snapshot fingerprint, the leak definition, the
+    suppressions and the analysis options; the same key means the same report.
+
+    Args:
+      snapshot_fingerprint: str, identifies the heap snapshot, e.g., see
+          result_cache.FileFingerprint.
+      max_leaks: int, the leak limit of the analysis, or None.
+    Returns:
+      str, the key.
+    """
+    definition = {
+        'containers': self.leak_definition.containers,
+        'bad_nodes': self.leak_definition.bad_nodes,
+        'stacktrace_prefix': self.leak_definition.stacktrace_prefix,
+        'stacktrace_suffix': self.leak_definition.stacktrace_suffix}
+    options = {'prune_snapshot': self._prune_snapshot, 'max_leaks': max_leaks}
+    if self._external_memory_dir:
+      # The retained sizes are not computed in the external memory mode.
+      options['external_memory'] = True
+    if self._sample_size is not None:
+      options['sample_size'] = self._sample_size
+    if self._retaining_paths:
+      options['retaining_paths'] = self._retaining_paths
+    return result_cache.Fingerprint(snapshot_fingerprint, definition,
+                                    self._suppressions_fingerprint, options)
+
+  def AnalyzeFile(self, snapshot_filename, time_budget=None, max_leaks=None):
+    """Analyzes a saved heap snapshot without printing the report.
+
+    Args:
+      snapshot_filename: str, the heap snapshot file, possibly compressed.
+      time_budget: float, the number of seconds after which the analysis is
+          stopped, or None for no limit.
+      max_leaks: int, the number of leaks after which the analysis is stopped,
+          or None for no limit.
+    Returns:
+      {}, the report; see _BuildReport.
+    Raises:
+      leak_finder.Error: Something went wrong with analyzing the snapshot.
+    """
+    deadline = None
+    if time_budget is not None:
+      deadline = time.time() + time_budget
+    leaks = self._FindLeaks(None, deadline, max_leaks, snapshot_filename)
+    return self._BuildReport(leaks)
+
+  def AnalyzeNodes(self, nodes, allocation_traces=None, time_budget=None,
+                   max_leaks=None, dominator_tree=None, index=None):
+    """Analyzes an already parsed heap snapshot.
+
+    Used for analyzing the same snapshot several times without parsing it
+    again, e.g., by analysis_server. The names given to the nodes by the
+    analysis are cleared afterwards, so the nodes can be analyzed again with
+    another leak definition.
+
+    Args:
+      nodes: set(leak_finder.Node), the Node objects in the snapshot.
+      allocation_traces: leak_finder.AllocationTraces, the allocation stack
+          traces in the snapshot, if any.
+      time_budget: float, the number of seconds after which the analysis is
+          stopped, or None for no limit.
+      max_leaks: int, the number of leaks after which the analysis is stopped,
+          or None for no limit.
+      dominator_tree: dominators.DominatorTree, the dominator tree of nodes if
+          it is already known. Otherwise it is computed if needed and stored
+          into self.dominator_tree.
+      index: heap_index.HeapIndex, the index of nodes if it is already known.
+    Returns:
+      {}, the report; see _BuildReport.
+    Raises:
+      leak_finder.Error: Something went wrong with analyzing the snapshot.
+    """
+    deadline = None
+    if time_budget is not None:
+      deadline = time.time() + time_budget
+    try:
+      leaks = self._AnalyzeNodes(nodes, allocation_traces, None, deadline,
+                                 max_leaks, dominator_tree, index)
+      return self._BuildReport(leaks)
+    finally:
+      self._leak_finder.ResetNames()
+
+  def _FindLeaks(self, inspector_client, deadline=None, max_leaks=None,
+                 snapshot_filename=None):
     """Take a heap snapshot and run LeakFinder on it.
 
     Args:
       inspector_client: RemoteInspectorClient, used to retrieve the heap
-        snapshot.
+        snapshot and the stack traces.
+      deadline: float, the time.time() value after which the analysis is
+          stopped, or None for no limit.
+      max_leaks: int, the number of leaks after which the analysis is stopped,
+          or None for no limit.
+      snapshot_filename: str, if given, the heap snapshot is read from this
+          file instead of using inspector_client.
     Returns:
       [leak_finder.LeakNode], a list of found leaks.
     Raises:
         leak_finder.Error: Something went wrong with taking or analyzing the
             heap snapshot.
     """
-    logging.info('Taking heap snapshot')
+    if snapshot_filename and self._external_memory_dir:
+      return self._FindLeaksInColumns(snapshot_filename, deadline, max_leaks)
     try:
-      nodes = leak_finder.Snapshotter().GetSnapshot(inspector_client)
+      snapshotter = leak_finder.Snapshotter(
+          self.leak_definition if self._prune_snapshot else None,
+          self._json_backend, self._progress)
+      if snapshot_filename:
+        logging.info('Reading heap snapshot from %s', snapshot_filename)
+        nodes = snapshotter.GetSnapshotFromFile(snapshot_filename)
+      else:
+        logging.info('Taking heap snapshot')
+        nodes = snapshotter.GetSnapshot(inspector_client,
+                                        self._save_snapshot_to)
+    except json_backends.Error as e:
+      raise leak_finder.Error(str(e))
     except leak_finder.Error as e:
       logging.error('Error parsing snapshot: %s', str(e))
       raise
 
-    logging.info('Analyzing heap snapshot')
+    return self._AnalyzeNodes(nodes, snapshotter.allocation_traces,
+                              inspector_client, deadline, max_leaks)
+
+  def _FindLeaksInColumns(self, snapshot_filename, deadline=None,
+                          max_leaks=None):
+    """Runs ColumnarLeakFinder on a saved heap snapshot.
+
+    Args:
+      snapshot_filename: str, the heap snapshot file.
+      deadline: float, the time.time() value after which the analysis is
+          stopped, or None for no limit.
+      max_leaks: int, the number of leaks after which the analysis is stopped,
+          or None for no limit.
+    Returns:
+      [leak_finder.LeakNode], a list of found leaks, with their stack traces.
+    Raises:
+        leak_finder.Error: Something went wrong with analyzing the snapshot.
+    """
+    logging.info('Opening the columns of %s in %s', snapshot_filename,
+                 self._external_memory_dir)
+    try:
+      snapshot = columnar_snapshot.OpenColumns(
+          snapshot_filename, self._external_memory_dir, self._json_backend,
+          self._external_memory_workers)
+    except (IOError, KeyError, ValueError, columnar_snapshot.Error,
+            json_backends.Error) as e:
+      raise leak_finder.Error('Cannot read %s: %s' % (snapshot_filename, e))
     try:
-      leaks = list(leak_finder.LeakFinder(
-          self.leak_definition.containers,
-          self.leak_definition.bad_nodes,
+      finder = columnar_snapshot.ColumnarLeakFinder(
+          self.leak_definition.containers, self.leak_definition.bad_nodes,
           self.leak_definition.stacktrace_prefix,
-          self.leak_definition.stacktrace_suffix).FindLeaks(nodes))
+          self.leak_definition.stacktrace_suffix)
+      if self._sample_size is not None:
+        logging.warning('Sampling is not supported in the external memory '
+                        'mode; classifying all the container elements')
+      if self._retaining_paths:
+        logging.warning('Retaining paths are not shown in the external memory '
+                        'mode')
+      time_budget = None
+      if deadline is not None:
+        time_budget = deadline - time.time()
+      leaks = list(finder.FindLeaks(snapshot, time_budget, max_leaks))
+      self._coverage = finder.coverage
+      self._stop_reason = finder.stop_reason
+      self._estimates = []
+      self._groups = []
+      self._paths_finder = None
+      self.dominator_tree = None
+      self._progress.Start('stacks', len(leaks), 'leaks')
+      for index, leak in enumerate(leaks):
+        self._progress.Update(index)
+        leak.RetrieveStackTrace()
+      self._progress.Finish()
+    finally:
+      snapshot.Close()
+    return leaks
+
+  def _AnalyzeNodes(self, nodes, allocation_traces, inspector_client,
+                    deadline=None, max_leaks=None, dominator_tree=None,
+                    index=None):
+    """Runs LeakFinder on a parsed heap snapshot.
+
+    Args:
+      nodes: set(leak_finder.Node), the Node objects in the snapshot.
+      allocation_traces: leak_finder.AllocationTraces, the allocation stack
+          traces in the snapshot, or None.
+      inspector_client: RemoteInspectorClient, used to retrieve the stack
+          traces, or None.
+      deadline: float, the time.time() value after which the analysis is
+          stopped, or None for no limit.
+      max_leaks: int, the number of leaks after which the analysis is stopped,
+          or None for no limit.
+      dominator_tree: dominators.DominatorTree, the dominator tree of nodes,
+          or None for computing it if needed.
+      index: heap_index.HeapIndex, the index of nodes, or None for building
+          it.
+    Returns:
+      [leak_finder.LeakNode], a list of found leaks.
+    Raises:
+        leak_finder.Error: Something went wrong with analyzing the snapshot.
+    """
+    logging.info('Analyzing heap snapshot')
+    finder = self._leak_finder
+    time_budget = None
+    if deadline is not None:
+      time_budget = deadline - time.time()
+    try:
+      leaks = list(finder.FindLeaks(nodes, time_budget, max_leaks, index,
+                                    self._sample_size))
     except leak_finder.Error as e:
       logging.error('Error analyzing snapshot: %s', str(e))
       raise
-
-    logging.info('Retrieving creating stack traces for leaking objects')
-    for leak in leaks:
-      leak.RetrieveStackTrace(inspector_client)
+    self._coverage = finder.coverage
+    self._stop_reason = finder.stop_reason
+    self._estimates = finder.Estimates()
+    self._paths_finder = finder
+    if finder.reused_count:
+      logging.info('Reused the classification of %d objects from the previous '
+                   'run', finder.reused_count)
+
+    # A pruned snapshot doesn't contain the objects retained by the leaks, so
+    # their retained sizes cannot be computed.
+    self.dominator_tree = dominator_tree
+    if not self.dominator_tree and deadline is not None and (
+        time.time() >= deadline):
+      logging.warning('Time budget exhausted; not computing retained sizes')
+    elif leaks and not self._prune_snapshot:
+      if not self.dominator_tree:
+        logging.info('Computing retained sizes of leaking objects')
+        self._progress.Start('dominators')
+        self.dominator_tree = dominators.DominatorTree(nodes)
+        self._progress.Finish()
+      self._progress.Start('retained sizes', len(leaks), 'leaks')
+      for index, leak in enumerate(leaks):
+        self._progress.Update(index)
+        leak.retained_size = self.dominator_tree.RetainedSize(leak.node)
+      self._progress.Finish()
+      leaks.sort(key=lambda leak: leak.retained_size, reverse=True)
+
+    # The leaks sharing their retainers share the stack traces of their
+    # representatives, which saves a round trip for each of the others.
+    self._groups = finder.GroupLeaks(leaks)
+    representatives = [leak for group in self._groups
+                       for leak in group.Representatives()]
+    logging.info('Retrieving creating stack traces for %d of %d leaking '
+                 'objects', len(representatives), len(leaks))
+    self._progress.Start('stacks', len(representatives), 'leaks')
+    for index, leak in enumerate(representatives):
+      self._progress.Update(index)
+      if deadline is not None and time.time() >= deadline:
+        logging.warning('Time budget exhausted; not retrieving stack traces '
+                        'for %d leaks', len(representatives) - index)
+        self._stop_reason = self._stop_reason or 'time budget exhausted'
+        self._progress.Finish(index)
+        break
+      # Leaks carried over from the previous run already have a stack trace.
+      if not leak.stack:
+        leak.RetrieveStackTrace(inspector_client, allocation_traces)
+    else:
+      self._progress.Finish()
+    for group in self._groups:
+      group.ShareStacks()
+
+    if leaks and self._export_leaks_to:
+      logging.info('Exporting the leaks into %s', self._export_leaks_to)
+      try:
+        node_count = snapshot_export.ExportLeaks(
+            leaks, finder.windows, finder.bad_stop_nodes,
+            self._export_leaks_to)
+        logging.info('Exported %d objects', node_count)
+      except IOError as e:
+        raise leak_finder.Error('Cannot export the leaks: %s' % e)
     return leaks
 
+  def _RetainedSize(self, nodes):
+    """Returns the retained size of a group of leaking objects.
+
+    Args:
+      nodes: [leak_finder.Node], the leaking objects.
+    Returns:
+      int, the number of bytes retained by the objects, or None if the sizes
+          are not known.
+    """
+    if not self.dominator_tree:
+      return None
+    return self.dominator_tree.RetainedSizeOfSet(nodes)
+
+  def _BuildReport(self, leaks):
+    """Builds the report of an analysis.
+
+    The report only contains plain data, so that it can be serialized as JSON.
+
+    Args:
+      leaks: [leak_finder.LeakNode], a list of found leaks.
+    Returns:
+      {}, the report, with the keys:
+          'stop_reason': str, why the analysis was stopped early, or None.
+          'coverage': {str -> [int, int]}, the number of examined and all
+              elements of each container.
+          'matched_suppressions': [{}], the suppressions which matched leaks,
+              with the keys 'description', 'count' and 'retained_size'.
+          'new_leaks': [{}], the leaks which don't match any suppression, with
+              the keys 'class_name', 'count', 'retained_size' and 'stack',
+              and 'retaining_paths', the most distinct retaining paths of
+              one of the leaking objects, if requested.
+          Both lists are sorted by the number of bytes retained, if known.
+          'estimates': [{}], if a sample was classified, the estimated leaks
+              per class, with the keys 'class_name', 'population',
+              'sampled', 'leaks', 'estimate', 'low' and 'high'; see
+              leak_finder.LeakEstimate.
+          'groups': [{}], the groups of leaks sharing their retainers, with
+              the keys 'retainers', the descriptions of the shared retainers,
+              'count', 'classes', the number of leaking objects of each class,
+              and 'retained_size'; sorted like the leaks. Only the groups of
+              more than one leak are included.
+    """
+    if not leaks:
+      logging.info('No leaks found.')
+    else:
+      logging.info('Scanning for new leaks.')
+    matched_suppressions, new_leaks = self._MatchSuppressions(leaks)
+
+    matched = []
+    for index, nodes in matched_suppressions.items():
+      matched.append({
+          'description': self._suppressions[index].description,
+          'count': len(nodes),
+          'retained_size': self._RetainedSize(nodes)})
+    matched.sort(key=lambda match: (match['retained_size'] or 0,
+                                    match['count']),
+                 reverse=True)
+
+    groups = []
+    for group in self._groups:
+      if len(group.leaks) < 2:
+        continue
+      groups.append({
+          'retainers': [node.ToJavaScript() for node in group.retainers],
+          'count': len(group.leaks),
+          'classes': dict(group.classes),
+          'retained_size': self._RetainedSize([leak.node
+                                               for leak in group.leaks])})
+    groups.sort(key=lambda group: (group['retained_size'] or 0,
+                                   group['count']),
+                reverse=True)
+
+    new_leak_entries = []
+    for leak in new_leaks:
+      entry = {'class_name': leak['leak'].node.class_name,
+               'count': leak['count'],
+               'retained_size': leak['retained_size'],
+               'stack': list(leak['leak'].stack.frames)}
+      if self._retaining_paths and self._paths_finder:
+        entry['retaining_paths'] = self._paths_finder.DescribeRetainingPaths(
+            leak['leak'].node, self._retaining_paths)
+      new_leak_entries.append(entry)
+
+    return {
+        'stop_reason': self._stop_reason,
+        'coverage': dict((name, list(coverage))
+                         for name, coverage in self._coverage.items()),
+        'matched_suppressions': matched,
+        'new_leaks': new_leak_entries,
+        'estimates': [{'class_name': estimate.class_name,
+                       'population': estimate.population,
+                       'sampled': estimate.sampled,
+                       'leaks': estimate.leaks,
+                       'estimate': estimate.estimate,
+                       'low': estimate.low,
+                       'high': estimate.high}
+                      for estimate in self._estimates],
+        'groups': groups,
+    }
+
+  def _ApplyHistory(self, report):
+    """Classifies the new leaks of a report against the history.
+
+    The new leaks get the key 'history': {}, with the keys 'first_seen',
+    'last_seen' and 'run_count' of the earlier runs they were seen in, or None
+    if none. The report gets the keys 'previous_run', the id of the previous
+    run, and 'fixed_leaks', the leaks of the previous run which were not found
+    any more, with the keys 'class_name', 'stack', 'first_seen', 'last_seen'
+    and 'run_count'. The new leaks are then recorded as the leaks of this run,
+    unless the analysis was stopped early or classified a sample.
+
+    The history is not applied to the cached reports, since it changes with
+    every run.
+
+    Args:
+      report: {}, the report built by _BuildReport; modified in place.
+    """
+    if not self._history:
+      return
+    new_leaks = report['new_leaks']
+    signatures = [leak_history.Signature(leak['class_name'], leak['stack'])
+                  for leak in new_leaks]
+    # A leak missing from a stopped or sampled run may just not have been
+    # examined, so such runs are neither recorded nor report fixed leaks.
+    partial = report['stop_reason'] or any(
+        estimate['sampled'] < estimate['population']
+        for estimate in report.get('estimates', []))
+    run_id = None
+    try:
+      classification = self._history.Classify(signatures)
+      if not partial:
+        self._run_count += 1
+        run_id = self._run_id
+        if self._run_count > 1:
+          run_id = '%s.%d' % (run_id, self._run_count)
+        self._history.Record(run_id, [(leak['class_name'], leak['stack'],
+                                       leak['count']) for leak in new_leaks])
+    except leak_history.Error as e:
+      # The analysis itself is still valid.
+      logging.error('Cannot use the leak history: %s', e)
+      return
+    for leak, signature in zip(new_leaks, signatures):
+      known = classification.known.get(signature)
+      leak['history'] = known and {'first_seen': known.first_seen,
+                                   'last_seen': known.last_seen,
+                                   'run_count': known.run_count}
+    report['previous_run'] = classification.previous_run
+    report['fixed_leaks'] = [{'class_name': known.class_name,
+                              'stack': known.stack,
+                              'first_seen': known.first_seen,
+                              'last_seen': known.last_seen,
+                              'run_count': known.run_count}
+                             for known in classification.fixed
+                             if not partial]
+    if run_id:
+      logging.info('Recorded run %s into the leak history', run_id)
+    else:
+      logging.info('Not recording the partial run into the leak history')
+
   def _MatchSuppressions(self, leaks):
     """Match the list of found leaks against the list of suppressions.
 
-    Prints the leaks not covered by suppressions, and which suppressions
-    were used.
+    The leaks sharing their retainers usually share their stack traces, so
+    the outcome is computed once for each class and stack trace.
 
     Args:
       leaks: [leak_finder.LeakNode], a list of found leaks.
     Returns:
-      [leak_finder.LeakNode], leaks which don't match any suppression.
+      ({int -> [leak_finder.Node]}, [{}]), the leaking objects matched by
+          each suppression (by index), and the groups of leaks which don't
+          match any suppression, sorted by the number of bytes the leaking
+          objects retain, if known.
     """
     matched_suppressions = {}
     new_leaks = []
+    # Maps the class names and stack traces to the index of the matching
+    # suppression, or to the matching new leak.
+    outcomes = {}
     for leak in leaks:
       if not leak.stack:
         logging.error('Found leak of type %s without a creation stack',
                       leak.node.class_name)
         continue
 
+      key = (leak.node.class_name, tuple(leak.stack.frames))
+      outcome = outcomes.get(key)
+      if outcome is not None:
+        if isinstance(outcome, dict):
+          outcome['count'] += 1
+          outcome['nodes'].append(leak.node)
+        else:
+          matched_suppressions[outcome].append(leak.node)
+        continue
+
       suppression_found = False
       # First, try to match against one of the defined suppressions.
       for index, suppression in enumerate(self._suppressions):
         if suppression.Match(leak.node.class_name, leak.stack.frames):
-          matched_suppressions[index] = (
-              matched_suppressions.get(index, 0) + 1)
+          matched_suppressions.setdefault(index, []).append(leak.node)
+          outcomes[key] = index
           suppression_found = True
           break
 
@@ -235,6 +867,8 @@ class JSLeakCheck(object):
           if known_leak['suppression'].Match(leak.node.class_name,
                                              leak.stack.frames):
             known_leak['count'] += 1
+            known_leak['nodes'].append(leak.node)
+            outcomes[key] = known_leak
             suppression_found = True
             break
 
@@ -246,31 +880,165 @@ class JSLeakCheck(object):
             'suppression': suppressions.Suppression(
                 '', leak.node.class_name, leak.stack.frames),
             'count': 1,
+            'nodes': [leak.node],
             'leak': leak})
+        outcomes[key] = new_leaks[-1]
 
-    if matched_suppressions:
-      print 'The following suppressions matched found leaks:'
-      for index, count in matched_suppressions.items():
-        print ' %d %s' % (count, self._suppressions[index].description)
-      print ''
+    for leak in new_leaks:
+      leak['retained_size'] = self._RetainedSize(leak['nodes'])
+    new_leaks.sort(key=lambda leak: (leak['retained_size'] or 0, leak['count']),
+                   reverse=True)
+    return matched_suppressions, new_leaks
 
-    if new_leaks:
-      print 'New memory leaks found:'
-      for leak in new_leaks:
-        print 'Leak: %d %s' % (leak['count'], leak['leak'].node.class_name)
-        print 'allocated at:'
-        print '  ' + '\n  '.join(leak['leak'].stack.frames)
 
-    return new_leaks
+def _FormatSize(retained_size):
+  """Returns a description of a retained size for the report."""
+  if retained_size is None:
+    return ''
+  return ' (%d bytes retained)' % retained_size
+
+
+def _FormatTime(timestamp):
+  """Returns a description of a time in the history for the report."""
+  return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
+
+
+def PrintReport(report):
+  """Prints a report built by JSLeakCheck.
+
+  Prints how much of each container was analyzed if the analysis was stopped
+  early, the estimated leaks per class if a sample was analyzed, the
+  suppressions which matched leaks, the new leaks and the groups of leaks
+  sharing their retainers. If the leaks were
+  classified against a leak history, tells which new leaks were seen by
+  earlier runs, and which leaks of the previous run were not found.
+
+  Args:
+    report: {}, the report.
+  """
+  if report['stop_reason']:
+    print('Analysis stopped early (%s), the results are partial:' %
+          report['stop_reason'])
+    for container_name in sorted(report['coverage']):
+      examined, total = report['coverage'][container_name]
+      print(' %s: examined %d of %d elements' % (container_name, examined,
+                                                  total))
+    print('')
+
+  if report['estimates']:
+    print('Estimated leaks per class from a sample (95% confidence):')
+    for estimate in report['estimates']:
+      if estimate['estimate'] is None:
+        continue
+      print(' ~%d (%d-%d) of %d %s; %d of %d sampled leak' % (
+          round(estimate['estimate']), math.floor(estimate['low']),
+          math.ceil(estimate['high']), estimate['population'],
+          estimate['class_name'], estimate['leaks'], estimate['sampled']))
+    print('')
+
+  if report['matched_suppressions']:
+    print('The following suppressions matched found leaks:')
+    for match in report['matched_suppressions']:
+      print(' %d %s%s' % (match['count'], match['description'],
+                          _FormatSize(match['retained_size'])))
+    print('')
+
+  if report['new_leaks']:
+    print('New memory leaks found:')
+    for leak in report['new_leaks']:
+      print('Leak: %d %s%s' % (leak['count'], leak['class_name'],
+                               _FormatSize(leak['retained_size'])))
+      if 'history' in leak:
+        if leak['history']:
+          print('recurring: seen in %d earlier runs since %s' % (
+              leak['history']['run_count'],
+              _FormatTime(leak['history']['first_seen'])))
+        else:
+          print('not seen in earlier runs')
+      print('allocated at:')
+      print('  ' + '\n  '.join(leak['stack']))
+      if leak.get('retaining_paths'):
+        print('retained by:')
+        print('  ' + '\n  '.join(leak['retaining_paths']))
+
+  if report['groups']:
+    print('')
+    print('Leaks sharing their retainers:')
+    for group in report['groups']:
+      print(' %d objects (%s) retained by %s%s' % (
+          group['count'], ', '.join(
+              '%d %s' % (group['classes'][class_name], class_name)
+              for class_name in sorted(group['classes'])),
+          ', '.join(group['retainers']), _FormatSize(group['retained_size'])))
+
+  if report.get('fixed_leaks'):
+    if report['new_leaks']:
+      print('')
+    print('The following leaks of the previous run (%s) were not found:' %
+          report['previous_run'])
+    for leak in report['fixed_leaks']:
+      print('Leak: %s, seen in %d runs from %s to %s' % (
+          leak['class_name'], leak['run_count'],
+          _FormatTime(leak['first_seen']), _FormatTime(leak['last_seen'])))
+      print('allocated at:')
+      print('  ' + '\n  '.join(leak['stack']))
+
+
+def PrintClassHistogram(histogram, baseline=None, limit=50):
+  """Prints a class histogram, or its growth compared to a baseline.
+
+  Args:
+    histogram: leak_finder.ClassHistogram, the histogram to print.
+    baseline: leak_finder.ClassHistogram, if given, the growth of each class
+        since this histogram is printed instead.
+    limit: int, the maximum number of classes to print.
+  """
+  if baseline:
+    print('Growth since the baseline (count, self size, class):')
+    for class_name, count, size in histogram.Diff(baseline)[:limit]:
+      print(' %+8d %+12d %s' % (count, size, class_name))
+  else:
+    print('Classes (count, self size, class):')
+    for class_name, count, size in histogram.Classes()[:limit]:
+      print(' %8d %12d %s' % (count, size, class_name))
+
+
+def _ProbeAndRun(leak_checker, inspector_client, token, options):
+  """Analyzes the heap whenever the probed containers have grown enough.
+
+  Args:
+    leak_checker: JSLeakCheck, analyzes the heap.
+    inspector_client: RemoteInspectorClient, the client to probe with.
+    token: progress.CancellationToken, stops the probing when cancelled.
+    options: optparse.Values, the command line options.
+  Returns:
+    int, the total number of new leaks found.
+  Raises:
+    leak_finder.Error: Something went wrong with probing, or taking or
+        analyzing the heap snapshots.
+  """
+  trigger = container_probe.GrowthTrigger(options.min_growth,
+                                          options.growth_trend or None)
+  new_leaks = 0
+  probe_count = 0
+  while options.probes is None or probe_count < options.probes:
+    if probe_count and token.Wait(options.probe_interval):
+      logging.info('Stopped probing')
+      break
+    probe_count += 1
+    new_leaks += leak_checker.RunOnGrowth(inspector_client, trigger,
+                                          options.time_budget,
+                                          options.max_leaks) or 0
+  return new_leaks
 
 
 def main():
   parser = optparse.OptionParser(usage='usage: %prog -d DEFINITION',
                                  epilog='Possible definitions are: %s' %
-                                 ', '.join(PREDEFINED_DEFINITIONS.keys()))
+                                 ', '.join(sorted(PREDEFINED_DEFINITIONS)))
 
   parser.add_option('-d', '--leak_definition', type='choice', action='store',
-                    dest='definition', choices=PREDEFINED_DEFINITIONS.keys(),
+                    dest='definition', choices=sorted(PREDEFINED_DEFINITIONS),
                     metavar='DEFINITION')
 
   group = optparse.OptionGroup(parser, 'Manually define conditions for leaks',
@@ -305,6 +1073,164 @@ def main():
                          'tab_pattern'))
   parser.add_option_group(group)
 
+  parser.add_option('--prune', action='store_true', default=False,
+                    dest='prune',
+                    help=('Discard the parts of the heap snapshot which cannot '
+                          'retain the objects in the containers while parsing '
+                          'it; reduces memory usage'))
+
+  group = optparse.OptionGroup(parser, 'Saved heap snapshots')
+  group.add_option('--snapshot', metavar='FILENAME', dest='snapshot',
+                   help=('Analyze a saved heap snapshot instead of taking one; '
+                         'it may be compressed with gzip, bzip2 or xz'))
+  group.add_option('--save-snapshot', metavar='FILENAME',
+                   dest='save_snapshot',
+                   help=('Save the heap snapshot into FILENAME; compressed if '
+                         'FILENAME ends in .gz, .bz2 or .xz'))
+  group.add_option('--export-leaks', metavar='FILENAME', dest='export_leaks',
+                   help=('Write the leaking objects, their retaining paths and '
+                         'nearby objects into FILENAME as a small heap '
+                         'snapshot which loads quickly in DevTools'))
+  group.add_option('--external-memory', metavar='DIRECTORY',
+                   dest='external_memory',
+                   help=('Convert the saved heap snapshot into column files '
+                         'in DIRECTORY and analyze it there; slower, but '
+                         'needs only a fraction of the snapshot size in '
+                         'memory. Retained sizes are not computed'))
+  group.add_option('--result-cache', metavar='DIRECTORY', dest='result_cache',
+                   help=('Cache the reports of saved heap snapshots in '
+                         'DIRECTORY, and replay them when the same snapshot is '
+                         'analyzed with the same definition and suppressions'))
+  group.add_option('--result-cache-size', type='int', metavar='MB',
+                   default=_DEFAULT_RESULT_CACHE_SIZE_MB,
+                   dest='result_cache_size',
+                   help='Maximum size of the result cache (default: %default)')
+  group.add_option('--result-cache-age', type='float', metavar='DAYS',
+                   default=_DEFAULT_RESULT_CACHE_AGE_DAYS,
+                   dest='result_cache_age',
+                   help=('Evict the cached reports unused for DAYS '
+                         '(default: %default)'))
+  group.add_option('--history', metavar='FILENAME', dest='history',
+                   help=('Record the unsuppressed leaks of each run into the '
+                         'database FILENAME, and report which of them are '
+                         'new, recurring or fixed'))
+  group.add_option('--run-id', metavar='ID', dest='run_id',
+                   help=('Identify the run in the leak history by ID, e.g., '
+                         'the CI build number (default: the time and the '
+                         'process id)'))
+  parser.add_option_group(group)
+
+  group = optparse.OptionGroup(parser, 'Growth probing',
+                               ('Poll the lengths of the containers, and only '
+                                'take and analyze a heap snapshot when they '
+                                'have grown'))
+  group.add_option('--probe-interval', type='float', metavar='SECONDS',
+                   dest='probe_interval',
+                   help='Probe the container lengths every SECONDS')
+  group.add_option('--probes', type='int', metavar='COUNT', dest='probes',
+                   help='Stop after COUNT probes (default: run until stopped)')
+  group.add_option('--min-growth', type='int', metavar='COUNT',
+                   default=container_probe.DEFAULT_MIN_GROWTH,
+                   dest='min_growth',
+                   help=('Analyze the heap when a container has grown by '
+                         'COUNT elements since the last analysis (default: '
+                         '%default)'))
+  group.add_option('--growth-trend', type='int', metavar='PROBES',
+                   default=container_probe.DEFAULT_TREND_PROBES,
+                   dest='growth_trend',
+                   help=('Also analyze the heap when a container has grown in '
+                         'PROBES consecutive probes; 0 disables this '
+                         '(default: %default)'))
+  parser.add_option_group(group)
+
+  group = optparse.OptionGroup(parser, 'Recorded sessions',
+                               ('Record the traffic with the browser, and '
+                                'replay it for timing the whole analysis '
+                                'offline'))
+  group.add_option('--record', metavar='DIRECTORY', dest='record',
+                   help=('Record the heap snapshot and the JavaScript '
+                         'evaluations of the session into DIRECTORY'))
+  group.add_option('--replay', metavar='DIRECTORY', dest='replay',
+                   help=('Replay the session recorded into DIRECTORY instead '
+                         'of connecting to the browser'))
+  group.add_option('--replay-latency', type='float', metavar='SECONDS',
+                   default=0.0, dest='replay_latency',
+                   help=('Delay each replayed call by SECONDS '
+                         '(default: %default)'))
+  group.add_option('--replay-recorded-latency', action='store_true',
+                   default=False, dest='replay_recorded_latency',
+                   help=('Also delay each replayed call by the time it took '
+                         'when it was recorded'))
+  parser.add_option_group(group)
+
+  group = optparse.OptionGroup(parser, 'Batch analysis',
+                               ('Analyze all the saved heap snapshots in a '
+                                'directory in parallel'))
+  group.add_option('--batch', metavar='DIRECTORY', dest='batch',
+                   help=('Analyze the heap snapshots in DIRECTORY and its '
+                         'subdirectories'))
+  group.add_option('--batch-output', metavar='DIRECTORY', dest='batch_output',
+                   help=('Write the report of each snapshot and the '
+                         'aggregated report into DIRECTORY; the snapshots '
+                         'whose reports there are current are skipped '
+                         '(default: jsleakcheck-results in the batch '
+                         'directory)'))
+  group.add_option('--jobs', type='int', metavar='COUNT', dest='jobs',
+                   help=('Analyze at most COUNT snapshots at the same time; '
+                         'with --external-memory, convert the snapshot into '
+                         'column files with COUNT processes (default: the '
+                         'number of processors)'))
+  group.add_option('--memory-limit', type='int', metavar='MB',
+                   dest='memory_limit',
+                   help=('Only analyze snapshots at the same time if their '
+                         'estimated memory use fits into MB (default: half '
+                         'of the physical memory)'))
+  parser.add_option_group(group)
+
+  group = optparse.OptionGroup(parser, 'Class histogram',
+                               ('Print the instance counts and sizes per class '
+                                'of a saved heap snapshot instead of looking '
+                                'for leaks'))
+  group.add_option('--histogram', metavar='FILENAME', dest='histogram',
+                   help='Print the class histogram of the snapshot FILENAME')
+  group.add_option('--baseline', metavar='FILENAME', dest='baseline',
+                   help=('Print the growth of each class since the earlier '
+                         'snapshot FILENAME instead'))
+  parser.add_option_group(group)
+
+  parser.add_option('--time-budget', type='float', metavar='SECONDS',
+                    dest='time_budget',
+                    help=('Stop the analysis after SECONDS and report the '
+                          'leaks found so far'))
+  parser.add_option('--max-leaks', type='int', metavar='COUNT',
+                    dest='max_leaks',
+                    help='Stop the analysis after finding COUNT leaks')
+
+  parser.add_option('--sample', type='int', metavar='COUNT',
+                    dest='sample_size',
+                    help=('Only classify about COUNT container elements, '
+                          'sampled per class, and estimate the number of '
+                          'leaks of each class; for a quick triage of huge '
+                          'containers'))
+
+  parser.add_option('--retaining-paths', type='int', metavar='COUNT',
+                    dest='retaining_paths',
+                    help=('Show up to COUNT distinct retaining paths of each '
+                          'new leak, the shortest first'))
+
+  parser.add_option('--json-backend', type='choice', metavar='LIBRARY',
+                    dest='json_backend',
+                    choices=json_backends.AvailableBackends(),
+                    help=('JSON library for decoding the heap snapshot; the '
+                          'fastest installed one is used by default. '
+                          'Installed: %s' %
+                          ', '.join(json_backends.AvailableBackends())))
+
+  parser.add_option('--progress', action='store_true', default=False,
+                    dest='progress',
+                    help=('Print the progress of the analysis phases, with '
+                          'throughput and estimated time left, to stderr'))
+
   parser.add_option('-v', '--verbose', action='store_true', default=False,
                     dest='verbose', help='more verbose output')
 
@@ -318,6 +1244,15 @@ def main():
   if options.verbose:
     logging.basicConfig(level=logging.DEBUG)
 
+  if options.histogram:
+    snapshotter = leak_finder.Snapshotter(json_backend=options.json_backend)
+    baseline = None
+    if options.baseline:
+      baseline = snapshotter.GetClassHistogramFromFile(options.baseline)
+    PrintClassHistogram(snapshotter.GetClassHistogramFromFile(
+        options.histogram), baseline)
+    return 0
+
   leak_definition = LeakDefinition()
   if options.definition:
     leak_definition = PREDEFINED_DEFINITIONS[options.definition]
@@ -352,16 +1287,115 @@ def main():
     pat = re.compile(options.tab_pattern)
     tab_filter = lambda o: pat.search(o[options.tab_field])
 
-  inspector_client = remote_inspector_client.RemoteInspectorClient(
-      tab_index=options.tab_index, tab_filter=tab_filter,
-      show_socket_messages=options.remote_inspector_client_debug)
+  if options.batch:
+    # The batch keeps no history, and schedules the analyses by their memory
+    # use instead of converting the snapshots into columns.
+    for flag, value in (('--external-memory', options.external_memory),
+                        ('--history', options.history)):
+      if value:
+        logging.error('%s cannot be used with --batch', flag)
+        return 1
+    # batch_analysis imports this module.
+    import batch_analysis  # pylint: disable=g-import-not-at-top
+    output_dir = options.batch_output or os.path.join(options.batch,
+                                                      'jsleakcheck-results')
+    memory_limit = batch_analysis.DefaultMemoryLimit()
+    if options.memory_limit:
+      memory_limit = options.memory_limit * 1024 * 1024
+    analyzer = batch_analysis.BatchAnalyzer(
+        leak_definition, output_dir, options.jobs, memory_limit,
+        options.json_backend, options.time_budget, options.max_leaks,
+        prune_snapshot=options.prune, sample_size=options.sample_size,
+        retaining_paths=options.retaining_paths)
+    results = analyzer.Run(options.batch)
+    aggregated = batch_analysis.AggregateResults(results)
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+      json.dump(aggregated, f, indent=1)
+    batch_analysis.PrintBatchReport(results, aggregated)
+    return len(aggregated['new_leaks']) + len(aggregated['errors'])
+
+  # SIGTERM stops the analysis cleanly, e.g., stopping the inspector client.
+  token = progress.CancellationToken()
+  signal.signal(signal.SIGTERM, lambda unused_signum, unused_frame:
+                token.Cancel())
+  callback = None
+  if options.progress:
+    callback = lambda p: sys.stderr.write('%s\n' % p)
+  reporter = progress.ProgressReporter(callback, token)
+
+  results = None
+  if options.result_cache:
+    results = result_cache.ResultCache(
+        options.result_cache, options.result_cache_age * 24 * 60 * 60,
+        options.result_cache_size * 1024 * 1024)
+
+  history = None
+  if options.history:
+    try:
+      history = leak_history.LeakHistory(options.history)
+    except leak_history.Error as e:
+      logging.error('%s', e)
+      return 1
+
+  leak_checker = JSLeakCheck(leak_definition, prune_snapshot=options.prune,
+                             save_snapshot_to=options.save_snapshot,
+                             json_backend=options.json_backend,
+                             results=results,
+                             export_leaks_to=options.export_leaks,
+                             external_memory_dir=options.external_memory,
+                             progress_reporter=reporter,
+                             incremental=bool(options.probe_interval),
+                             external_memory_workers=options.jobs,
+                             sample_size=options.sample_size,
+                             history=history, run_id=options.run_id,
+                             retaining_paths=options.retaining_paths)
+  if options.snapshot:
+    try:
+      return leak_checker.Run(None, options.time_budget, options.max_leaks,
+                              options.snapshot)
+    except progress.Cancelled as e:
+      logging.error('%s', e)
+      return 1
 
-  leak_checker = JSLeakCheck(leak_definition)
+  if options.replay:
+    try:
+      inspector_client = inspector_replay.ReplayClient(
+          options.replay, options.replay_latency,
+          options.replay_recorded_latency)
+    except inspector_replay.Error as e:
+      logging.error('%s', e)
+      return 1
+  elif not remote_inspector_client:
+    logging.error('The remote_inspector_client module is not available; only '
+                  'saved heap snapshots (--snapshot) or recorded sessions '
+                  '(--replay) can be analyzed')
+    return 1
+  else:
+    inspector_client = remote_inspector_client.RemoteInspectorClient(
+        tab_index=options.tab_index, tab_filter=tab_filter,
+        show_socket_messages=options.remote_inspector_client_debug)
+    if options.record:
+      inspector_client = inspector_replay.RecordingClient(inspector_client,
+                                                          options.record)
+
+  start = time.time()
   try:
-    result = leak_checker.Run(inspector_client)
+    if options.probe_interval:
+      result = _ProbeAndRun(leak_checker, inspector_client, token, options)
+    else:
+      result = leak_checker.Run(inspector_client, options.time_budget,
+                                options.max_leaks)
+  except (progress.Cancelled, inspector_replay.Error) as e:
+    logging.error('%s', e)
+    result = 1
   finally:
     inspector_client.Stop()
+  if options.replay:
+    logging.info('Replayed %d calls in %.2fs, including %.2fs of simulated '
+                 'latency', inspector_client.call_count, time.time() - start,
+                 inspector_client.simulated_latency)
   return result
 
+
 if __name__ == '__main__':
   sys.exit(main())
@@ -16,12 +16,19 @@
 
 """Tests JSLeakCheck."""
 
-import googletest
+import json
+import os
+import shutil
+import tempfile
+import unittest
 
 import jsleakcheck
+import leak_history
+import result_cache
+import snapshot_testdata
 
 
-class LeakDefinitionTest(googletest.TestCase):
+class LeakDefinitionTest(unittest.TestCase):
   def testConstruction(self):
     definition = jsleakcheck.LeakDefinition('desc', 'file.txt', ['container'],
                                             ['node'])
@@ -34,5 +41,161 @@ class LeakDefinitionTest(googletest.TestCase):
     self.assertEqual('node', definition.bad_nodes[0])
 
 
+class JSLeakCheckTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _WriteSnapshot(self):
+    """Helper for creating a heap snapshot file.
+
+    Returns:
+      The file name.
+    """
+    filename = os.path.join(self._directory, 'snapshot.heapsnapshot')
+    with open(filename, 'w') as f:
+      json.dump(snapshot_testdata.LeakSnapshotData(), f)
+    return filename
+
+  def testResultCache(self):
+    filename = self._WriteSnapshot()
+    definition = jsleakcheck.LeakDefinition('', '', ['lib.container'], [], '',
+                                            '.stack')
+    results = result_cache.ResultCache(os.path.join(self._directory, 'cache'))
+    checker = jsleakcheck.JSLeakCheck(definition, results=results)
+    self.assertEqual(1, checker.Run(snapshot_filename=filename))
+
+    analyzed = []
+
+    def FindLeaks(*unused_args):
+      analyzed.append(True)
+      return []
+    checker = jsleakcheck.JSLeakCheck(definition, results=results)
+    checker._FindLeaks = FindLeaks
+    self.assertEqual(1, checker.Run(snapshot_filename=filename))
+    self.assertEqual([], analyzed)
+
+    # A different definition is analyzed again.
+    definition.bad_nodes = ['lib']
+    checker = jsleakcheck.JSLeakCheck(definition, results=results)
+    checker._FindLeaks = FindLeaks
+    self.assertEqual(0, checker.Run(snapshot_filename=filename))
+    self.assertEqual([True], analyzed)
+
+  def testSharedRetainers(self):
+    """Tests that the leaks sharing a retainer share the stack trace.
+
+    (window) - lib -> (array) - [0], [1], [2] -> (A1), (A2), (A3)
+        |                                          ^     ^
+        `- bad -> (map) - [0], [1] ----------------'-----'
+
+    A1, A2 and A3 were created by f, g and h; A1 and A2 share a stack trace.
+    """
+    heap = {'snapshot': {'meta': {'node_types': [['object', 'string',
+                                                  'array']],
+                                  'edge_types': [['property', 'element']],
+                                  'node_fields': ['type', 'name', 'id',
+                                                  'self_size', 'edge_count'],
+                                  'edge_fields': ['type', 'name_or_index',
+                                                  'to_node']}},
+            'nodes': [0, 0, 1, 10, 2,
+                      2, 1, 2, 10, 3,
+                      0, 2, 3, 10, 2,
+                      0, 3, 4, 10, 1,
+                      0, 3, 5, 10, 1,
+                      0, 3, 6, 10, 1,
+                      1, 4, 7, 10, 0,
+                      1, 5, 8, 10, 0,
+                      1, 9, 9, 10, 0],
+            'edges': [0, 6, 5, 0, 7, 10,
+                      1, 0, 15, 1, 1, 20, 1, 2, 25,
+                      1, 0, 15, 1, 1, 20,
+                      0, 8, 30,
+                      0, 8, 35,
+                      0, 8, 40],
+            'strings': ['Window', 'Array', 'Map', 'A',
+                        'Error\n    at f (a.js:1:1)',
+                        'Error\n    at g (a.js:1:1)', 'lib', 'bad', 'stack',
+                        'Error\n    at h (a.js:1:1)']}
+    filename = os.path.join(self._directory, 'snapshot.heapsnapshot')
+    with open(filename, 'w') as f:
+      json.dump(heap, f)
+    definition = jsleakcheck.LeakDefinition('', '', ['lib'], ['bad'], '',
+                                            '.stack')
+    report = jsleakcheck.JSLeakCheck(definition).AnalyzeFile(filename)
+    self.assertEqual([2, 1], [leak['count'] for leak in report['new_leaks']])
+    self.assertEqual(['h'], report['new_leaks'][1]['stack'])
+    self.assertEqual(1, len(report['groups']))
+    group = report['groups'][0]
+    self.assertEqual((['bad'], 2, {'A': 2}),
+                     (group['retainers'], group['count'], group['classes']))
+
+  def testRetainingPaths(self):
+    filename = self._WriteSnapshot()
+    definition = jsleakcheck.LeakDefinition('', '', ['lib.container'], [], '',
+                                            '.stack')
+    checker = jsleakcheck.JSLeakCheck(definition, retaining_paths=2)
+    report = checker.AnalyzeFile(filename)
+    self.assertEqual(['lib.container[0]'],
+                     report['new_leaks'][0]['retaining_paths'])
+
+    report = jsleakcheck.JSLeakCheck(definition).AnalyzeFile(filename)
+    self.assertFalse('retaining_paths' in report['new_leaks'][0])
+
+  def testHistory(self):
+    filename = self._WriteSnapshot()
+    definition = jsleakcheck.LeakDefinition('', '', ['lib.container'], [], '',
+                                            '.stack')
+    history = leak_history.LeakHistory(os.path.join(self._directory,
+                                                    'history.db'))
+    checker = jsleakcheck.JSLeakCheck(definition, history=history,
+                                      run_id='ci-1')
+    self.assertEqual(1, checker.Run(snapshot_filename=filename))
+    self.assertEqual(1, checker.Run(snapshot_filename=filename))
+    signature = leak_history.Signature('Leaked', ['createLeak'])
+    self.assertEqual(['ci-1', 'ci-1.2'], history.RunIds(signature))
+
+    report = {'stop_reason': None,
+              'new_leaks': [{'class_name': 'Leaked', 'count': 2,
+                             'stack': ['createLeak']},
+                            {'class_name': 'Other', 'count': 1,
+                             'stack': ['createOther']}]}
+    checker._ApplyHistory(report)
+    self.assertEqual(2, report['new_leaks'][0]['history']['run_count'])
+    self.assertEqual(None, report['new_leaks'][1]['history'])
+    self.assertEqual('ci-1.2', report['previous_run'])
+    self.assertEqual([], report['fixed_leaks'])
+    history.Close()
+
+  def testHistoryIgnoresPartialRuns(self):
+    history = leak_history.LeakHistory(os.path.join(self._directory,
+                                                    'history.db'))
+    history.Record('ci-1', [('Leaked', ['createLeak'], 2)])
+    checker = jsleakcheck.JSLeakCheck(
+        jsleakcheck.LeakDefinition('', '', ['lib.container'], [], '',
+                                   '.stack'),
+        history=history, run_id='ci-2')
+    estimate = {'class_name': 'Leaked', 'population': 10, 'sampled': 5}
+    for report in ({'stop_reason': 'time budget exhausted', 'new_leaks': []},
+                   {'stop_reason': None, 'new_leaks': [],
+                    'estimates': [estimate]}):
+      checker._ApplyHistory(report)
+      self.assertEqual('ci-1', report['previous_run'])
+      self.assertEqual([], report['fixed_leaks'])
+    self.assertEqual(['ci-1'], history.RunIds(
+        leak_history.Signature('Leaked', ['createLeak'])))
+
+    report = {'stop_reason': None, 'new_leaks': [],
+              'estimates': [dict(estimate, sampled=10)]}
+    checker._ApplyHistory(report)
+    self.assertEqual(['Leaked'], [leak['class_name']
+                                  for leak in report['fixed_leaks']])
+    self.assertEqual('ci-2', history.Classify([]).previous_run)
+    history.Close()
+
+
 if __name__ == '__main__':
-  googletest.main()
+  unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Pluggable JSON decoders for reading heap snapshots.
+
+Decoding the JSON is a large part of the time spent on analyzing a heap
+snapshot. Several third party JSON libraries decode the long integer arrays of
+a snapshot much faster than the standard library, so the fastest installed one
+is used by default. The standard library json module is always available as a
+fallback.
+"""
+
+import importlib
+
+
+# The supported backends, fastest first.
+_BACKEND_NAMES = ('orjson', 'rapidjson', 'ujson', 'simplejson', 'json')
+
+# Backends which only decode str objects, not bytes.
+_TEXT_ONLY_BACKENDS = ('rapidjson',)
+
+
+class Error(Exception):
+  """Base class for exceptions thrown by this module."""
+
+
+class JsonBackend(object):
+  """Decodes JSON with one JSON library.
+
+  Attributes:
+    name: str, the name of the library.
+    _loads: function, the decoding function of the library.
+    _text_only: bool, True if _loads doesn't accept bytes.
+  """
+
+  def __init__(self, name, module):
+    """Initializes the JsonBackend object.
+
+    Args:
+      name: str, the name of the library.
+      module: module, the imported library.
+    """
+    self.name = name
+    self._loads = module.loads
+    self._text_only = name in _TEXT_ONLY_BACKENDS
+
+  def Loads(self, data):
+    """Decodes a JSON document.
+
+    Args:
+      data: str or bytes, the JSON document; bytes are decoded as UTF-8.
+    Returns:
+      The decoded value.
+    Raises:
+      ValueError: The document cannot be decoded.
+    """
+    if self._text_only and isinstance(data, bytes):
+      data = data.decode('utf-8')
+    return self._loads(data)
+
+  def Load(self, f):
+    """Decodes a JSON document from a file.
+
+    Args:
+      f: file, a file object opened for reading.
+    Returns:
+      The decoded value.
+    Raises:
+      ValueError: The document cannot be decoded.
+    """
+    return self.Loads(f.read())
+
+
+def _ImportBackend(name):
+  """Imports the library of a backend.
+
+  Returns:
+    module, the library, or None if it is not installed.
+  """
+  try:
+    return importlib.import_module(name)
+  except ImportError:
+    return None
+
+
+def AvailableBackends():
+  """Returns the names of the installed backends, fastest first."""
+  return [name for name in _BACKEND_NAMES if _ImportBackend(name)]
+
+
+def GetBackend(name=None):
+  """Returns a JSON backend.
+
+  Args:
+    name: str, the name of the backend, or None for the fastest installed one.
+  Returns:
+    JsonBackend, the backend.
+  Raises:
+    Error: The backend is not supported or not installed.
+  """
+  if name is None:
+    name = AvailableBackends()[0]
+  if name not in _BACKEND_NAMES:
+    raise Error('Unknown JSON backend %s; supported backends are: %s' %
+                (name, ', '.join(_BACKEND_NAMES)))
+  module = _ImportBackend(name)
+  if not module:
+    raise Error('JSON backend %s is not installed' % name)
+  return JsonBackend(name, module)
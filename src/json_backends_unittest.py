@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests json_backends."""
+
+import io
+import unittest
+
+import json_backends
+
+
+class JsonBackendsTest(unittest.TestCase):
+
+  def testAvailableBackends(self):
+    backends = json_backends.AvailableBackends()
+    self.assertIn('json', backends)
+    self.assertEqual(backends[0], json_backends.GetBackend().name)
+
+  def testAllBackendsDecodeTheSame(self):
+    document = '{"nodes": [1, 2, 3], "strings": ["a", "\\u00e4"]}'
+    expected = {'nodes': [1, 2, 3], 'strings': ['a', u'ä']}
+    for name in json_backends.AvailableBackends():
+      backend = json_backends.GetBackend(name)
+      self.assertEqual(expected, backend.Loads(document))
+      self.assertEqual(expected, backend.Loads(document.encode('utf-8')))
+      self.assertEqual(expected,
+                       backend.Load(io.BytesIO(document.encode('utf-8'))))
+
+  def testErrors(self):
+    self.assertRaises(json_backends.Error, json_backends.GetBackend, 'yaml')
+    for name in json_backends.AvailableBackends():
+      self.assertRaises(ValueError,
+                        json_backends.GetBackend(name).Loads, '{"nodes": [')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -47,15 +47,387 @@ going through these bad stop nodes, the object is not a leak.
 """
 
 
-import simplejson
-
+import array
+import bz2
+import gzip
+import heapq
+import json
+import logging
+import math
+import mmap
+import random
+import re
+import time
+
+import heap_index
+import json_backends
+import progress
 import stacktrace
 
+try:
+  import lzma  # pylint: disable=g-import-not-at-top
+except ImportError:
+  lzma = None
+
 
 class Error(Exception):
   pass
 
 
+class _SearchStopped(Exception):
+  """The time budget ran out while classifying a container element."""
+
+
+# Magic numbers identifying the supported compression formats.
+_COMPRESSION_MAGIC = ((b'\x1f\x8b', 'gzip'),
+                      (b'BZh', 'bz2'),
+                      (b'\xfd7zXZ\x00', 'xz'))
+
+# The types of the nodes and edges which are not included in the analysis.
+UNINTERESTING_NODE_TYPES = ('hidden', 'code', 'number', 'native', 'synthetic')
+UNINTERESTING_EDGE_TYPES = ('weak', 'hidden', 'internal')
+
+# File name extensions of the supported compression formats.
+_COMPRESSION_EXTENSIONS = {'.gz': 'gzip',
+                           '.bz2': 'bz2',
+                           '.xz': 'xz',
+                           '.lzma': 'xz'}
+
+
+def _OpenFile(filename, compression, mode):
+  """Opens a file, compressing or decompressing it on the fly.
+
+  Args:
+    filename: str, the file to open.
+    compression: str, 'gzip', 'bz2', 'xz' or None for no compression.
+    mode: str, 'rb' or 'wb'.
+  Returns:
+    file, the opened file.
+  Raises:
+    Error: The compression format is not supported by this Python.
+  """
+  if compression == 'gzip':
+    return gzip.open(filename, mode)
+  if compression == 'bz2':
+    return bz2.BZ2File(filename, mode)
+  if compression == 'xz':
+    if not lzma:
+      raise Error('Cannot handle %s: the lzma module is not available' %
+                  filename)
+    return lzma.open(filename, mode)
+  return open(filename, mode)
+
+
+def _DetectCompression(filename):
+  """Returns the compression format of a file based on its content.
+
+  Returns:
+    str, 'gzip', 'bz2', 'xz' or None if the file is not compressed.
+  Raises:
+    IOError: The file cannot be read.
+  """
+  with open(filename, 'rb') as f:
+    header = f.read(6)
+  for magic, compression in _COMPRESSION_MAGIC:
+    if header.startswith(magic):
+      return compression
+  return None
+
+
+def IsSnapshotFileCompressed(filename):
+  """Returns True if a heap snapshot file is compressed.
+
+  Raises:
+    IOError: The file cannot be read.
+  """
+  return _DetectCompression(filename) is not None
+
+
+def OpenSnapshotFile(filename):
+  """Opens a heap snapshot file for reading.
+
+  Snapshots compressed with gzip, bzip2 or xz are detected based on their
+  content and decompressed while reading.
+
+  Args:
+    filename: str, the heap snapshot file.
+  Returns:
+    file, the opened file, yielding the uncompressed snapshot.
+  Raises:
+    IOError: The file cannot be read.
+    Error: The compression format is not supported by this Python.
+  """
+  return _OpenFile(filename, _DetectCompression(filename), 'rb')
+
+
+def _ReadSnapshotData(filename):
+  """Reads the uncompressed contents of a heap snapshot file.
+
+  An uncompressed file is memory mapped instead of read, so that the parts of
+  it which are never accessed are never read into memory.
+
+  Args:
+    filename: str, the heap snapshot file.
+  Returns:
+    bytes or mmap, the uncompressed snapshot.
+  Raises:
+    IOError: The file cannot be read.
+    ValueError: The file is empty.
+    Error: The compression format is not supported by this Python.
+  """
+  compression = _DetectCompression(filename)
+  if compression:
+    f = _OpenFile(filename, compression, 'rb')
+    try:
+      return f.read()
+    finally:
+      f.close()
+  with open(filename, 'rb') as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def SaveSnapshotFile(raw_data, filename):
+  """Writes a heap snapshot into a file.
+
+  The snapshot is compressed if the file name ends in .gz, .bz2, .xz or .lzma.
+
+  Args:
+    raw_data: str, the heap snapshot JSON.
+    filename: str, the file to write.
+  Raises:
+    IOError: The file cannot be written.
+    Error: The compression format is not supported by this Python.
+  """
+  compression = None
+  for extension in _COMPRESSION_EXTENSIONS:
+    if filename.endswith(extension):
+      compression = _COMPRESSION_EXTENSIONS[extension]
+  if isinstance(raw_data, str):
+    raw_data = raw_data.encode('utf-8')
+  f = _OpenFile(filename, compression, 'wb')
+  try:
+    f.write(raw_data)
+  finally:
+    f.close()
+
+
+# The size of the chunks in which heap snapshot files are streamed.
+_STREAM_CHUNK_SIZE = 1 << 20
+
+# The number of nodes, edges or strings processed between progress updates.
+_PROGRESS_STEP = 1 << 12
+
+# The z value of the confidence intervals of the sampled leak estimates (95%).
+_CONFIDENCE_Z = 1.96
+
+# The costs of the edge types for ranking retaining paths of the same length.
+# The paths through the other edge types, e.g., closure contexts and
+# shortcuts, are harder to follow in the code.
+_PATH_EDGE_COSTS = {'property': 0, 'element': 0}
+_DEFAULT_PATH_EDGE_COST = 1
+
+# The number of retainers the retaining path search visits between the checks
+# of the time budget and the cancellation.
+_CHECK_INTERVAL = 1000
+
+# A property name containing digits, taken for an id, e.g., of a map entry.
+_ID_LIKE_NAME_RE = re.compile(r'\d')
+
+# The default budgets of searching the retaining paths of a node.
+_DEFAULT_PATH_VISITS = 100000
+_DEFAULT_PATH_TIME_BUDGET = 1.0
+
+# A JSON string in an array, preceded by the separating comma if any.
+_JSON_STRING_RE = re.compile(br'\s*,?\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+
+# The start of the string table of a heap snapshot, after the key.
+_STRING_TABLE_START_RE = re.compile(br'\s*:\s*\[')
+
+# The end of a JSON array.
+_ARRAY_END_RE = re.compile(br'\s*\]')
+
+
+def _DecodeJsonString(raw):
+  """Decodes the contents of a JSON string literal (without the quotes).
+
+  Args:
+    raw: bytes, the UTF-8 encoded contents, possibly with escapes.
+  Returns:
+    str, the decoded string.
+  """
+  if b'\\' not in raw:
+    return raw.decode('utf-8')
+  return json.loads(b'"' + raw + b'"')
+
+
+class SnapshotStream(object):
+  """Reads a heap snapshot file in chunks.
+
+  Only the chunk being parsed is kept in memory, so that e.g. the nodes array
+  can be aggregated without decoding the whole snapshot.
+
+  Attributes:
+    _file: file, the uncompressed snapshot.
+    _buffer: bytes, the data read but not consumed yet.
+  """
+
+  def __init__(self, f):
+    self._file = f
+    self._buffer = b''
+
+  def _Fill(self):
+    """Reads the next chunk into the buffer.
+
+    Returns:
+      bool, False at the end of the file.
+    """
+    chunk = self._file.read(_STREAM_CHUNK_SIZE)
+    if not chunk:
+      return False
+    self._buffer += chunk
+    return True
+
+  def ReadUntil(self, token, keep=True):
+    """Consumes the data up to and including a token.
+
+    Args:
+      token: bytes, the token to find.
+      keep: bool, if False, the data before the token is discarded while
+          reading, e.g., for skipping the edges array.
+    Returns:
+      bytes, the data before the token, or b'' if keep is False.
+    Raises:
+      Error: The token was not found.
+    """
+    consumed = []
+    position = self._buffer.find(token)
+    while position < 0:
+      # The end of the buffer may contain the start of the token.
+      cut = max(0, len(self._buffer) - len(token) + 1)
+      if keep:
+        consumed.append(self._buffer[:cut])
+      self._buffer = self._buffer[cut:]
+      if not self._Fill():
+        raise Error('Unexpected end of the heap snapshot, %s not found' %
+                    token.decode('utf-8'))
+      position = self._buffer.find(token)
+    if keep:
+      consumed.append(self._buffer[:position])
+    self._buffer = self._buffer[position + len(token):]
+    return b''.join(consumed)
+
+  def Integers(self):
+    """Reads an array of integers whose opening bracket has been consumed.
+
+    Yields:
+      [int], the next integers of the array, one list per chunk.
+    Raises:
+      Error: The array doesn't end.
+    """
+    while True:
+      end = self._buffer.find(b']')
+      if end >= 0:
+        data = self._buffer[:end]
+        self._buffer = self._buffer[end + 1:]
+        if data.strip():
+          yield [int(value) for value in data.split(b',')]
+        return
+      # The last number may continue in the next chunk.
+      cut = self._buffer.rfind(b',')
+      if cut >= 0:
+        data = self._buffer[:cut]
+        self._buffer = self._buffer[cut + 1:]
+        if data.strip():
+          yield [int(value) for value in data.split(b',')]
+      if not self._Fill():
+        raise Error('Unexpected end of the heap snapshot in an array')
+
+  def Strings(self):
+    """Reads an array of strings whose opening bracket has been consumed.
+
+    Yields:
+      bytes, the contents of the next string, not decoded (see
+          _DecodeJsonString).
+    Raises:
+      Error: The array doesn't end.
+    """
+    position = 0
+    while True:
+      match = _JSON_STRING_RE.match(self._buffer, position)
+      if match:
+        position = match.end()
+        yield match.group(1)
+        continue
+      rest = self._buffer[position:].lstrip()
+      if rest.startswith(b']'):
+        self._buffer = rest[1:]
+        return
+      self._buffer = self._buffer[position:]
+      position = 0
+      if not self._Fill():
+        raise Error('Unexpected end of the heap snapshot in the strings')
+
+
+class LazyStringTable(object):
+  """The string table of a heap snapshot, decoded only when accessed.
+
+  The string table is often the largest part of a snapshot (source texts,
+  URLs, JSON data), but the analysis only needs a few of the strings. The
+  table only records where each string is in the snapshot data.
+
+  Attributes:
+    _data: bytes or mmap, the heap snapshot JSON.
+    _offsets: array('q'), the start and end offsets of the contents of each
+        string in _data.
+    _decoded: {int -> str}, the strings accessed so far.
+  """
+
+  def __init__(self, data, offsets):
+    """Initializes the LazyStringTable object.
+
+    Args:
+      data: bytes or mmap, the heap snapshot JSON.
+      offsets: array('q'), the start and end offsets of the contents of each
+          string in data.
+    """
+    self._data = data
+    self._offsets = offsets
+    self._decoded = {}
+
+  def __len__(self):
+    return len(self._offsets) // 2
+
+  def __getitem__(self, ix):
+    value = self._decoded.get(ix)
+    if value is None:
+      if not 0 <= ix < len(self):
+        raise IndexError('String index %d out of range' % ix)
+      value = _DecodeJsonString(
+          self._data[self._offsets[2 * ix]:self._offsets[2 * ix + 1]])
+      self._decoded[ix] = value
+    return value
+
+  def __iter__(self):
+    for ix in range(len(self)):
+      yield self[ix]
+
+  def IndicesOf(self, value):
+    """Finds a string without decoding the other strings.
+
+    Args:
+      value: str, the string to find.
+    Returns:
+      set(int), the indices of the strings equal to value.
+    """
+    encoded = value.encode('utf-8')
+    indices = set()
+    for ix in range(len(self)):
+      raw = self._data[self._offsets[2 * ix]:self._offsets[2 * ix + 1]]
+      if raw == encoded or (b'\\' in raw and self[ix] == value):
+        indices.add(ix)
+    return indices
+
+
 class Node(object):
   """Data structure for representing a node in the heap snapshot.
 
@@ -67,27 +439,57 @@ class Node(object):
     edges_to: [Edge], edges whose end point this Node is.
     edges_from: [Edge], edges whose start point this Node is.
     string: str, for string Nodes, contains the string the Node represents.
-        Empty string for non-string nodes.
+        Empty string for non-string nodes. If the string is in a
+        LazyStringTable, it is decoded when accessed.
     js_name: str, how to refer to this node in JavaScript.
+    self_size: int, the size of the object itself in bytes.
+    trace_node_id: int, identifies the allocation stack trace of the object
+        in the AllocationTraces of the snapshot, or 0 if unknown.
   """
 
-  def __init__(self, node_id, type_string, class_name):
+  def __init__(self, node_id, type_string, class_name, self_size=0):
     """Initializes the Node object.
 
     Args:
       node_id: int, identifier for the Node.
       type_string: str, the type of the node.
       class_name: str, the class of the JavaScript object this Node represents.
+      self_size: int, the size of the object itself in bytes.
     """
 
     self.node_id = node_id
     self.type_string = type_string
     self.class_name = class_name
+    self.self_size = self_size
+    self.trace_node_id = 0
     self.edges_to = []
     self.edges_from = []
-    self.string = ''
+    self._string = ''
+    self._string_table = None
+    self._string_ix = None
     self.js_name = ''
 
+  @property
+  def string(self):
+    if self._string_table is not None:
+      return self._string_table[self._string_ix]
+    return self._string
+
+  @string.setter
+  def string(self, value):
+    self._string = value
+    self._string_table = None
+
+  def SetStringIndex(self, strings, ix):
+    """Sets the string of the Node without accessing it.
+
+    Args:
+      strings: [str] or LazyStringTable, the string table of the snapshot.
+      ix: int, the index of the string in strings.
+    """
+    self._string_table = strings
+    self._string_ix = ix
+
   def AddEdgeTo(self, edge):
     """Associates an Edge with the Node (the end point).
 
@@ -175,6 +577,8 @@ class LeakNode(object):
         leaked JavaScript object.
     stack: Stack, the creation stack trace of the JavaScript object, or None if
         the stack trace cannot be retrieved or has not yet been retrieved.
+    retained_size: int, the number of bytes which would be freed if the
+        object was released, or None if it has not been computed.
   """
 
   def __init__(self, node, description, how_to_find_node, stacktrace_suffix):
@@ -193,15 +597,25 @@ class LeakNode(object):
     self.how_to_find_node = how_to_find_node
     self._stacktrace_suffix = stacktrace_suffix
     self.stack = None
+    self.retained_size = None
 
-  def RetrieveStackTrace(self, inspector_client=None):
+  def RetrieveStackTrace(self, inspector_client=None, allocation_traces=None):
     """Retrieves the creation stack trace and stores it into this LeakNode.
 
     Args:
       inspector_client: RemoteInspectorClient, client to use for retrieving the
           full stack trace. If None, we will retrieve a possibly shortened value
           from the snapshot.
+      allocation_traces: AllocationTraces, the allocation stack traces recorded
+          in the snapshot. If they contain the stack trace of the object, it is
+          used instead of the stack trace stored in the object.
     """
+    if allocation_traces and self.node.trace_node_id:
+      stack = allocation_traces.GetStack(self.node.trace_node_id)
+      if stack:
+        self.stack = stack
+        return
+
     stack = None
     if not self._stacktrace_suffix:
       # No stack trace information.
@@ -216,9 +630,10 @@ class LeakNode(object):
       stack = inspector_client.EvaluateJavaScript(
           self.how_to_find_node + self._stacktrace_suffix)
     else:
-      # See if the object contains a stack trace.
+      # See if the object contains a stack trace. The suffix is a JavaScript
+      # expression (e.g., ".stack"), the edge name is the bare property name.
       for edge in self.node.edges_from:
-        if edge.name_string == self._stacktrace_suffix:
+        if edge.name_string == self._stacktrace_suffix.lstrip('.'):
           stack = edge.to_node.string
           break
     if stack:
@@ -228,8 +643,277 @@ class LeakNode(object):
     stack = ''
     if self.stack:
       stack = 'Stack:\n  %s' % '\n  '.join(self.stack.frames)
-    return '%s\nClass: %s\nObject: %s\n%s' % (
-        self.description, self.node.class_name, self.how_to_find_node, stack)
+    size = ''
+    if self.retained_size is not None:
+      size = 'Retained size: %d bytes\n' % self.retained_size
+    return '%s\nClass: %s\nObject: %s\n%s%s' % (
+        self.description, self.node.class_name, self.how_to_find_node, size,
+        stack)
+
+
+class LeakGroup(object):
+  """Leaks which share their immediate retainers outside the containers.
+
+  Leaks often come in clusters, e.g., a forgotten listener map keeping
+  thousands of objects alive. The objects of a cluster are typically created
+  by the same code, so the stack trace is only retrieved for one
+  representative of each class and retaining edge in the group, and shared
+  with the others.
+
+  This is an approximation: the objects of the same class stored the same way
+  (as elements, or as values keyed by ids) into the same retainers are
+  assumed to be allocated by the same code. Objects stored under distinct
+  property names get representatives of their own, since they are often
+  allocated elsewhere.
+
+  Attributes:
+    retainers: [Node], the retainers the leaks share, other than the
+        containers and the leaks themselves; empty for a single leak which
+        has no such retainers.
+    leaks: [LeakNode], the leaks in the group.
+    classes: {str -> int}, maps the classes of the leaking objects to their
+        number.
+  """
+
+  def __init__(self, retainers):
+    self.retainers = retainers
+    self.leaks = []
+    self.classes = {}
+    self._representatives = {}
+    self._representative_keys = {}
+
+  def Add(self, leak, edges=frozenset()):
+    """Adds a leak to the group.
+
+    The first leak of each class and set of retaining edges represents the
+    others.
+
+    Args:
+      leak: LeakNode, the leak.
+      edges: frozenset(tuple), identifies how the shared retainers retain the
+          leak; see LeakFinder.GroupLeaks.
+    """
+    self.leaks.append(leak)
+    class_name = leak.node.class_name
+    self.classes[class_name] = self.classes.get(class_name, 0) + 1
+    key = (class_name, edges)
+    self._representatives.setdefault(key, leak)
+    self._representative_keys[leak] = key
+
+  def Representatives(self):
+    """Returns the leaks whose stack traces need to be retrieved."""
+    return list(self._representatives.values())
+
+  def ShareStacks(self):
+    """Gives the leaks without a stack trace that of their representative."""
+    for leak in self.leaks:
+      if not leak.stack:
+        leak.stack = self._representatives[
+            self._representative_keys[leak]].stack
+
+
+class AllocationTraces(object):
+  """The allocation stack traces recorded into a heap snapshot.
+
+  If allocation tracking is enabled when the snapshot is taken, V8 records the
+  stack trace for each allocation into a tree of functions (the trace tree),
+  and each node in the snapshot refers to a node of the tree. The stack traces
+  cost nothing in the inspected application, and unlike stack traces stored in
+  JavaScript strings, they are not truncated.
+
+  Attributes:
+    _functions: [(str, str, int, int)], the function name, script name, line
+        and column of each function in the snapshot.
+    _trace_nodes: {int -> (int, int)}, maps trace node ids to the function index
+        and the parent trace node id (None for the root).
+    _stacks: {int -> Stack}, the stack traces constructed so far.
+  """
+
+  def __init__(self, function_infos, function_info_fields, trace_tree,
+               trace_node_fields, strings):
+    """Initializes the AllocationTraces object.
+
+    Args:
+      function_infos: [int], the raw trace_function_infos data of the snapshot.
+      function_info_fields: [str], the fields present for each function.
+      trace_tree: [], the raw trace_tree data of the snapshot.
+      trace_node_fields: [str], the fields present for each trace tree node.
+      strings: [str], the string table of the snapshot.
+    Raises:
+      Error: The trace data doesn't contain the required fields.
+    """
+    self._stacks = {}
+
+    field_count = len(function_info_fields)
+    name_ix = AllocationTraces._FindField('name', function_info_fields)
+    script_name_ix = AllocationTraces._FindField('script_name',
+                                                 function_info_fields)
+    line_ix = AllocationTraces._FindField('line', function_info_fields)
+    column_ix = AllocationTraces._FindField('column', function_info_fields)
+    self._functions = []
+    for ix in range(0, len(function_infos), field_count):
+      self._functions.append((strings[function_infos[ix + name_ix]],
+                              strings[function_infos[ix + script_name_ix]],
+                              function_infos[ix + line_ix],
+                              function_infos[ix + column_ix]))
+
+    field_count = len(trace_node_fields)
+    id_ix = AllocationTraces._FindField('id', trace_node_fields)
+    function_ix = AllocationTraces._FindField('function_info_index',
+                                              trace_node_fields)
+    children_ix = AllocationTraces._FindField('children', trace_node_fields)
+    self._trace_nodes = {}
+    # Each element of the stack is a list of sibling nodes and their parent.
+    stack = [(trace_tree, None)]
+    while stack:
+      siblings, parent_id = stack.pop()
+      for ix in range(0, len(siblings), field_count):
+        trace_node_id = siblings[ix + id_ix]
+        self._trace_nodes[trace_node_id] = (siblings[ix + function_ix],
+                                            parent_id)
+        stack.append((siblings[ix + children_ix], trace_node_id))
+
+  @staticmethod
+  def _FindField(field_name, fields_array):
+    """Finds the index of a field in the trace meta information.
+
+    Args:
+      field_name: str, the field to find in fields_array.
+      fields_array: [str], array of available fields.
+    Returns:
+      int, the first index of field_name in fields_array.
+    Raises:
+      Error: field_name doesn't occur in fields_array.
+    """
+    if field_name not in fields_array:
+      raise Error('Cannot find trace field %s from the snapshot' % field_name)
+    return fields_array.index(field_name)
+
+  def GetStack(self, trace_node_id):
+    """Returns the allocation stack trace for a trace node.
+
+    Args:
+      trace_node_id: int, the trace node id of a Node.
+    Returns:
+      Stack, the stack trace, innermost frame first, or None if the trace node
+          is unknown.
+    """
+    if trace_node_id in self._stacks:
+      return self._stacks[trace_node_id]
+    if trace_node_id not in self._trace_nodes:
+      return None
+
+    # The stack is built in the V8 format, so that it is parsed the same way
+    # as the stack traces retrieved from the JavaScript objects.
+    frames = ['Error']
+    function_ix, parent_id = self._trace_nodes[trace_node_id]
+    # The root of the tree doesn't correspond to a function.
+    while parent_id is not None:
+      name, script_name, line, column = self._functions[function_ix]
+      frames.append('    at %s (%s:%d:%d)' % (name or '<anonymous>',
+                                             script_name, line, column))
+      function_ix, parent_id = self._trace_nodes[parent_id]
+    stack = stacktrace.Stack('\n'.join(frames))
+    self._stacks[trace_node_id] = stack
+    return stack
+
+
+class ClassHistogram(object):
+  """The instance counts and total self sizes of the classes in a snapshot.
+
+  Attributes:
+    counts: {str -> int}, the number of instances of each class.
+    sizes: {str -> int}, the total self size of the instances of each class.
+  """
+
+  def __init__(self):
+    self.counts = {}
+    self.sizes = {}
+
+  def Add(self, class_name, count, size):
+    """Adds instances of a class.
+
+    Args:
+      class_name: str, the class name.
+      count: int, the number of instances.
+      size: int, their total self size in bytes.
+    """
+    self.counts[class_name] = self.counts.get(class_name, 0) + count
+    self.sizes[class_name] = self.sizes.get(class_name, 0) + size
+
+  def Classes(self):
+    """Returns the classes, the largest total size first.
+
+    Returns:
+      [(str, int, int)], the class name, instance count and total self size
+          of each class.
+    """
+    classes = [(class_name, count, self.sizes[class_name])
+               for class_name, count in self.counts.items()]
+    classes.sort(key=lambda entry: (-entry[2], -entry[1], entry[0]))
+    return classes
+
+  def Diff(self, previous):
+    """Compares the histogram to the histogram of an earlier snapshot.
+
+    Args:
+      previous: ClassHistogram, the histogram of the earlier snapshot.
+    Returns:
+      [(str, int, int)], the class name, the growth of the instance count
+          and the growth of the total self size of each class which changed.
+          The classes which grew the most come first.
+    """
+    growth = []
+    for class_name in set(self.counts) | set(previous.counts):
+      count_growth = (self.counts.get(class_name, 0) -
+                      previous.counts.get(class_name, 0))
+      size_growth = (self.sizes.get(class_name, 0) -
+                     previous.sizes.get(class_name, 0))
+      if count_growth or size_growth:
+        growth.append((class_name, count_growth, size_growth))
+    growth.sort(key=lambda entry: (-entry[2], -entry[1], entry[0]))
+    return growth
+
+
+class LeakEstimate(object):
+  """The estimated number of leaks of a class, based on a sample.
+
+  The interval is the Wilson score interval of the leaking proportion, scaled
+  to the population, and narrowed to what the sample proves: at least the
+  sampled leaks leak, and at least the sampled non-leaks don't.
+
+  Attributes:
+    class_name: str, the class of the container elements.
+    population: int, the number of container elements of the class.
+    sampled: int, the number of them classified.
+    leaks: int, the number of the classified elements which leak.
+    estimate: float, the estimated number of leaking elements of the class.
+    low: float, the lower bound of the confidence interval.
+    high: float, the upper bound of the confidence interval.
+  """
+
+  def __init__(self, class_name, population, sampled, leaks, z=_CONFIDENCE_Z):
+    self.class_name = class_name
+    self.population = population
+    self.sampled = sampled
+    self.leaks = leaks
+    if sampled >= population:
+      self.estimate = self.low = self.high = float(leaks)
+      return
+    if not sampled:
+      self.estimate = None
+      self.low = 0.0
+      self.high = float(population)
+      return
+    proportion = float(leaks) / sampled
+    denominator = 1 + z * z / sampled
+    center = (proportion + z * z / (2 * sampled)) / denominator
+    half_width = z * math.sqrt(proportion * (1 - proportion) / sampled +
+                               z * z / (4 * sampled * sampled)) / denominator
+    self.estimate = proportion * population
+    self.low = max(float(leaks), (center - half_width) * population)
+    self.high = min(float(population - (sampled - leaks)),
+                    (center + half_width) * population)
 
 
 class Snapshotter(object):
@@ -248,6 +932,10 @@ class Snapshotter(object):
     _node_type_ix: int, index of the node type field.
     _node_name_ix: int, index of the node name field.
     _node_id_ix: int, index of the node id field.
+    _node_self_size_ix: int, index of the node self size field, or None if the
+        snapshot doesn't contain the sizes.
+    _node_trace_node_id_ix: int, index of the node trace node id field, or None
+        if the snapshot doesn't contain allocation traces.
     _node_edges_start_ix: int, index of the "edge start index for a node" field.
     _node_edge_count_ix: int, index of the node edge count field.
     _node_edge_count_format: bool, defines if the snapshot uses edges_start or
@@ -257,17 +945,50 @@ class Snapshotter(object):
     _edge_name_or_ix_ix: int, index of the edge name field.
     _edge_to_node_ix: int, index of the "to node for an edge" field.
     _edge_field_count: int, number of edge fields.
+    _leak_definition: LeakDefinition, if set, only the nodes relevant for
+        finding the leaks it describes are constructed.
+    _relevant_node_ixs: set(int), indices into self._node_list of the nodes to
+        construct, or None if all interesting nodes are constructed.
+    allocation_traces: AllocationTraces, the allocation stack traces in the
+        snapshot, or None if allocation tracking was not enabled.
+    _json_backend: json_backends.JsonBackend, decodes the snapshot JSON.
+    _progress: progress.ProgressReporter, receives the progress of decoding
+        and parsing the snapshot.
   """
 
-  def __init__(self):
+  def __init__(self, leak_definition=None, json_backend=None,
+               progress_reporter=None):
+    """Initializes the Snapshotter object.
+
+    Args:
+      leak_definition: LeakDefinition, if given, the snapshot is pruned while
+          parsing: only the nodes which can reach an element of one of its
+          containers are kept. Everything else is discarded before Node
+          objects are constructed.
+      json_backend: str, the name of the JSON library for decoding the
+          snapshot (see json_backends), or None for the fastest installed one.
+      progress_reporter: progress.ProgressReporter, if given, receives the
+          progress of decoding the snapshot ('decode', in bytes), constructing
+          the nodes ('parse', in nodes) and linking the edges ('link', in
+          nodes), and can cancel them.
+    Raises:
+      json_backends.Error: The JSON library is not installed.
+    """
     self._node_dict = {}
+    self._json_backend = json_backends.GetBackend(json_backend)
+    self._progress = progress_reporter or progress.ProgressReporter()
+    self._leak_definition = leak_definition
+    self._relevant_node_ixs = None
+    self.allocation_traces = None
 
-  def GetSnapshot(self, inspector_client):
+  def GetSnapshot(self, inspector_client, snapshot_filename=None):
     """Reads a heap snapshot from a chromium process and returns the data.
 
     Args:
       inspector_client: RemoteInspectorClient, the client to used for taking the
           heap snapshot.
+      snapshot_filename: str, if given, the snapshot is also written into this
+          file, compressed according to its extension (see SaveSnapshotFile).
     Returns:
       set(Node), the Node objects in the snapshot or None if the snapshot
           couldn't be read.
@@ -276,10 +997,187 @@ class Snapshotter(object):
       ValueError: The snaphost cannot be parsed.
       Error: The snapshot format cannot be parsed (e.g., too new version).
     """
-    self._ReadSnapshot(inspector_client)
+    self._ReadSnapshot(inspector_client, snapshot_filename)
     self._ParseSnapshot()
     return self._node_dict.values()
 
+  def GetSnapshotFromFile(self, filename):
+    """Reads a heap snapshot from a file and returns the data.
+
+    The file may be compressed with gzip, bzip2 or xz; it is decompressed while
+    parsing, without intermediate files. An uncompressed file is memory mapped
+    and its strings are decoded only when accessed, so it must not be modified
+    while the returned nodes are in use.
+
+    Args:
+      filename: str, the heap snapshot file.
+    Returns:
+      set(Node), the Node objects in the snapshot.
+    Raises:
+      IOError: The file cannot be read.
+      KeyError: The snapshot doesn't contain the required data fields.
+      ValueError: The snaphost cannot be parsed.
+      Error: The snapshot format cannot be parsed (e.g., too new version).
+    """
+    return self.GetSnapshotFromHeap(
+        self._DecodeHeap(_ReadSnapshotData(filename)))
+
+  def GetSnapshotFromHeap(self, heap):
+    """Parses an already decoded heap snapshot and returns the data.
+
+    Args:
+      heap: {}, the decoded heap snapshot JSON.
+    Returns:
+      set(Node), the Node objects in the snapshot.
+    Raises:
+      KeyError: The snapshot doesn't contain the required data fields.
+      Error: The snapshot format cannot be parsed (e.g., too new version).
+    """
+    self._LoadHeap(heap)
+    self._ParseSnapshot()
+    return self._node_dict.values()
+
+  def GetClassHistogramFromFile(self, filename):
+    """Computes the class histogram of a heap snapshot file.
+
+    The nodes array is streamed through once without constructing Node
+    objects, so the memory usage is proportional to the number of distinct
+    classes, not to the size of the snapshot. Only the class names are decoded
+    from the string table.
+
+    Args:
+      filename: str, the heap snapshot file, possibly compressed.
+    Returns:
+      ClassHistogram, the instance counts and sizes per class.
+    Raises:
+      IOError: The file cannot be read.
+      KeyError: The snapshot doesn't contain the required data fields.
+      ValueError: The snaphost cannot be parsed.
+      Error: The snapshot format cannot be parsed (e.g., too new version).
+    """
+    f = OpenSnapshotFile(filename)
+    try:
+      stream = SnapshotStream(f)
+      # V8 writes the meta information before the nodes.
+      header = stream.ReadUntil(b'"nodes"').rstrip().rstrip(b',') + b'}'
+      meta = self._json_backend.Loads(header)['snapshot']['meta']
+      stream.ReadUntil(b'[')
+      counts = self._CountClasses(meta, stream.Integers())
+
+      def ReadNames(name_ixs):
+        """Decodes the strings at name_ixs, skipping the rest of the file."""
+        names = {}
+        stream.ReadUntil(b'"strings"', keep=False)
+        stream.ReadUntil(b'[')
+        last_ix = max(name_ixs)
+        for ix, raw in enumerate(stream.Strings()):
+          if ix in name_ixs:
+            names[ix] = _DecodeJsonString(raw)
+          if ix == last_ix:
+            break
+        return names
+
+      return self._BuildClassHistogram(meta, counts, ReadNames)
+    finally:
+      f.close()
+
+  def GetClassHistogramFromHeap(self, heap):
+    """Computes the class histogram of an already decoded heap snapshot.
+
+    Args:
+      heap: {}, the decoded heap snapshot JSON.
+    Returns:
+      ClassHistogram, the instance counts and sizes per class.
+    Raises:
+      KeyError: The snapshot doesn't contain the required data fields.
+      Error: The snapshot format cannot be parsed (e.g., too new version).
+    """
+    meta = heap['snapshot']['meta']
+    counts = self._CountClasses(meta, [heap['nodes']])
+    strings = heap['strings']
+    return self._BuildClassHistogram(
+        meta, counts, lambda name_ixs: dict((ix, strings[ix])
+                                            for ix in name_ixs))
+
+  def _CountClasses(self, meta, node_chunks):
+    """Aggregates the nodes array by node type and name.
+
+    Args:
+      meta: {}, the meta information of the snapshot.
+      node_chunks: iterable of [int], the nodes array in consecutive parts.
+    Returns:
+      {(int, int) -> [int, int]}, maps the node types and, for objects, the
+          name string indices (None for other types) to the number and total
+          self size of the nodes.
+    Raises:
+      Error: The node list of the snapshot is malformed.
+    """
+    node_fields = meta['node_fields']
+    type_ix = self._FindField('type', node_fields)
+    name_ix = self._FindField('name', node_fields)
+    self_size_ix = None
+    if 'self_size' in node_fields:
+      self_size_ix = node_fields.index('self_size')
+    field_count = len(node_fields)
+    node_types = meta['node_types'][0]
+    object_type = None
+    if 'object' in node_types:
+      object_type = node_types.index('object')
+
+    counts = {}
+    pending = []
+    for values in node_chunks:
+      if pending:
+        values = pending + values
+      end = len(values) - len(values) % field_count
+      pending = values[end:]
+      for ix in range(0, end, field_count):
+        node_type = values[ix + type_ix]
+        name = None
+        if node_type == object_type:
+          name = values[ix + name_ix]
+        entry = counts.get((node_type, name))
+        if entry is None:
+          entry = counts[(node_type, name)] = [0, 0]
+        entry[0] += 1
+        if self_size_ix is not None:
+          entry[1] += values[ix + self_size_ix]
+    if pending:
+      raise Error('Snapshot node list too short')
+    return counts
+
+  def _BuildClassHistogram(self, meta, counts, read_names):
+    """Builds a ClassHistogram from the aggregated nodes.
+
+    Args:
+      meta: {}, the meta information of the snapshot.
+      counts: {(int, int) -> [int, int]}, as returned by _CountClasses.
+      read_names: function, takes a set of string indices and returns {int ->
+          str}, the strings at those indices.
+    Returns:
+      ClassHistogram, the histogram.
+    Raises:
+      Error: The string table is too short.
+    """
+    node_types = meta['node_types'][0]
+    name_ixs = set(name for _, name in counts if name is not None)
+    names = {}
+    if name_ixs:
+      try:
+        names = read_names(name_ixs)
+      except IndexError:
+        pass
+      if len(names) < len(name_ixs):
+        raise Error('Snapshot string list too short')
+    histogram = ClassHistogram()
+    for (node_type, name), (count, size) in counts.items():
+      if name is None:
+        class_name = '(%s)' % node_types[node_type]
+      else:
+        class_name = names[name]
+      histogram.Add(class_name, count, size)
+    return histogram
+
   def _FindField(self, field_name, fields_array):
     """Finds field indices based on the snapshot meta information.
 
@@ -295,9 +1193,75 @@ class Snapshotter(object):
       raise Error('Cannot find field %s from the snapshot' % field_name)
     return fields_array.index(field_name)
 
-  def _ReadSnapshot(self, inspector_client):
+  def _ReadSnapshot(self, inspector_client, snapshot_filename=None):
     """Reads a heap snapshot from a chromium process and stores the data.
 
+    Args:
+      inspector_client: RemoteInspectorClient, the client to used for taking the
+          heap snapshot.
+      snapshot_filename: str, if given, the snapshot is also written into this
+          file.
+    Raises:
+      KeyError: The snapshot doesn't contain the required data fields.
+      ValueError: The snaphost cannot be parsed.
+      Error: The snapshot format is not supported (e.g., too new version).
+    """
+    raw_data = inspector_client.HeapSnapshot(include_summary=False)['raw_data']
+    if snapshot_filename:
+      SaveSnapshotFile(raw_data, snapshot_filename)
+    if isinstance(raw_data, str):
+      raw_data = raw_data.encode('utf-8')
+    self._LoadHeap(self._DecodeHeap(raw_data))
+
+  def _DecodeHeap(self, data):
+    """Decodes a heap snapshot, except for its string table.
+
+    The string table is replaced by a LazyStringTable, which only records
+    where each string is in data, and decodes the strings when accessed.
+
+    Args:
+      data: bytes or mmap, the heap snapshot JSON.
+    Returns:
+      {}, the decoded heap snapshot JSON.
+    Raises:
+      ValueError: The snaphost cannot be parsed.
+    """
+    # The string table follows the node and edge arrays, which only contain
+    # numbers, so the first occurrence of the key is the key.
+    key = data.find(b'"strings"')
+    match = None
+    if key >= 0:
+      match = _STRING_TABLE_START_RE.match(data, key + len(b'"strings"'))
+    self._progress.Start('decode', len(data), 'bytes')
+    if not match:
+      heap = self._json_backend.Loads(data[:])
+      self._progress.Finish()
+      return heap
+
+    offsets = array.array('q')
+    position = match.end()
+    self._progress.Update(position)
+    match = _JSON_STRING_RE.match(data, position)
+    while match:
+      offsets.append(match.start(1))
+      offsets.append(match.end(1))
+      position = match.end()
+      if len(offsets) % (2 * _PROGRESS_STEP) == 0:
+        self._progress.Update(position)
+      match = _JSON_STRING_RE.match(data, position)
+    match = _ARRAY_END_RE.match(data, position)
+    if not match:
+      raise ValueError('Cannot parse the string table of the heap snapshot')
+
+    heap = self._json_backend.Loads(data[:key] + b'"strings":[]' +
+                                    data[match.end():])
+    heap['strings'] = LazyStringTable(data, offsets)
+    self._progress.Finish()
+    return heap
+
+  def _LoadHeap(self, heap):
+    """Stores the data of a decoded heap snapshot.
+
     The snapshot contains a list of integers describing nodes (types, names,
     etc.) and a list of integers describing edges (types, the node the edge
     points to, etc.) and a string table. All strings are expressed as indices to
@@ -307,16 +1271,11 @@ class Snapshotter(object):
     fields for nodes and the data fields for edges.
 
     Args:
-      inspector_client: RemoteInspectorClient, the client to used for taking the
-          heap snapshot.
+      heap: {}, the decoded heap snapshot JSON.
     Raises:
       KeyError: The snapshot doesn't contain the required data fields.
-      ValueError: The snaphost cannot be parsed.
       Error: The snapshot format is not supported (e.g., too new version).
     """
-    raw_data = inspector_client.HeapSnapshot(include_summary=False)['raw_data']
-
-    heap = simplejson.loads(raw_data)
     self._node_list = heap['nodes']
     self._edge_list = heap['edges']
     self._strings = heap['strings']
@@ -330,6 +1289,21 @@ class Snapshotter(object):
     self._node_type_ix = self._FindField('type', node_fields)
     self._node_name_ix = self._FindField('name', node_fields)
     self._node_id_ix = self._FindField('id', node_fields)
+    self._node_self_size_ix = None
+    if 'self_size' in node_fields:
+      self._node_self_size_ix = node_fields.index('self_size')
+    self._node_trace_node_id_ix = None
+    if 'trace_node_id' in node_fields:
+      self._node_trace_node_id_ix = node_fields.index('trace_node_id')
+
+    # The allocation traces are present only if allocation tracking was
+    # enabled when the snapshot was taken.
+    self.allocation_traces = None
+    if heap.get('trace_tree'):
+      meta = heap['snapshot']['meta']
+      self.allocation_traces = AllocationTraces(
+          heap['trace_function_infos'], meta['trace_function_info_fields'],
+          heap['trace_tree'], meta['trace_node_fields'], self._strings)
 
     # Support 2 different snapshot formats:
     # - Define where edges for a given node start in the edge array as
@@ -376,8 +1350,7 @@ class Snapshotter(object):
       bool, True if the node is of an uninteresting type and shouldn't be
           included in the heap snapshot analysis.
     """
-    uninteresting_types = ('hidden', 'code', 'number', 'native', 'synthetic')
-    return type_string in uninteresting_types
+    return type_string in UNINTERESTING_NODE_TYPES
 
   @staticmethod
   def _IsEdgeTypeUninteresting(edge_type_string):
@@ -389,8 +1362,7 @@ class Snapshotter(object):
       bool, True if the edge is of an uninteresting type and shouldn't be
           included in the heap snapshot analysis.
     """
-    uninteresting_types = ('weak', 'hidden', 'internal')
-    return edge_type_string in uninteresting_types
+    return edge_type_string in UNINTERESTING_EDGE_TYPES
 
   def _ReadNodeFromIndex(self, ix, edges_start):
     """Reads the data for a node from the heap snapshot.
@@ -432,16 +1404,25 @@ class Snapshotter(object):
 
     if Snapshotter._IsNodeTypeUninteresting(type_string):
       return edges_end
+    if (self._relevant_node_ixs is not None and
+        ix not in self._relevant_node_ixs):
+      return edges_end
 
     name_ix = self._node_list[ix + self._node_name_ix]
     node_id = self._node_list[ix + self._node_id_ix]
 
+    self_size = 0
+    if self._node_self_size_ix is not None:
+      self_size = self._node_list[ix + self._node_self_size_ix]
+
     ctor_name = self._ConstructorName(type_string, name_ix)
-    n = Node(node_id, type_string, ctor_name)
+    n = Node(node_id, type_string, ctor_name, self_size)
     if type_string == 'string':
-      n.string = self._strings[int(name_ix)]
+      n.SetStringIndex(self._strings, int(name_ix))
+    if self._node_trace_node_id_ix is not None:
+      n.trace_node_id = self._node_list[ix + self._node_trace_node_id_ix]
 
-    for edge_ix in xrange(edges_start, edges_end, self._edge_field_count):
+    for edge_ix in range(edges_start, edges_end, self._edge_field_count):
       edge = self._ReadEdgeFromIndex(node_id, edge_ix)
       if edge:
         # The edge will be associated with the other endpoint when all the data
@@ -482,6 +1463,9 @@ class Snapshotter(object):
 
     if Snapshotter._IsNodeTypeUninteresting(child_node_type_string):
       return None
+    if (self._relevant_node_ixs is not None and
+        child_node_ix not in self._relevant_node_ixs):
+      return None
 
     child_name_string = ''
     # For element nodes, the child has no name (only an index).
@@ -492,31 +1476,221 @@ class Snapshotter(object):
       child_name_string = self._strings[int(child_name_or_ix)]
     return Edge(node_id, child_node_id, edge_type_string, child_name_string)
 
+  def _GetEdgeStarts(self):
+    """Computes where the edges of each node start in the edge array.
+
+    Returns:
+      [int], the edge array index where the edges of the i:th node start,
+          followed by the length of the edge array.
+    """
+    node_count = len(self._node_list) // self._node_field_count
+    edge_starts = [0] * (node_count + 1)
+    if self._node_edge_count_format:
+      edge_start = 0
+      for i in range(node_count):
+        edge_starts[i] = edge_start
+        edge_count = self._node_list[i * self._node_field_count +
+                                     self._node_edge_count_ix]
+        edge_start += edge_count * self._edge_field_count
+    else:
+      for i in range(node_count):
+        edge_starts[i] = self._node_list[i * self._node_field_count +
+                                         self._node_edges_start_ix]
+    edge_starts[node_count] = len(self._edge_list)
+    return edge_starts
+
+  def _FindRelevantNodes(self, leak_definition):
+    """Finds the nodes which are relevant for finding the given leaks.
+
+    Only nodes which can reach an element of a container are relevant: the
+    retaining paths of the elements consist of such nodes. Since the nodes
+    retaining a container or a bad stop node can reach the elements too, the
+    paths describing them are kept intact. In addition, the stack trace
+    strings referred to by the elements are kept.
+
+    The computation is done on the raw snapshot data, so that no Node or Edge
+    objects need to be constructed for the discarded parts of the heap.
+
+    Args:
+      leak_definition: LeakDefinition, describes the containers.
+    Returns:
+      set(int), indices into self._node_list of the relevant nodes.
+    """
+    node_field_count = self._node_field_count
+    edge_field_count = self._edge_field_count
+    node_list = self._node_list
+    edge_list = self._edge_list
+    edge_starts = self._GetEdgeStarts()
+    node_count = len(edge_starts) - 1
+
+    interesting_node_types = set(
+        ix for ix, t in enumerate(self._node_types)
+        if not Snapshotter._IsNodeTypeUninteresting(t))
+    interesting_edge_types = set(
+        ix for ix, t in enumerate(self._edge_types)
+        if not Snapshotter._IsEdgeTypeUninteresting(t))
+    element_types = set(ix for ix, t in enumerate(self._edge_types)
+                        if t == 'element')
+
+    def InterestingEdges(node):
+      """Yields (edge index, child node) for the interesting edges of node."""
+      for edge_ix in range(edge_starts[node], edge_starts[node + 1],
+                            edge_field_count):
+        edge_type_ix = edge_list[edge_ix + self._edge_type_ix]
+        if edge_type_ix not in interesting_edge_types:
+          continue
+        child_node_ix = edge_list[edge_ix + self._edge_to_node_ix]
+        if (node_list[child_node_ix + self._node_type_ix] not in
+            interesting_node_types):
+          continue
+        yield edge_ix, child_node_ix // node_field_count
+
+    def EdgeNameMatcher(name):
+      """Returns a function testing whether an edge is called name."""
+      if isinstance(self._strings, LazyStringTable):
+        name_ixs = self._strings.IndicesOf(name)
+      else:
+        name_ixs = set(ix for ix, s in enumerate(self._strings) if s == name)
+
+      def Matches(edge_ix):
+        name_or_ix = edge_list[edge_ix + self._edge_name_or_ix_ix]
+        if (edge_list[edge_ix + self._edge_type_ix] in element_types or
+            name_or_ix >= len(self._strings)):
+          return str(name_or_ix) == name
+        return name_or_ix in name_ixs
+      return Matches
+
+    interesting_nodes = [
+        i for i in range(node_count)
+        if (node_list[i * node_field_count + self._node_type_ix] in
+            interesting_node_types)]
+
+    # Find the containers by following the edges named in their descriptions.
+    containers = set()
+    for description in leak_definition.containers:
+      found = interesting_nodes
+      for name in description.split('.'):
+        matches = EdgeNameMatcher(name)
+        found = set(child for node in found
+                    for edge_ix, child in InterestingEdges(node)
+                    if matches(edge_ix))
+      containers.update(found)
+
+    elements = set()
+    for container in containers:
+      for edge_ix, child in InterestingEdges(container):
+        if edge_list[edge_ix + self._edge_type_ix] in element_types:
+          elements.add(child)
+
+    # Build the reverse adjacency of the interesting edges in the compressed
+    # sparse row format: the parents of the i:th node are
+    # parents[parent_starts[i]:parent_starts[i + 1]].
+    parent_starts = [0] * (node_count + 1)
+    for node in interesting_nodes:
+      for _, child in InterestingEdges(node):
+        parent_starts[child + 1] += 1
+    for i in range(node_count):
+      parent_starts[i + 1] += parent_starts[i]
+    parents = [0] * parent_starts[node_count]
+    fill = list(parent_starts)
+    for node in interesting_nodes:
+      for _, child in InterestingEdges(node):
+        parents[fill[child]] = node
+        fill[child] += 1
+
+    # The backward cone of the elements.
+    relevant = set(elements)
+    stack = list(elements)
+    while stack:
+      node = stack.pop()
+      for parent in parents[parent_starts[node]:parent_starts[node + 1]]:
+        if parent not in relevant:
+          relevant.add(parent)
+          stack.append(parent)
+
+    # Keep the stack traces stored in the elements.
+    suffix = leak_definition.stacktrace_suffix.lstrip('.')
+    if suffix:
+      matches = EdgeNameMatcher(suffix)
+      for element in elements:
+        for edge_ix, child in InterestingEdges(element):
+          if matches(edge_ix):
+            relevant.add(child)
+
+    return set(node * node_field_count for node in relevant)
+
   def _ParseSnapshot(self):
     """Parses the stored JSON snapshot data.
 
     Fills in self._node_dict with Node objects constructed based on the heap
     snapshot. The Node objects contain the associated Edge objects.
+
+    Raises:
+      progress.Cancelled: The parsing was cancelled.
     """
+    if self._leak_definition:
+      self._relevant_node_ixs = self._FindRelevantNodes(self._leak_definition)
+
+    node_field_count = self._node_field_count
+    self._progress.Start('parse', len(self._node_list) // node_field_count,
+                         'nodes')
+    step = _PROGRESS_STEP * node_field_count
     edge_start_ix = 0
-    for ix in xrange(0, len(self._node_list), self._node_field_count):
+    for ix in range(0, len(self._node_list), node_field_count):
+      if ix % step == 0:
+        self._progress.Update(ix // node_field_count)
       edge_start_ix = self._ReadNodeFromIndex(ix, edge_start_ix)
+    self._progress.Finish()
 
     # Add pointers to the endpoints to the edges, and associate the edges with
     # the "to" nodes.
-    for node_id in self._node_dict:
+    self._progress.Start('link', len(self._node_dict), 'nodes')
+    for count, node_id in enumerate(self._node_dict):
+      if count % _PROGRESS_STEP == 0:
+        self._progress.Update(count)
       n = self._node_dict[node_id]
       for e in n.edges_from:
         self._node_dict[e.to_node_id].AddEdgeTo(e)
         e.SetFromNode(n)
         e.SetToNode(self._node_dict[e.to_node_id])
+    self._progress.Finish()
 
 
 class LeakFinder(object):
-  """Finds potentially leaking JavaScript objects based on a heap snapshot."""
+  """Finds potentially leaking JavaScript objects based on a heap snapshot.
+
+  Attributes:
+    coverage: {str -> (int, int)}, maps the container names to the number of
+        container elements examined by the last FindLeaks call and the total
+        number of elements in the container.
+    stop_reason: str, describes why the last FindLeaks call stopped before
+        examining all the container elements, or None if it examined all of
+        them.
+    reused_count: int, the number of container elements whose classification
+        the last FindLeaks call carried over from the previous call.
+    windows: set(Node), the Window objects found by the last FindLeaks call.
+    bad_stop_nodes: set(Node), the bad stop nodes found by the last FindLeaks
+        call, including the containers.
+    containers: set(Node), the containers found by the last FindLeaks call.
+    sample_counts: {str -> [int, int, int]}, if the last FindLeaks call
+        classified a sample, maps the classes of the container elements to
+        the number of elements, the number of them classified and the number
+        of leaks among them; see Estimates.
+    _incremental: bool, whether the classifications are carried over between
+        FindLeaks calls.
+    _classifications: {int -> (bool, ...)}, maps the node ids of the container
+        elements examined by the previous FindLeaks call to whether they were
+        leaks, and the evidence the classification was based on: for a non-leak,
+        the node ids on a good retaining path; for a leak, the signatures of
+        the nodes on its retaining paths.
+    _previous_leaks: {int -> LeakNode}, the leaks found by the previous
+        FindLeaks call, by node id.
+    _progress: progress.ProgressReporter, receives the progress of classifying
+        the container elements.
+  """
 
   def __init__(self, containers, bad_stop_nodes, stacktrace_prefix,
-               stacktrace_suffix):
+               stacktrace_suffix, incremental=False, progress_reporter=None):
     """Initializes the LeakFinder object.
 
     Potentially leaking Node objects the are children of the nodes described by
@@ -535,22 +1709,71 @@ class LeakFinder(object):
           the stack trace. Useful e.g., if the JavaScript is in different frame.
       stacktrace_suffix: str, name of the member variable where the stack trace
           is stored.
+      incremental: bool, if True, each FindLeaks call is assumed to analyze a
+          later snapshot of the same heap. The container elements whose
+          retainers haven't changed since the previous call (based on the node
+          ids) keep their classification, and the leaks keep their stack
+          traces; only the changed elements are classified again.
+      progress_reporter: progress.ProgressReporter, if given, receives the
+          progress of classifying the container elements ('classify', in
+          elements), and can cancel it.
     """
     self._container_description = [c.split('.') for c in containers]
     self._bad_stop_node_description = [b.split('.') for b in bad_stop_nodes]
     self._stacktrace_prefix = stacktrace_prefix
     self._stacktrace_suffix = stacktrace_suffix
-
-  def FindLeaks(self, nodes):
+    self._incremental = incremental
+    self._classifications = {}
+    self._previous_leaks = {}
+    self.coverage = {}
+    self.stop_reason = None
+    self.reused_count = 0
+    self.windows = set()
+    self.bad_stop_nodes = set()
+    self.containers = set()
+    self.sample_counts = {}
+    self._progress = progress_reporter or progress.ProgressReporter()
+
+  def FindLeaks(self, nodes, time_budget=None, max_leaks=None, index=None,
+                sample_size=None, seed=0):
     """Finds Node objects which are potentially leaking.
 
+    The container elements are examined so that objects of different classes
+    come first; if the search is stopped early, the found leaks are as diverse
+    as possible. How much of each container was examined is recorded into
+    self.coverage.
+
+    If sample_size is given, only a sample of the container elements,
+    stratified by class, is examined, and the number of leaks of each class
+    can be estimated afterwards with Estimates.
+
+    In the incremental mode, the classification of the container elements is
+    carried over from the previous call when their retainers have not changed.
+
     Args:
       nodes: set(Node), Node objects in the snapshot.
+      time_budget: float, the number of seconds after which the search is
+          stopped, or None for no limit.
+      max_leaks: int, the number of leaks after which the search is stopped, or
+          None for no limit.
+      index: heap_index.HeapIndex, the index of nodes if it has already been
+          built; otherwise it is built here.
+      sample_size: int, the approximate number of container elements to
+          examine, or None for examining all of them.
+      seed: int, the seed of the random sample.
     Yields:
       LeakNode objects representing the potential leaks.
     Raises:
       Error: Cannot find the Nodes needed by the leak detection algorithm.
+      progress.Cancelled: The search was cancelled.
     """
+    deadline = None
+    if time_budget is not None:
+      deadline = time.time() + time_budget
+    self.coverage = {}
+    self.stop_reason = None
+    self.reused_count = 0
+    self.sample_counts = {}
 
     # The retaining paths are computed until meeting one of these nodes.
     stop_nodes = set()
@@ -563,30 +1786,39 @@ class LeakFinder(object):
     containers = set()
     found_container_edges = set()
 
+    if index is None:
+      index = heap_index.HeapIndex(nodes)
+
     # Find container nodes and stopper nodes based on the descriptions.
-    for node in nodes:
-      # Window objects are good stop nodes. If a retaining path goes through a
-      # Window object without going through any bad stop nodes, the retaining
-      # path is good, and the object is not a leak.
-      if node.class_name == 'Window' or node.class_name.startswith('Window / '):
+    # Window objects are good stop nodes. If a retaining path goes through a
+    # Window object without going through any bad stop nodes, the retaining
+    # path is good, and the object is not a leak.
+    windows = set()
+    for class_name in index.ClassNames():
+      if LeakFinder.IsWindowClass(class_name):
+        windows.update(index.InstancesOf(class_name))
+    for node in windows:
+      stop_nodes.add(node)
+      node.js_name = 'window'
+    named_bad_stop_nodes = set()
+    for edges in self._bad_stop_node_description:
+      for node in index.FindByPath(edges) - windows - named_bad_stop_nodes:
         stop_nodes.add(node)
-        node.js_name = 'window'
-        continue
-      for edges in self._bad_stop_node_description:
-        if LeakFinder._IsRetainedByEdges(node, edges):
-          stop_nodes.add(node)
-          bad_stop_nodes.add(node)
-          node.js_name = '.'.join(edges)
-          break
-      for edges in self._container_description:
-        if LeakFinder._IsRetainedByEdges(node, edges):
-          containers.add(node)
-          stop_nodes.add(node)
-          bad_stop_nodes.add(node)
-          node.container_name = '.'.join(edges)
-          found_container_edges.add(node.container_name)
-          node.js_name = '.'.join(edges)
-          break
+        bad_stop_nodes.add(node)
+        named_bad_stop_nodes.add(node)
+        node.js_name = '.'.join(edges)
+    for edges in self._container_description:
+      for node in index.FindByPath(edges) - windows - containers:
+        containers.add(node)
+        stop_nodes.add(node)
+        bad_stop_nodes.add(node)
+        node.container_name = '.'.join(edges)
+        found_container_edges.add(node.container_name)
+        node.js_name = '.'.join(edges)
+
+    self.windows = windows
+    self.bad_stop_nodes = bad_stop_nodes
+    self.containers = containers
 
     # Check that we found all the containers.
     for edges in self._container_description:
@@ -597,33 +1829,380 @@ class LeakFinder(object):
     # Find objects such that they are in the specified containers and all
     # retaining paths contain either the container or the specified bad stop
     # objects.
+    elements = []
     for container in containers:
-      for edge in container.edges_from:
-        if edge.type_string != 'element':
+      container_elements = [edge for edge in container.edges_from
+                            if edge.type_string == 'element']
+      self.coverage[container.container_name] = (0, len(container_elements))
+      elements.extend((container, edge) for edge in container_elements)
+    if sample_size is not None:
+      elements = self._Sample(elements, sample_size, random.Random(seed))
+
+    # Maps the nodes known to be retained by a good path to the node ids on
+    # that path, starting from the node itself.
+    good_paths = {}
+    previous_classifications = self._classifications
+    previous_leaks = self._previous_leaks
+    self._classifications = {}
+    self._previous_leaks = {}
+    carry_over = self._incremental and previous_classifications
+    signatures = {}
+
+    def CheckLimits():
+      # A single element can have exponentially many retaining paths, so the
+      # limits are also checked while classifying it.
+      self._progress.Check()
+      if deadline is not None and time.time() >= deadline:
+        raise _SearchStopped()
+
+    leak_count = 0
+    self._progress.Start('classify', len(elements), 'elements')
+    for examined_count, (container, edge) in enumerate(
+        LeakFinder._OrderByClass(elements)):
+      self._progress.Update(examined_count)
+      if deadline is not None and time.time() >= deadline:
+        self.stop_reason = 'time budget exhausted'
+        self._progress.Finish(examined_count)
+        return
+      if max_leaks is not None and leak_count >= max_leaks:
+        self.stop_reason = 'leak limit reached'
+        self._progress.Finish(examined_count)
+        return
+      node = edge.to_node
+      classification = None
+      if carry_over:
+        classification = LeakFinder._CarryOverClassification(
+            previous_classifications.get(node.node_id), index, bad_stop_nodes,
+            signatures)
+      if classification:
+        self.reused_count += 1
+        path = None
+        if not classification[0]:
+          path = [index.NodeById(node_id) for node_id in classification[1]]
+      else:
+        try:
+          classification, path = LeakFinder._Classify(
+              node, stop_nodes, bad_stop_nodes, good_paths, self._incremental,
+              CheckLimits)
+        except _SearchStopped:
+          self.stop_reason = 'time budget exhausted'
+          self._progress.Finish(examined_count)
+          return
+      examined, total = self.coverage[container.container_name]
+      self.coverage[container.container_name] = (examined + 1, total)
+      sample_counts = self.sample_counts.get(node.class_name)
+      if sample_counts:
+        sample_counts[1] += 1
+
+      is_leak, evidence = classification
+      if not is_leak:
+        # All the objects on the known good path are known to be non-leaks.
+        # Utilize this information when finding paths for other objects: As
+        # soon as we find a path which hits one of them, we know the object
+        # is not leaked.
+        for ix, path_node in enumerate(path):
+          stop_nodes.add(path_node)
+          good_paths.setdefault(path_node, evidence[ix:])
+      if self._incremental:
+        self._classifications[node.node_id] = classification
+      if is_leak:
+        node_description = '%s%s[%s]' % (self._stacktrace_prefix,
+                                         container.container_name,
+                                         edge.name_string)
+        leak = LeakNode(node, 'Leak', node_description,
+                        self._stacktrace_suffix)
+        if sample_counts:
+          sample_counts[2] += 1
+        if node.node_id in previous_leaks:
+          leak.stack = previous_leaks[node.node_id].stack
+        if self._incremental:
+          self._previous_leaks[node.node_id] = leak
+        leak_count += 1
+        yield leak
+    self._progress.Finish()
+
+  def ResetNames(self):
+    """Clears the names the last FindLeaks call gave to the nodes.
+
+    For analyzing the same nodes again with another leak definition, which
+    would otherwise see the container and bad stop node names of this one.
+    """
+    for node in self.windows | self.bad_stop_nodes:
+      node.js_name = ''
+    for node in self.containers:
+      node.container_name = None
+
+  def _Sample(self, elements, sample_size, rng):
+    """Draws a sample of the container elements, stratified by class.
+
+    Each class gets a share of the sample proportional to its number of
+    elements, but at least one element, so the sample may be slightly larger
+    than sample_size. The elements of each class are drawn at random. The
+    classes and their numbers of elements are recorded into
+    self.sample_counts.
+
+    Args:
+      elements: [(Node, Edge)], the containers and their element edges.
+      sample_size: int, the approximate size of the sample.
+      rng: random.Random, draws the sample.
+    Returns:
+      [(Node, Edge)], the sample.
+    """
+    strata = {}
+    for element in elements:
+      strata.setdefault(element[1].to_node.class_name, []).append(element)
+    sample = []
+    for class_name in sorted(strata):
+      members = strata[class_name]
+      self.sample_counts[class_name] = [len(members), 0, 0]
+      share = max(1, int(round(float(sample_size) * len(members) /
+                               len(elements))))
+      if share >= len(members):
+        sample.extend(members)
+      else:
+        sample.extend(rng.sample(members, share))
+    return sample
+
+  def Estimates(self, z=_CONFIDENCE_Z):
+    """Estimates the number of leaks per class from the last sample.
+
+    Args:
+      z: float, the z value of the confidence intervals; 1.96 for 95%.
+    Returns:
+      [LeakEstimate], the estimates of the sampled classes, the most leaks
+          first; empty if the last FindLeaks call didn't sample.
+    """
+    estimates = [LeakEstimate(class_name, population, sampled, leaks, z)
+                 for class_name, (population, sampled, leaks)
+                 in self.sample_counts.items()]
+    estimates.sort(key=lambda estimate: (-(estimate.estimate or 0),
+                                         estimate.class_name))
+    return estimates
+
+  def GroupLeaks(self, leaks):
+    """Groups the leaks by the retainers they share.
+
+    The leaks are grouped by their immediate retainers, other than the
+    containers of the last FindLeaks call and other leaks, and the types of
+    the retaining edges. The edge names and indices are ignored, so that the
+    elements of the same array, and the values of the same object used as a
+    map, keyed by ids, are grouped together. A leak retained only by the
+    containers and other leaks forms a group of its own.
+
+    Within a group, the leaks are represented per class and retaining edges,
+    where element indices and property names containing digits (taken for
+    ids) are ignored; see LeakGroup.
+
+    Args:
+      leaks: [LeakNode], the leaks found by the last FindLeaks call.
+    Returns:
+      [LeakGroup], the groups, in the order of their first leaks.
+    """
+    leaked = set(leak.node for leak in leaks)
+    groups = []
+    groups_by_key = {}
+    for leak in leaks:
+      retainers = {}
+      edges = set()
+      for edge in leak.node.edges_to:
+        if edge.from_node in self.containers or edge.from_node in leaked:
           continue
+        retainers[(edge.from_node.node_id, edge.type_string)] = (
+            edge.from_node)
+        name = edge.name_string
+        if edge.type_string == 'element' or _ID_LIKE_NAME_RE.search(name):
+          name = ''
+        edges.add((edge.from_node.node_id, edge.type_string, name))
+      key = frozenset(retainers)
+      group = key and groups_by_key.get(key)
+      if not group:
+        shared = []
+        for retainer_key in sorted(retainers):
+          if retainers[retainer_key] not in shared:
+            shared.append(retainers[retainer_key])
+        group = LeakGroup(shared)
+        groups.append(group)
+        if key:
+          groups_by_key[key] = group
+      group.Add(leak, frozenset(edges))
+    return groups
 
-        found_good_path = False
-        node = edge.to_node
-        for path in LeakFinder._FindRetainingPaths(node, [node], stop_nodes):
-          # If the last node on the path is in bad_stop_nodes, the path is bad,
-          # otherwise it's good (it may end in a good stop node or in a node
-          # which doesn't have parents).
-          if not path[-1] in bad_stop_nodes:
-            found_good_path = True
-            # All the objects on the known good path are known to be non-leaks.
-            # Utilize this information when finding paths for other objects: As
-            # soon as we find a path which hits one of them, we know the object
-            # is not leaked.
-            for node in path:
-              stop_nodes.add(node)
-            break
-        if not found_good_path:
-          node_description = '%s%s[%s]' % (self._stacktrace_prefix,
-                                           container.container_name,
-                                           edge.name_string)
-          leak = LeakNode(edge.to_node, 'Leak', node_description,
-                          self._stacktrace_suffix)
-          yield leak
+  @staticmethod
+  def _IsWindow(node):
+    """Returns True if node is a Window object.
+
+    Window objects are good stop nodes. If a retaining path goes through a
+    Window object without going through any bad stop nodes, the retaining path
+    is good, and the object is not a leak.
+    """
+    return LeakFinder.IsWindowClass(node.class_name)
+
+  @staticmethod
+  def IsWindowClass(class_name):
+    """Returns True if class_name is the class name of Window objects."""
+    return class_name == 'Window' or class_name.startswith('Window / ')
+
+  @staticmethod
+  def _Classify(node, stop_nodes, bad_stop_nodes, good_paths, leak_evidence,
+                check=None):
+    """Finds out whether a container element is a leak.
+
+    Args:
+      node: Node, the container element.
+      stop_nodes: set(Node), nodes which terminate the retaining paths.
+      bad_stop_nodes: set(Node), stop nodes which make a retaining path bad.
+      good_paths: {Node -> [int]}, the node ids on a good retaining path for
+          the stop nodes known to be retained by a good path.
+      leak_evidence: bool, whether to collect the evidence for leaks. If False,
+          the evidence of a leak is None.
+      check: function, if given, called every now and then during the search;
+          stops the search by raising an exception.
+    Returns:
+      ((bool, []), [Node]), the classification and the good retaining path
+          found, or None for a leak. The classification consists of whether
+          the node is a leak, and the evidence: for a non-leak, the node ids on
+          a good retaining path up to a Window object or an unretained node;
+          for a leak, the (node id, signature, is bad stop node) triples of the
+          nodes which may be on its retaining paths.
+    """
+    for path in LeakFinder._FindRetainingPaths(node, [node], stop_nodes,
+                                               check=check):
+      # If the last node on the path is in bad_stop_nodes, the path is bad,
+      # otherwise it's good (it may end in a good stop node or in a node
+      # which doesn't have parents).
+      if not path[-1] in bad_stop_nodes:
+        # If the path ends in a node known to be retained by a good path,
+        # continue with that path.
+        path_ids = [path_node.node_id for path_node in path[:-1]]
+        path_ids.extend(good_paths.get(path[-1], [path[-1].node_id]))
+        return (False, path_ids), list(path)
+
+    if not leak_evidence:
+      return (True, None), None
+    evidence = [(cone_node.node_id, LeakFinder._Signature(cone_node),
+                 cone_node in bad_stop_nodes)
+                for cone_node in LeakFinder._RetainingCone(node, stop_nodes,
+                                                           check=check)]
+    return (True, evidence), None
+
+  @staticmethod
+  def _Signature(node):
+    """Returns a hash of the retainers of a node.
+
+    Element indices are not included, since they change whenever an earlier
+    element is removed from an array.
+    """
+    retainers = []
+    for edge in node.edges_to:
+      name = edge.name_string
+      if edge.type_string == 'element':
+        name = ''
+      retainers.append((edge.from_node.node_id, edge.type_string, name))
+    retainers.sort()
+    return hash((node.class_name, tuple(retainers)))
+
+  @staticmethod
+  def _RetainingCone(node, stop_nodes, max_depth=30, check=None):
+    """Finds the nodes which may be on the retaining paths of a node.
+
+    Args:
+      node: Node, the node to find the retainers for.
+      stop_nodes: set(Node), nodes whose retainers are not included.
+      max_depth: int, the maximum length of the retaining paths.
+      check: function, if given, called every _CHECK_INTERVAL nodes; stops
+          the search by raising an exception.
+    Returns:
+      set(Node), the node and its retainers, up to the stop nodes.
+    """
+    cone = set([node])
+    frontier = [node]
+    visits = 0
+    for _ in range(max_depth + 1):
+      next_frontier = []
+      for cone_node in frontier:
+        visits += 1
+        if check and not visits % _CHECK_INTERVAL:
+          check()
+        if cone_node in stop_nodes and cone_node is not node:
+          continue
+        for edge in cone_node.edges_to:
+          if edge.from_node not in cone:
+            cone.add(edge.from_node)
+            next_frontier.append(edge.from_node)
+      frontier = next_frontier
+    return cone
+
+  @staticmethod
+  def _CarryOverClassification(classification, index, bad_stop_nodes,
+                               signatures):
+    """Checks whether a previous classification is still valid.
+
+    A non-leak stays a non-leak if its good retaining path still exists. A leak
+    stays a leak if none of the nodes on its retaining paths has gained or lost
+    retainers, or become or stopped being a bad stop node.
+
+    Args:
+      classification: (bool, []), the previous classification as returned by
+          _Classify, or None.
+      index: heap_index.HeapIndex, the index of the current snapshot.
+      bad_stop_nodes: set(Node), the current bad stop nodes.
+      signatures: {Node -> int}, cache of the signatures of the nodes in the
+          current snapshot.
+    Returns:
+      (bool, []), the classification if it is still valid, otherwise None.
+    """
+    if not classification:
+      return None
+    is_leak, evidence = classification
+    if not is_leak:
+      path = [index.NodeById(node_id) for node_id in evidence]
+      if None in path:
+        return None
+      for child, parent in zip(path, path[1:]):
+        if child in bad_stop_nodes:
+          return None
+        if not any(edge.from_node is parent for edge in child.edges_to):
+          return None
+      if path[-1] in bad_stop_nodes:
+        return None
+      if path[-1].edges_to and not LeakFinder._IsWindow(path[-1]):
+        return None
+      return classification
+
+    for node_id, signature, is_bad_stop_node in evidence:
+      node = index.NodeById(node_id)
+      if node is None or (node in bad_stop_nodes) != is_bad_stop_node:
+        return None
+      if node not in signatures:
+        signatures[node] = LeakFinder._Signature(node)
+      if signatures[node] != signature:
+        return None
+    return classification
+
+  @staticmethod
+  def _OrderByClass(elements):
+    """Orders container elements so that different classes come first.
+
+    The first element of each class comes before the second element of any
+    class, and so on. Within these rounds, the classes are ordered by their
+    first appearance.
+
+    Args:
+      elements: [(Node, Edge)], the containers and the edges to their
+          elements.
+    Returns:
+      [(Node, Edge)], the reordered elements.
+    """
+    class_order = {}
+    class_counts = {}
+    keys = {}
+    for _, edge in elements:
+      class_name = edge.to_node.class_name
+      class_order.setdefault(class_name, len(class_order))
+      rank = class_counts.get(class_name, 0)
+      class_counts[class_name] = rank + 1
+      keys[edge] = (rank, class_order[class_name])
+    return sorted(elements, key=lambda element: keys[element[1]])
 
   @staticmethod
   def _IsRetainedByEdges(node, edge_names):
@@ -683,19 +2262,26 @@ class LeakFinder(object):
     return ''
 
   @staticmethod
-  def _FindRetainingPaths(node, visited, stop_nodes, max_depth=30):
+  def _FindRetainingPaths(node, visited, stop_nodes, max_depth=30,
+                          check=None):
     """Finds retaining paths for a Node.
 
+    The paths are searched depth first with an explicit stack, so that deep
+    heaps don't exhaust the Python stack, and the nodes on the current path
+    are also kept in a set for checking for loops.
+
     Args:
       node: Node, the Node to find the retaining paths for.
       visited: [Node], the visited path so far.
       stop_nodes: set(Node), nodes which terminate the path (we don't care how
           they are retained)
       max_depth: int, the maximum length of retaining paths to search. The
-          search will be terminated when at least one path exceeding max_depth
-          is found.
+          paths longer than this are not followed further.
+      check: function, if given, called every _CHECK_INTERVAL retainers;
+          stops the search by raising an exception.
     Yields:
-      [Node], retaining paths.
+      [Node], retaining paths. The same list is yielded each time and changed
+          afterwards; copy it to keep it.
     """
     if len(visited) > max_depth:
       return
@@ -703,10 +2289,181 @@ class LeakFinder(object):
       yield visited
       return
 
-    for edge in node.edges_to:
-      if edge.from_node not in visited:
-        visited.append(edge.from_node)
-        for path in LeakFinder._FindRetainingPaths(edge.from_node, visited,
-                                                   stop_nodes):
-          yield path
-        visited.pop()
+    on_path = set(visited)
+    # The edges of the nodes on the path which are yet to be followed.
+    edge_iterators = [iter(node.edges_to)]
+    visits = 0
+    while edge_iterators:
+      for edge in edge_iterators[-1]:
+        visits += 1
+        if check and not visits % _CHECK_INTERVAL:
+          check()
+        retainer = edge.from_node
+        if retainer in on_path or len(visited) >= max_depth:
+          continue
+        visited.append(retainer)
+        if not retainer.edges_to or retainer in stop_nodes:
+          yield visited
+          visited.pop()
+          continue
+        on_path.add(retainer)
+        edge_iterators.append(iter(retainer.edges_to))
+        break
+      else:
+        edge_iterators.pop()
+        if edge_iterators:
+          on_path.discard(visited.pop())
+
+  @staticmethod
+  def FindTopRetainingPaths(node, stop_nodes, k=3, max_depth=30,
+                            distinct_hops=3, max_visits=_DEFAULT_PATH_VISITS,
+                            time_budget=_DEFAULT_PATH_TIME_BUDGET,
+                            clock=time.time):
+    """Finds the k most distinct retaining paths of a Node.
+
+    The paths are searched best first, so they are found in the order of
+    their rank: shorter paths first, and of the paths of the same length,
+    those through fewer edges other than properties and elements. The paths
+    which share their first distinct_hops retainers with a better path only
+    differ in how the rest of the path is retained, so only the better path
+    is kept.
+
+    Each node is extended at most k times, by its best partial paths with
+    distinct first retainers, as in the k shortest paths algorithms; a worse
+    partial path through the node cannot lead to one of the k best distinct
+    paths. The partial paths refer to their parents instead of copying the
+    nodes, so extending one takes constant time, apart from the check for
+    loops.
+
+    Args:
+      node: Node, the Node to find the retaining paths for.
+      stop_nodes: set(Node), nodes which terminate the paths.
+      k: int, the maximum number of paths to find.
+      max_depth: int, the maximum length of the paths, as in
+          _FindRetainingPaths.
+      distinct_hops: int, the number of retainers from node on which the
+          paths must differ.
+      max_visits: int, the maximum number of partial paths to create or
+          extend.
+      time_budget: float, the number of seconds after which the search is
+          stopped, or None for no limit.
+      clock: function, returns the current time in seconds.
+    Returns:
+      ([[Node]], str), the paths, each starting from node and ending in a stop
+          node or in a node without retainers, best first, and why the search
+          was stopped before finding k paths or all the paths, or None.
+    """
+    deadline = None
+    if time_budget is not None:
+      deadline = clock() + time_budget
+    paths = []
+    prefixes = set()
+    extended = {}
+    # The nodes with k partial paths better than any partial path to be found.
+    full = set()
+    # The best partial paths to each node so far, as (length, cost, first
+    # retainers).
+    labels = {node: [(1, 0, ())]}
+    # The partial paths, as (node, index of the parent partial path, the
+    # first distinct_hops retainers on the path).
+    partial_paths = [(node, None, ())]
+    # The partial paths to extend, as (length, cost, index); the index breaks
+    # the ties in the order the paths were found.
+    queue = [(1, 0, 0)]
+    visits = 1
+    while queue and len(paths) < k:
+      if visits >= max_visits:
+        return paths, 'visit budget exhausted'
+      if deadline is not None and clock() >= deadline:
+        return paths, 'time budget exhausted'
+      visits += 1
+      length, cost, index = heapq.heappop(queue)
+      last, _, prefix = partial_paths[index]
+      # Of the partial paths through a node with the same first retainers,
+      # only the best one can lead to a distinct path.
+      node_extended = extended.setdefault(last, set())
+      if (prefix in prefixes or prefix in node_extended or
+          len(node_extended) >= k):
+        continue
+      node_extended.add(prefix)
+      if not last.edges_to or last in stop_nodes:
+        paths.append(LeakFinder._PartialPathNodes(partial_paths, index))
+        prefixes.add(prefix)
+        continue
+      if length >= max_depth:
+        continue
+      # The partial paths are popped best first, so the partial paths found
+      # from now on are at least this long and costly.
+      bound = (length + 1, cost)
+      for edge in last.edges_to:
+        retainer = edge.from_node
+        if retainer in full:
+          continue
+        retainer_labels = labels.setdefault(retainer, [])
+        if sum(1 for label in retainer_labels if label[:2] <= bound) >= k:
+          full.add(retainer)
+          continue
+        retainer_cost = cost + _PATH_EDGE_COSTS.get(edge.type_string,
+                                                     _DEFAULT_PATH_EDGE_COST)
+        retainer_prefix = prefix
+        if len(prefix) < distinct_hops:
+          retainer_prefix = prefix + (retainer,)
+        # Skip the partial path if the retainer already has k better ones, or
+        # a better one with the same first retainers.
+        better = 0
+        for label in retainer_labels:
+          if label[:2] <= (length + 1, retainer_cost):
+            if label[2] == retainer_prefix:
+              break
+            better += 1
+        else:
+          if better < k and not LeakFinder._IsOnPartialPath(
+              partial_paths, index, retainer):
+            retainer_labels.append((length + 1, retainer_cost,
+                                    retainer_prefix))
+            partial_paths.append((retainer, index, retainer_prefix))
+            heapq.heappush(queue, (length + 1, retainer_cost,
+                                   len(partial_paths) - 1))
+            visits += 1
+    return paths, None
+
+  @staticmethod
+  def _IsOnPartialPath(partial_paths, index, node):
+    """Returns True if node is on the partial path ending at index."""
+    while index is not None:
+      path_node, index, _ = partial_paths[index]
+      if path_node is node:
+        return True
+    return False
+
+  @staticmethod
+  def _PartialPathNodes(partial_paths, index):
+    """Returns the nodes of a partial path, starting from the first one."""
+    nodes = []
+    while index is not None:
+      path_node, index, _ = partial_paths[index]
+      nodes.append(path_node)
+    nodes.reverse()
+    return nodes
+
+  def DescribeRetainingPaths(self, node, k=3,
+                             time_budget=_DEFAULT_PATH_TIME_BUDGET):
+    """Describes the most distinct retaining paths of a leaking object.
+
+    The paths end in the Window objects and the bad stop nodes found by the
+    last FindLeaks call; see FindTopRetainingPaths.
+
+    Args:
+      node: Node, the leaking object.
+      k: int, the maximum number of paths.
+      time_budget: float, the number of seconds after which the search is
+          stopped, or None for no limit.
+    Returns:
+      [str], the paths as JavaScript expressions, best first.
+    """
+    paths, stop_reason = LeakFinder.FindTopRetainingPaths(
+        node, self.windows | self.bad_stop_nodes, k, time_budget=time_budget)
+    if stop_reason:
+      logging.warning('Found %d retaining paths of %s (%s)', len(paths), node,
+                      stop_reason)
+    return [LeakFinder._RetainingPathToString(path) for path in paths]
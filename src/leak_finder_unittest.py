@@ -16,10 +16,16 @@
 
 """Tests LeakFinder."""
 
+import json
+import os
+import random
+import shutil
+import tempfile
 import unittest
 
-import simplejson
 import leak_finder
+import progress
+import snapshot_testdata
 
 
 class LeakFinderTest(unittest.TestCase):
@@ -123,7 +129,7 @@ class LeakFinderTest(unittest.TestCase):
     return [n1, n2, n3, n4]
 
   def _DataLeaks(self):
-    """Helper for creating test data.
+    r"""Helper for creating test data.
 
     (n1) - container -> (n2) - [0] -> (n3)
                          |
@@ -198,6 +204,131 @@ class LeakFinderTest(unittest.TestCase):
     self.assertEqual(n2, paths[0][1])
     self.assertEqual(n4, paths[0][2])
 
+  def _RecursiveRetainingPaths(self, node, visited, stop_nodes, max_depth):
+    """The recursive version of LeakFinder._FindRetainingPaths."""
+    if len(visited) > max_depth:
+      return
+    if not node.edges_to or node in stop_nodes:
+      yield list(visited)
+      return
+    for edge in node.edges_to:
+      if edge.from_node not in visited:
+        visited.append(edge.from_node)
+        for path in self._RecursiveRetainingPaths(edge.from_node, visited,
+                                                  stop_nodes, max_depth):
+          yield path
+        visited.pop()
+
+  def testFindRetainingPathsLikeRecursive(self):
+    rng = random.Random(0)
+    for _ in range(200):
+      nodes = [leak_finder.Node(i, 'object', 'Object')
+               for i in range(rng.randint(2, 8))]
+      for i in range(rng.randint(1, 16)):
+        self._CreatePropertyEdge(rng.choice(nodes), rng.choice(nodes), str(i))
+      stop_nodes = set(rng.sample(nodes, rng.randint(0, 2)))
+      max_depth = rng.choice([2, 3, 30])
+      expected = list(self._RecursiveRetainingPaths(nodes[0], [nodes[0]],
+                                                    stop_nodes, max_depth))
+      paths = self._GetLists(leak_finder.LeakFinder._FindRetainingPaths(
+          nodes[0], [nodes[0]], stop_nodes, max_depth))
+      self.assertEqual(expected, paths)
+
+  def _DataRankedPaths(self):
+    """Helper for creating test data.
+
+    (w) - context -> (c) - a -> (t)
+    (w) - property -> (p) - b -> (t)
+    (w) - first -> (q1) - second -> (q2) - c -> (t)
+
+    Returns:
+      List of Nodes in the data.
+    """
+    w = leak_finder.Node(1, 'object', 'Window')
+    t = leak_finder.Node(2, 'object', 'Object')
+    c = leak_finder.Node(3, 'object', 'Object')
+    p = leak_finder.Node(4, 'object', 'Object')
+    q1 = leak_finder.Node(5, 'object', 'Object')
+    q2 = leak_finder.Node(6, 'object', 'Object')
+    self._CreatePropertyEdge(q2, t, 'c')
+    self._CreatePropertyEdge(c, t, 'a')
+    self._CreatePropertyEdge(p, t, 'b')
+    edge = leak_finder.Edge(w.node_id, c.node_id, 'context', 'context')
+    edge.SetFromNode(w).SetToNode(c)
+    w.AddEdgeFrom(edge)
+    c.AddEdgeTo(edge)
+    self._CreatePropertyEdge(w, p, 'property')
+    self._CreatePropertyEdge(w, q1, 'first')
+    self._CreatePropertyEdge(q1, q2, 'second')
+    return [w, t, c, p, q1, q2]
+
+  def testFindTopRetainingPathsRanking(self):
+    [w, t, c, p, q1, q2] = self._DataRankedPaths()
+    paths, stop_reason = leak_finder.LeakFinder.FindTopRetainingPaths(
+        t, set([w]), k=3)
+    self.assertEqual([[t, p, w], [t, c, w], [t, q2, q1, w]], paths)
+    self.assertEqual(None, stop_reason)
+
+    paths, _ = leak_finder.LeakFinder.FindTopRetainingPaths(t, set([w]), k=1)
+    self.assertEqual([[t, p, w]], paths)
+    paths, _ = leak_finder.LeakFinder.FindTopRetainingPaths(
+        t, set([w]), max_depth=3)
+    self.assertEqual([[t, p, w], [t, c, w]], paths)
+
+  def testFindTopRetainingPathsDistinctHops(self):
+    r"""Tests that the paths differing only in their tail are deduplicated.
+
+    (w) - x -> (b1) - y -> (a) - z -> (t)
+      \                  /
+       - x -> (b2) - y -
+    """
+    w = leak_finder.Node(1, 'object', 'Window')
+    b1 = leak_finder.Node(2, 'object', 'Object')
+    b2 = leak_finder.Node(3, 'object', 'Object')
+    a = leak_finder.Node(4, 'object', 'Object')
+    t = leak_finder.Node(5, 'object', 'Object')
+    self._CreatePropertyEdge(a, t, 'z')
+    self._CreatePropertyEdge(b1, a, 'y')
+    self._CreatePropertyEdge(b2, a, 'y')
+    self._CreatePropertyEdge(w, b1, 'x')
+    self._CreatePropertyEdge(w, b2, 'x')
+    paths, _ = leak_finder.LeakFinder.FindTopRetainingPaths(
+        t, set([w]), distinct_hops=1)
+    self.assertEqual([[t, a, b1, w]], paths)
+    paths, _ = leak_finder.LeakFinder.FindTopRetainingPaths(
+        t, set([w]), distinct_hops=2)
+    self.assertEqual([[t, a, b1, w], [t, a, b2, w]], paths)
+
+  def testFindTopRetainingPathsBudgets(self):
+    [w, t, _, p, _, _] = self._DataRankedPaths()
+    paths, stop_reason = leak_finder.LeakFinder.FindTopRetainingPaths(
+        t, set([w]), max_visits=6)
+    self.assertEqual('visit budget exhausted', stop_reason)
+    self.assertTrue(len(paths) < 3)
+
+    times = iter(range(100))
+    paths, stop_reason = leak_finder.LeakFinder.FindTopRetainingPaths(
+        t, set([w]), time_budget=3, clock=lambda: next(times))
+    self.assertEqual('time budget exhausted', stop_reason)
+    self.assertEqual([], paths)
+
+    # A wide heap is searched in time linear in k and the number of edges.
+    layers = [[t]]
+    for depth in range(6):
+      layer = [leak_finder.Node(100 * depth + i + 10, 'object', 'Object')
+               for i in range(30)]
+      for retainer in layer:
+        for node in layers[-1]:
+          self._CreatePropertyEdge(retainer, node, 'x')
+      layers.append(layer)
+    for node in layers[-1]:
+      self._CreatePropertyEdge(w, node, 'x')
+    paths, stop_reason = leak_finder.LeakFinder.FindTopRetainingPaths(
+        layers[1][0], set([w]), time_budget=None, max_visits=2000)
+    self.assertEqual(None, stop_reason)
+    self.assertEqual([7, 7, 7], [len(path) for path in paths])
+    self.assertEqual(3, len(set(tuple(path[1:4]) for path in paths)))
+
   def testFindLeaksBranch(self):
     nodelist = [_, _, n3, n4, _, _, _, _, _] = self._DataLeaks()
     nodes = set()
@@ -210,27 +341,349 @@ class LeakFinderTest(unittest.TestCase):
     self.assertTrue(leaks[0].node == n4 or leaks[1].node == n4)
     self.assertNotEqual(leaks[0].node, leaks[1].node)
 
+  def testFindLeaksMaxLeaks(self):
+    nodes = set(self._DataLeaks())
+    lf = leak_finder.LeakFinder(['container'], ['bad'], '', '')
+    leaks = self._GetObjects(lf.FindLeaks(nodes, max_leaks=1))
+    self.assertEqual(1, len(leaks))
+    self.assertEqual('leak limit reached', lf.stop_reason)
+    self.assertEqual(3, lf.coverage['container'][1])
+    self.assertTrue(lf.coverage['container'][0] < 3)
+
+  def testFindLeaksTimeBudget(self):
+    nodes = set(self._DataLeaks())
+    lf = leak_finder.LeakFinder(['container'], ['bad'], '', '')
+    leaks = self._GetObjects(lf.FindLeaks(nodes, time_budget=0))
+    self.assertEqual(0, len(leaks))
+    self.assertEqual('time budget exhausted', lf.stop_reason)
+    self.assertEqual({'container': (0, 3)}, lf.coverage)
+
+    leaks = self._GetObjects(lf.FindLeaks(nodes, time_budget=60))
+    self.assertEqual(2, len(leaks))
+    self.assertEqual(None, lf.stop_reason)
+    self.assertEqual({'container': (3, 3)}, lf.coverage)
+
+  def _DataDenseLeak(self):
+    """Helper for creating test data.
+
+    (n1 Window) - container -> (n2) - [0] -> (n3)
+        |
+        `- bad -> (n4) <- x - (8 nodes) <- x - ... <- x - (8 nodes) <- x - (n3)
+
+    Each of the 12 layers of 8 nodes retains each node of the next one, so
+    there are 8^12 retaining paths to the bad node.
+
+    Returns:
+      List of Nodes in the data.
+    """
+    n1 = leak_finder.Node(1, 'object', 'Window')
+    n2 = leak_finder.Node(2, 'array', 'Array')
+    n3 = leak_finder.Node(3, 'object', 'Leaked')
+    n4 = leak_finder.Node(4, 'object', 'Object')
+    self._CreatePropertyEdge(n1, n2, 'container')
+    self._CreatePropertyEdge(n1, n4, 'bad')
+    self._CreateElementEdge(n2, n3, '0')
+    nodes = [n1, n2, n3, n4]
+    layer = [n3]
+    for depth in range(12):
+      retainers = [leak_finder.Node(100 * depth + i + 10, 'object', 'Object')
+                   for i in range(8)]
+      for retainer in retainers:
+        for node in layer:
+          self._CreatePropertyEdge(retainer, node, 'x')
+      nodes.extend(retainers)
+      layer = retainers
+    for node in layer:
+      self._CreatePropertyEdge(n4, node, 'x')
+    return nodes
+
+  def testFindLeaksTimeBudgetWithinElement(self):
+    nodes = set(self._DataDenseLeak())
+    lf = leak_finder.LeakFinder(['container'], ['bad'], '', '')
+    leaks = self._GetObjects(lf.FindLeaks(nodes, time_budget=0.1))
+    self.assertEqual([], leaks)
+    self.assertEqual('time budget exhausted', lf.stop_reason)
+    self.assertEqual({'container': (0, 1)}, lf.coverage)
+
+  def testFindLeaksCancelledWithinElement(self):
+
+    class CountdownToken(progress.CancellationToken):
+      """Is cancelled after a number of checks."""
+
+      def __init__(self, checks):
+        progress.CancellationToken.__init__(self)
+        self.checks = checks
+
+      def Check(self):
+        self.checks -= 1
+        if not self.checks:
+          self.Cancel()
+        progress.CancellationToken.Check(self)
+
+    token = CountdownToken(5)
+    lf = leak_finder.LeakFinder(
+        ['container'], ['bad'], '', '',
+        progress_reporter=progress.ProgressReporter(token=token))
+    self.assertRaises(progress.Cancelled, self._GetObjects,
+                      lf.FindLeaks(set(self._DataDenseLeak())))
+    self.assertTrue(token.checks <= 0)
+
+  def _DataSession(self, third_retained):
+    """Helper for creating test data for successive snapshots.
+
+    (n1 Window) - lib -> (n2) - [0] -> (n3)
+        |                 |
+        |                 |- [1] -> (n4) <- a - (n6) <- bad - (n1)
+        |                 |
+        |                 `- [2] -> (n5) <- keep - (n1)
+        |
+        `- keep2 -> (n3), if third_retained
+
+    Args:
+      third_retained: bool, whether n3 is retained by the Window.
+    Returns:
+      List of Nodes in the data.
+    """
+    n1 = leak_finder.Node(1, 'object', 'Window')
+    n2 = leak_finder.Node(2, 'array', 'Array')
+    n3 = leak_finder.Node(3, 'object', 'Object')
+    n4 = leak_finder.Node(4, 'object', 'Object')
+    n5 = leak_finder.Node(5, 'object', 'Object')
+    n6 = leak_finder.Node(6, 'object', 'Object')
+    self._CreatePropertyEdge(n1, n2, 'lib')
+    self._CreateElementEdge(n2, n3, '0')
+    self._CreateElementEdge(n2, n4, '1')
+    self._CreateElementEdge(n2, n5, '2')
+    self._CreatePropertyEdge(n1, n6, 'bad')
+    self._CreatePropertyEdge(n6, n4, 'a')
+    self._CreatePropertyEdge(n1, n5, 'keep')
+    if third_retained:
+      self._CreatePropertyEdge(n1, n3, 'keep2')
+    return [n1, n2, n3, n4, n5, n6]
+
+  def testFindLeaksIncremental(self):
+    lf = leak_finder.LeakFinder(['lib'], ['bad'], '', '', incremental=True)
+    leaks = self._GetObjects(lf.FindLeaks(self._DataSession(False)))
+    self.assertEqual([3, 4], sorted(leak.node.node_id for leak in leaks))
+    self.assertEqual(0, lf.reused_count)
+    for leak in leaks:
+      leak.stack = 'stack of %d' % leak.node.node_id
+
+    # Nothing changed.
+    leaks = self._GetObjects(lf.FindLeaks(self._DataSession(False)))
+    self.assertEqual([3, 4], sorted(leak.node.node_id for leak in leaks))
+    self.assertEqual(3, lf.reused_count)
+    self.assertEqual(['stack of 3', 'stack of 4'],
+                     sorted(leak.stack for leak in leaks))
+
+    # n3 gained a good retaining path.
+    leaks = self._GetObjects(lf.FindLeaks(self._DataSession(True)))
+    self.assertEqual([4], [leak.node.node_id for leak in leaks])
+    self.assertEqual(2, lf.reused_count)
+    self.assertEqual('stack of 4', leaks[0].stack)
+
+    # n3 lost the good retaining path.
+    leaks = self._GetObjects(lf.FindLeaks(self._DataSession(False)))
+    self.assertEqual([3, 4], sorted(leak.node.node_id for leak in leaks))
+    self.assertEqual(2, lf.reused_count)
+
+  def testFindLeaksNotIncremental(self):
+    lf = leak_finder.LeakFinder(['lib'], ['bad'], '', '')
+    self._GetObjects(lf.FindLeaks(self._DataSession(False)))
+    leaks = self._GetObjects(lf.FindLeaks(self._DataSession(False)))
+    self.assertEqual([3, 4], sorted(leak.node.node_id for leak in leaks))
+    self.assertEqual(0, lf.reused_count)
+    self.assertEqual([None, None], [leak.stack for leak in leaks])
+
+  def testOrderByClass(self):
+    container = leak_finder.Node(1, 'array', 'Array')
+    n2 = leak_finder.Node(2, 'object', 'A')
+    n3 = leak_finder.Node(3, 'object', 'A')
+    n4 = leak_finder.Node(4, 'object', 'B')
+    self._CreateElementEdge(container, n2, '0')
+    self._CreateElementEdge(container, n3, '1')
+    self._CreateElementEdge(container, n4, '2')
+    elements = [(container, edge) for edge in container.edges_from]
+    ordered = leak_finder.LeakFinder._OrderByClass(elements)
+    self.assertEqual([n2, n4, n3], [edge.to_node for _, edge in ordered])
+
+  def _DataManyElements(self, leaking_count, retained_count):
+    """Helper for creating test data.
+
+    (window) - lib -> (array) - [i] -> (A), leaking_count of them
+                              - [j] -> (B) <- keep - (window), retained_count
+                                                               of them
+
+    Returns:
+      List of Nodes in the data.
+    """
+    window = leak_finder.Node(1, 'object', 'Window')
+    container = leak_finder.Node(2, 'array', 'Array')
+    self._CreatePropertyEdge(window, container, 'lib')
+    nodes = [window, container]
+    for i in range(leaking_count + retained_count):
+      node = leak_finder.Node(i + 3, 'object',
+                              'A' if i < leaking_count else 'B')
+      self._CreateElementEdge(container, node, str(i))
+      if i >= leaking_count:
+        self._CreatePropertyEdge(window, node, 'keep')
+      nodes.append(node)
+    return nodes
+
+  def testFindLeaksSample(self):
+    lf = leak_finder.LeakFinder(['lib'], [], '', '')
+    nodes = self._DataManyElements(30, 10)
+    leaks = self._GetObjects(lf.FindLeaks(nodes, sample_size=8))
+    self.assertEqual(6, len(leaks))
+    self.assertEqual({'A': [30, 6, 6], 'B': [10, 2, 0]}, lf.sample_counts)
+    self.assertEqual({'lib': (8, 40)}, lf.coverage)
+    [a, b] = lf.Estimates()
+    self.assertEqual(('A', 30.0), (a.class_name, a.estimate))
+    self.assertAlmostEqual(30, a.high)
+    self.assertTrue(6 < a.low < 30)
+    self.assertEqual(('B', 0.0, 0.0), (b.class_name, b.estimate, b.low))
+    self.assertTrue(0 < b.high < 10)
+
+    # The same seed draws the same sample.
+    ids = [leak.node.node_id for leak in leaks]
+    leaks = self._GetObjects(lf.FindLeaks(nodes, sample_size=8))
+    self.assertEqual(ids, [leak.node.node_id for leak in leaks])
+
+    # Without sampling, there are no estimates.
+    self._GetObjects(lf.FindLeaks(nodes))
+    self.assertEqual([], lf.Estimates())
+
+  def _DataSharedRetainer(self):
+    """Helper for creating test data.
+
+    (n1 Window) - lib -> (n2) - [0..3] -> (n3 A), (n4 A), (n5 B), (n6 A)
+        |                                   ^       ^       ^
+        `- bad -> (n7 Map) - [0], [1], [2] -'-------'-------'
+
+    Returns:
+      List of Nodes in the data.
+    """
+    n1 = leak_finder.Node(1, 'object', 'Window')
+    n2 = leak_finder.Node(2, 'array', 'Array')
+    n7 = leak_finder.Node(7, 'object', 'Map')
+    self._CreatePropertyEdge(n1, n2, 'lib')
+    self._CreatePropertyEdge(n1, n7, 'bad')
+    nodes = [n1, n2, n7]
+    for i, class_name in enumerate(['A', 'A', 'B', 'A']):
+      node = leak_finder.Node(i + 3, 'object', class_name)
+      self._CreateElementEdge(n2, node, str(i))
+      if i < 3:
+        self._CreateElementEdge(n7, node, str(i))
+      nodes.append(node)
+    return nodes
+
+  def testGroupLeaks(self):
+    nodes = [_, _, n7, n3, n4, n5, n6] = self._DataSharedRetainer()
+    lf = leak_finder.LeakFinder(['lib'], ['bad'], '', '')
+    leaks = self._GetObjects(lf.FindLeaks(nodes))
+    leaks.sort(key=lambda leak: leak.node.node_id)
+    groups = lf.GroupLeaks(leaks)
+    self.assertEqual(2, len(groups))
+    self.assertEqual([n7], groups[0].retainers)
+    self.assertEqual([n3, n4, n5], [leak.node for leak in groups[0].leaks])
+    self.assertEqual({'A': 2, 'B': 1}, groups[0].classes)
+    self.assertEqual([n3, n5], sorted(
+        [leak.node for leak in groups[0].Representatives()],
+        key=lambda node: node.node_id))
+    self.assertEqual([], groups[1].retainers)
+    self.assertEqual([n6], [leak.node for leak in groups[1].leaks])
+
+    leaks[0].stack = 'stack of A'
+    leaks[2].stack = 'stack of B'
+    groups[0].ShareStacks()
+    self.assertEqual(['stack of A', 'stack of A', 'stack of B', None],
+                     [leak.stack for leak in leaks])
+
+  def testGroupLeaksByPropertyKeys(self):
+    """Tests that the values of an object keyed by ids are grouped.
+
+    (n1 Window) - lib -> (n2) - [0..2] -> (n3 A), (n4 A), (n5 A)
+        |                                   ^       ^
+        `- bad -> (n6) - id3, id4 ----------'-------'
+    """
+    n1 = leak_finder.Node(1, 'object', 'Window')
+    n2 = leak_finder.Node(2, 'array', 'Array')
+    n6 = leak_finder.Node(6, 'object', 'Object')
+    self._CreatePropertyEdge(n1, n2, 'lib')
+    self._CreatePropertyEdge(n1, n6, 'bad')
+    nodes = [n1, n2, n6]
+    for i in range(3):
+      node = leak_finder.Node(i + 3, 'object', 'A')
+      self._CreateElementEdge(n2, node, str(i))
+      if i < 2:
+        self._CreatePropertyEdge(n6, node, 'id%d' % node.node_id)
+      nodes.append(node)
+    lf = leak_finder.LeakFinder(['lib'], ['bad'], '', '')
+    leaks = self._GetObjects(lf.FindLeaks(nodes))
+    leaks.sort(key=lambda leak: leak.node.node_id)
+    groups = lf.GroupLeaks(leaks)
+    self.assertEqual([[n6], []], [group.retainers for group in groups])
+    self.assertEqual([[3, 4], [5]],
+                     [[leak.node.node_id for leak in group.leaks]
+                      for group in groups])
+    self.assertEqual(1, len(groups[0].Representatives()))
+
+  def testGroupLeaksByPropertyNames(self):
+    """Tests that the values of distinct properties have own stack traces.
+
+    (n1 Window) - lib -> (n2) - [0..1] -> (n3 A), (n4 A)
+        |                                   ^       ^
+        `- bad -> (n5) - first, second -----'-------'
+    """
+    n1 = leak_finder.Node(1, 'object', 'Window')
+    n2 = leak_finder.Node(2, 'array', 'Array')
+    n5 = leak_finder.Node(5, 'object', 'Object')
+    self._CreatePropertyEdge(n1, n2, 'lib')
+    self._CreatePropertyEdge(n1, n5, 'bad')
+    nodes = [n1, n2, n5]
+    for i, name in enumerate(['first', 'second']):
+      node = leak_finder.Node(i + 3, 'object', 'A')
+      self._CreateElementEdge(n2, node, str(i))
+      self._CreatePropertyEdge(n5, node, name)
+      nodes.append(node)
+    lf = leak_finder.LeakFinder(['lib'], ['bad'], '', '')
+    leaks = self._GetObjects(lf.FindLeaks(nodes))
+    leaks.sort(key=lambda leak: leak.node.node_id)
+    [group] = lf.GroupLeaks(leaks)
+    self.assertEqual([n5], group.retainers)
+    self.assertEqual(2, len(group.Representatives()))
+    leaks[0].stack = 'stack of first'
+    leaks[1].stack = 'stack of second'
+    group.ShareStacks()
+    self.assertEqual(['stack of first', 'stack of second'],
+                     [leak.stack for leak in leaks])
+
+  def testLeakEstimate(self):
+    estimate = leak_finder.LeakEstimate('A', 1000, 100, 50)
+    self.assertEqual(500.0, estimate.estimate)
+    # The Wilson interval of 50/100 at 95% is about [0.404, 0.596].
+    self.assertAlmostEqual(404, estimate.low, places=0)
+    self.assertAlmostEqual(596, estimate.high, places=0)
+
+    # A fully sampled class is counted exactly.
+    estimate = leak_finder.LeakEstimate('A', 10, 10, 3)
+    self.assertEqual((3.0, 3.0, 3.0),
+                     (estimate.estimate, estimate.low, estimate.high))
+
+    estimate = leak_finder.LeakEstimate('A', 10, 0, 0)
+    self.assertEqual((None, 0.0, 10.0),
+                     (estimate.estimate, estimate.low, estimate.high))
+
   class MockSnapshotter(object):
     def __init__(self, data_to_return):
       self.called = False
-      self.data_to_return = {'raw_data': simplejson.dumps(data_to_return)}
+      self.data_to_return = {'raw_data': json.dumps(data_to_return)}
 
     def HeapSnapshot(self, include_summary):
       if not include_summary:
         self.called = True
       return self.data_to_return
 
-  def _HeapSnapshotData(self, node_types, edge_types, node_fields, edge_fields,
-                        node_list, edge_list, strings):
-    """Helper for creating heap snapshot data."""
-    return {'snapshot': {'meta': {'node_types': [node_types],
-                                  'edge_types': [edge_types],
-                                  'node_fields': node_fields,
-                                  'edge_fields': edge_fields}},
-            'nodes': node_list,
-            'edges': edge_list,
-            'strings': strings}
-
   def testSnapshotter(self):
     try:
       mock_client = LeakFinderTest.MockSnapshotter({})
@@ -250,8 +703,9 @@ class LeakFinderTest(unittest.TestCase):
                  0, 1, 1, 3]
     edge_list = [0, 2, 4]
     strings = ['node1', 'node2', 'edge1']
-    heap = self._HeapSnapshotData(node_types, edge_types, node_fields,
-                                  edge_fields, node_list, edge_list, strings)
+    heap = snapshot_testdata.HeapSnapshotData(
+        node_types, edge_types, node_fields, edge_fields, node_list, edge_list,
+        strings)
     mock_client = LeakFinderTest.MockSnapshotter(heap)
     nodes = list(leak_finder.Snapshotter().GetSnapshot(mock_client))
     self.assertEqual(2, len(nodes))
@@ -284,8 +738,9 @@ class LeakFinderTest(unittest.TestCase):
                  0, 1, 1, 0]
     edge_list = [0, 2, 4]
     strings = ['node1', 'node2', 'edge1']
-    heap = self._HeapSnapshotData(node_types, edge_types, node_fields,
-                                  edge_fields, node_list, edge_list, strings)
+    heap = snapshot_testdata.HeapSnapshotData(
+        node_types, edge_types, node_fields, edge_fields, node_list, edge_list,
+        strings)
     mock_client = LeakFinderTest.MockSnapshotter(heap)
     nodes = list(leak_finder.Snapshotter().GetSnapshot(mock_client))
     self.assertEqual(2, len(nodes))
@@ -308,6 +763,249 @@ class LeakFinderTest(unittest.TestCase):
     self.assertEqual('node2', nodes[to_ix].edges_to[0].to_node.class_name)
     self.assertEqual('edge1', nodes[to_ix].edges_to[0].name_string)
 
+  class FakeLeakDefinition(object):
+    def __init__(self, containers, bad_nodes, stacktrace_suffix=''):
+      self.containers = containers
+      self.bad_nodes = bad_nodes
+      self.stacktrace_prefix = ''
+      self.stacktrace_suffix = stacktrace_suffix
+
+  def _ContainerSnapshotData(self):
+    """Helper for creating heap snapshot data with a container.
+
+    (window) - lib -> (lib) - container -> (array) - [0] -> (leaked)
+        |                                     |
+        |                                     `- [1] -> (used) - stack -> ('s')
+        |                                                   ^
+        |- used ----------------------------------------------
+        |
+        `- other -> (unrelated) - text -> ('unrelated string')
+
+    Returns:
+      The heap snapshot data.
+    """
+    node_types = ['object', 'string', 'array']
+    edge_types = ['property', 'element']
+    node_fields = ['type', 'name', 'id', 'edge_count']
+    edge_fields = ['type', 'name_or_index', 'to_node']
+    strings = ['Window', 'Lib', 'Array', 'Leaked', 'Used', 'Unrelated', 's',
+               'unrelated string', 'lib', 'container', 'used', 'other', 'text',
+               'stack']
+    node_list = [0, 0, 1, 3,   # 0: window
+                 0, 1, 2, 1,   # 4: lib
+                 2, 2, 3, 2,   # 8: array
+                 0, 3, 4, 0,   # 12: leaked
+                 0, 4, 5, 1,   # 16: used
+                 1, 6, 6, 0,   # 20: 's'
+                 0, 5, 7, 1,   # 24: unrelated
+                 1, 7, 8, 0]   # 28: 'unrelated string'
+    edge_list = [0, 8, 4,      # window.lib
+                 0, 10, 16,    # window.used
+                 0, 11, 24,    # window.other
+                 0, 9, 8,      # lib.container
+                 1, 0, 12,     # array[0]
+                 1, 1, 16,     # array[1]
+                 0, 13, 20,    # used.stack
+                 0, 12, 28]    # unrelated.text
+    return snapshot_testdata.HeapSnapshotData(
+        node_types, edge_types, node_fields, edge_fields, node_list, edge_list,
+        strings)
+
+  def testParsePrunedSnapshot(self):
+    mock_client = LeakFinderTest.MockSnapshotter(
+        self._ContainerSnapshotData())
+    definition = LeakFinderTest.FakeLeakDefinition(['lib.container'], [],
+                                                   '.stack')
+    nodes = list(leak_finder.Snapshotter(definition).GetSnapshot(mock_client))
+    self.assertEqual(['(array)', '(string)', 'Leaked', 'Lib', 'Used', 'Window'],
+                     sorted(n.class_name for n in nodes))
+    window = [n for n in nodes if n.class_name == 'Window'][0]
+    self.assertEqual(['lib', 'used'],
+                     sorted(e.name_string for e in window.edges_from))
+
+  def testFindLeaksInPrunedSnapshot(self):
+    definition = LeakFinderTest.FakeLeakDefinition(['lib.container'], [])
+    for snapshotter in [leak_finder.Snapshotter(),
+                        leak_finder.Snapshotter(definition)]:
+      mock_client = LeakFinderTest.MockSnapshotter(
+          self._ContainerSnapshotData())
+      nodes = snapshotter.GetSnapshot(mock_client)
+      lf = leak_finder.LeakFinder(['lib.container'], [], '', '')
+      leaks = self._GetObjects(lf.FindLeaks(nodes))
+      self.assertEqual(['Leaked'], [leak.node.class_name for leak in leaks])
+
+  def testParseSelfSize(self):
+    node_types = ['object']
+    edge_types = ['property']
+    node_fields = ['type', 'name', 'id', 'self_size', 'edge_count']
+    edge_fields = ['type', 'name_or_index', 'to_node']
+    node_list = [0, 0, 0, 16, 1,
+                 0, 1, 1, 32, 0]
+    edge_list = [0, 2, 5]
+    strings = ['node1', 'node2', 'edge1']
+    heap = snapshot_testdata.HeapSnapshotData(
+        node_types, edge_types, node_fields, edge_fields, node_list, edge_list,
+        strings)
+    mock_client = LeakFinderTest.MockSnapshotter(heap)
+    nodes = leak_finder.Snapshotter().GetSnapshot(mock_client)
+    self.assertEqual([('node1', 16), ('node2', 32)],
+                     sorted((n.class_name, n.self_size) for n in nodes))
+
+  def testAllocationTraces(self):
+    node_types = ['object']
+    edge_types = ['property']
+    node_fields = ['type', 'name', 'id', 'edge_count', 'trace_node_id']
+    edge_fields = ['type', 'name_or_index', 'to_node']
+    node_list = [0, 0, 0, 0, 3,
+                 0, 1, 1, 0, 0]
+    strings = ['node1', 'node2', '(root)', 'outer', 'inner', '', 'app.js']
+    heap = snapshot_testdata.HeapSnapshotData(
+        node_types, edge_types, node_fields, edge_fields, node_list, [],
+        strings)
+    heap['snapshot']['meta']['trace_function_info_fields'] = [
+        'function_id', 'name', 'script_name', 'script_id', 'line', 'column']
+    heap['snapshot']['meta']['trace_node_fields'] = [
+        'id', 'function_info_index', 'count', 'size', 'children']
+    heap['trace_function_infos'] = [0, 2, 5, 0, 0, 0,
+                                    1, 3, 6, 1, 10, 2,
+                                    2, 4, 6, 1, 20, 4]
+    heap['trace_tree'] = [1, 0, 0, 0, [2, 1, 0, 0, [3, 2, 1, 16, []]]]
+    mock_client = LeakFinderTest.MockSnapshotter(heap)
+    snapshotter = leak_finder.Snapshotter()
+    nodes = dict((n.class_name, n)
+                 for n in snapshotter.GetSnapshot(mock_client))
+    self.assertEqual(3, nodes['node1'].trace_node_id)
+    self.assertEqual(0, nodes['node2'].trace_node_id)
+
+    traces = snapshotter.allocation_traces
+    self.assertEqual(['inner', 'outer'], traces.GetStack(3).frames)
+    self.assertEqual([], traces.GetStack(1).frames)
+    self.assertEqual(None, traces.GetStack(4))
+
+    leak = leak_finder.LeakNode(nodes['node1'], 'Leak', 'leak', '')
+    leak.RetrieveStackTrace(None, traces)
+    self.assertEqual(['inner', 'outer'], leak.stack.frames)
+
+  def testSaveAndReadCompressedSnapshots(self):
+    heap = self._ContainerSnapshotData()
+    raw_data = json.dumps(heap)
+    temp_dir = tempfile.mkdtemp()
+    try:
+      extensions = ['', '.gz', '.bz2']
+      if leak_finder.lzma:
+        extensions.append('.xz')
+      for extension in extensions:
+        filename = os.path.join(temp_dir, 'snapshot.heapsnapshot' + extension)
+        leak_finder.SaveSnapshotFile(raw_data, filename)
+        if extension:
+          with open(filename, 'rb') as f:
+            self.assertNotEqual(raw_data[:10], f.read(10))
+        nodes = leak_finder.Snapshotter().GetSnapshotFromFile(filename)
+        self.assertEqual(8, len(nodes))
+
+      filename = os.path.join(temp_dir, 'taken.heapsnapshot.gz')
+      mock_client = LeakFinderTest.MockSnapshotter(heap)
+      leak_finder.Snapshotter().GetSnapshot(mock_client, filename)
+      nodes = leak_finder.Snapshotter().GetSnapshotFromFile(filename)
+      self.assertEqual(8, len(nodes))
+    finally:
+      shutil.rmtree(temp_dir)
+
+  def _HistogramSnapshotData(self, leaked_count):
+    """Helper for creating heap snapshot data with self sizes.
+
+    Contains a Window object, leaked_count objects of class 'Le"aked' and a
+    string for each of them.
+
+    Returns:
+      The heap snapshot data.
+    """
+    node_list = [0, 0, 1, 100, 0]
+    for i in range(leaked_count):
+      node_list.extend([0, 1, 2 * i + 2, 20, 0])
+      node_list.extend([1, 2, 2 * i + 3, 8, 0])
+    return snapshot_testdata.HeapSnapshotData(
+        ['object', 'string'], ['property'],
+        ['type', 'name', 'id', 'self_size', 'edge_count'],
+        ['type', 'name_or_index', 'to_node'], node_list, [],
+        ['Window', 'Le"aked', 'text \u00e4'])
+
+  def testClassHistogram(self):
+    temp_dir = tempfile.mkdtemp()
+    original_chunk_size = leak_finder._STREAM_CHUNK_SIZE
+    try:
+      filename = os.path.join(temp_dir, 'snapshot.heapsnapshot.gz')
+      heap = self._HistogramSnapshotData(3)
+      leak_finder.SaveSnapshotFile(json.dumps(heap), filename)
+      for chunk_size in [7, original_chunk_size]:
+        leak_finder._STREAM_CHUNK_SIZE = chunk_size
+        histogram = leak_finder.Snapshotter().GetClassHistogramFromFile(
+            filename)
+        self.assertEqual([('Window', 1, 100), ('Le"aked', 3, 60),
+                          ('(string)', 3, 24)], histogram.Classes())
+      histogram = leak_finder.Snapshotter().GetClassHistogramFromHeap(heap)
+      self.assertEqual([('Window', 1, 100), ('Le"aked', 3, 60),
+                        ('(string)', 3, 24)], histogram.Classes())
+    finally:
+      leak_finder._STREAM_CHUNK_SIZE = original_chunk_size
+      shutil.rmtree(temp_dir)
+
+  def testClassHistogramDiff(self):
+    snapshotter = leak_finder.Snapshotter()
+    before = snapshotter.GetClassHistogramFromHeap(
+        self._HistogramSnapshotData(3))
+    after = snapshotter.GetClassHistogramFromHeap(
+        self._HistogramSnapshotData(5))
+    self.assertEqual([('Le"aked', 2, 40), ('(string)', 2, 16)],
+                     after.Diff(before))
+    self.assertEqual([('(string)', -2, -16), ('Le"aked', -2, -40)],
+                     before.Diff(after))
+
+  def testRetrieveStackTraceFromSnapshot(self):
+    n1 = leak_finder.Node(1, 'object', 'Object')
+    n2 = leak_finder.Node(2, 'string', '(string)')
+    n2.string = 'Error\n    at foo (a.js:1:1)'
+    self._CreatePropertyEdge(n1, n2, 'creationStack')
+    leak = leak_finder.LeakNode(n1, 'Leak', 'leak', '.creationStack')
+    leak.RetrieveStackTrace()
+    self.assertEqual(['foo'], leak.stack.frames)
+
+  def testLazyStringTable(self):
+    snapshotter = leak_finder.Snapshotter()
+    data = json.dumps({'nodes': [1], 'strings': ['plain', 'qu"ote', u'\xe4',
+                                                 'a\nb', '']})
+    heap = snapshotter._DecodeHeap(data.encode('utf-8'))
+    self.assertEqual([1], heap['nodes'])
+    strings = heap['strings']
+    self.assertTrue(isinstance(strings, leak_finder.LazyStringTable))
+    self.assertEqual(5, len(strings))
+    self.assertEqual('qu"ote', strings[1])
+    self.assertEqual(['plain', 'qu"ote', u'\xe4', 'a\nb', ''], list(strings))
+    self.assertEqual(set([2]), strings.IndicesOf(u'\xe4'))
+    self.assertEqual(set([1]), strings.IndicesOf('qu"ote'))
+    self.assertRaises(IndexError, strings.__getitem__, 5)
+
+  def testParseSnapshotWithLazyStrings(self):
+    temp_dir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(temp_dir, 'snapshot.heapsnapshot')
+      leak_finder.SaveSnapshotFile(json.dumps(self._ContainerSnapshotData()),
+                                   filename)
+      definition = LeakFinderTest.FakeLeakDefinition(['lib.container'], [],
+                                                     '.stack')
+      for snapshotter in [leak_finder.Snapshotter(),
+                          leak_finder.Snapshotter(definition)]:
+        nodes = snapshotter.GetSnapshotFromFile(filename)
+        strings = snapshotter._strings
+        self.assertTrue(isinstance(strings, leak_finder.LazyStringTable))
+        self.assertFalse(6 in strings._decoded)
+        [string_node] = [n for n in nodes if n.node_id == 6]
+        self.assertEqual('s', string_node.string)
+        self.assertTrue(6 in strings._decoded)
+        self.assertFalse(7 in strings._decoded)
+    finally:
+      shutil.rmtree(temp_dir)
+
   def testRetainingPathToString(self):
     n1 = leak_finder.Node(1, 'object', 'Object')
     n2 = leak_finder.Node(2, 'object', 'Object')
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""A local database of the leaks reported by earlier runs.
+
+The suppressions only know the leaks someone has looked at, so without a
+history every run reports the same unsuppressed leaks as new. LeakHistory
+records the leaks of each run into an SQLite database, keyed by a signature
+of the leaking class and the normalized allocation stack, and classifies the
+leaks of a run as new (never recorded), recurring (recorded by an earlier
+run) or fixed (recorded by the previous run, but not found any more).
+
+The database has three tables:
+
+  runs: one row per recorded run, with its id and time.
+  signatures: one row per distinct leak, with the class name, the stack, the
+      first and last time it was seen, the number of runs it was seen in, the
+      total number of leaking objects and the last run it was seen in.
+  occurrences: one row per leak and run, with the number of leaking objects.
+
+Classifying a run looks up its signatures in the unique index of the
+signatures table and the previous run in the primary key of the occurrences
+table, so it takes milliseconds regardless of how many runs are recorded.
+"""
+
+import hashlib
+import re
+import sqlite3
+import time
+
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL UNIQUE,
+    time REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS signatures (
+    id INTEGER PRIMARY KEY,
+    signature TEXT NOT NULL UNIQUE,
+    class_name TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    run_count INTEGER NOT NULL,
+    leak_count INTEGER NOT NULL,
+    last_run INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS occurrences (
+    run INTEGER NOT NULL,
+    signature INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run, signature)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS occurrences_by_signature
+    ON occurrences (signature);
+"""
+
+# The source positions of a frame, e.g., "a.js:10:5", which change whenever
+# unrelated code is edited.
+_POSITION_RE = re.compile(r':\d+(:\d+)?(?=\)?$)')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class Error(Exception):
+  pass
+
+
+def NormalizeFrame(frame):
+  """Returns a frame without whitespace differences and source positions.
+
+  Args:
+    frame: str, a stack frame.
+  Returns:
+    str, the normalized frame.
+  """
+  return _POSITION_RE.sub('', _WHITESPACE_RE.sub(' ', frame.strip()))
+
+
+def Signature(class_name, stack):
+  """Returns the signature identifying a leak across runs.
+
+  Args:
+    class_name: str, the class of the leaking objects.
+    stack: [str], the frames of the allocation stack.
+  Returns:
+    str, the hex SHA-1 of the class name and the normalized frames.
+  """
+  text = '\n'.join([class_name] + [NormalizeFrame(frame) for frame in stack])
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class KnownLeak(object):
+  """What the history knows about a leak.
+
+  Attributes:
+    class_name: str, the class of the leaking objects.
+    stack: [str], the normalized allocation stack.
+    first_seen: float, the time of the first run the leak was seen in.
+    last_seen: float, the time of the last run the leak was seen in.
+    run_count: int, the number of runs the leak was seen in.
+    leak_count: int, the total number of leaking objects in those runs.
+  """
+
+  def __init__(self, class_name, stack, first_seen, last_seen, run_count,
+               leak_count):
+    self.class_name = class_name
+    self.stack = stack
+    self.first_seen = first_seen
+    self.last_seen = last_seen
+    self.run_count = run_count
+    self.leak_count = leak_count
+
+
+class Classification(object):
+  """The leaks of a run, classified against the history.
+
+  Attributes:
+    known: {str -> KnownLeak}, maps the signatures of the recurring leaks to
+        what the history knows about them. The other signatures of the run
+        are new.
+    fixed: [KnownLeak], the leaks of the previous run which are not among the
+        leaks of this run, the most leaking objects first.
+    previous_run: str, the id of the previous run, or None if no run has been
+        recorded.
+  """
+
+  def __init__(self, known, fixed, previous_run):
+    self.known = known
+    self.fixed = fixed
+    self.previous_run = previous_run
+
+  def IsNew(self, signature):
+    return signature not in self.known
+
+
+class LeakHistory(object):
+  """An SQLite database of the leaks found by earlier runs."""
+
+  def __init__(self, filename, clock=time.time):
+    """Initializes the LeakHistory object.
+
+    Args:
+      filename: str, the database file; created if needed.
+      clock: function, returns the current time in seconds.
+    Raises:
+      Error: The file cannot be opened, or it is not a leak history.
+    """
+    self._clock = clock
+    try:
+      self._db = sqlite3.connect(filename)
+      version = self._db.execute('PRAGMA user_version').fetchone()[0]
+      if version not in (0, _SCHEMA_VERSION):
+        raise Error('Unsupported leak history version in %s: %d' %
+                    (filename, version))
+      with self._db:
+        self._db.executescript(_SCHEMA)
+        self._db.execute('PRAGMA user_version = %d' % _SCHEMA_VERSION)
+    except sqlite3.Error as e:
+      raise Error('Cannot open the leak history %s: %s' % (filename, e))
+
+  def Close(self):
+    self._db.close()
+
+  def _PreviousRun(self):
+    """Returns the row id and the id of the last recorded run, or None."""
+    return self._db.execute(
+        'SELECT id, run_id FROM runs ORDER BY id DESC LIMIT 1').fetchone()
+
+  def Classify(self, signatures):
+    """Classifies the leaks of a run against the recorded runs.
+
+    Args:
+      signatures: [str], the signatures of the leaks of the run, see
+          Signature.
+    Returns:
+      Classification, the recurring and the fixed leaks.
+    Raises:
+      Error: The database cannot be read.
+    """
+    signatures = set(signatures)
+    try:
+      known = {}
+      ordered = sorted(signatures)
+      # SQLite limits the number of parameters of a statement.
+      for start in range(0, len(ordered), 500):
+        batch = ordered[start:start + 500]
+        rows = self._db.execute(
+            'SELECT signature, class_name, stack, first_seen, last_seen, '
+            'run_count, leak_count FROM signatures WHERE signature IN (%s)' %
+            ', '.join('?' * len(batch)), batch)
+        for row in rows:
+          known[row[0]] = KnownLeak(row[1], row[2].split('\n'), *row[3:])
+
+      fixed = []
+      previous = self._PreviousRun()
+      if previous:
+        rows = self._db.execute(
+            'SELECT s.signature, s.class_name, s.stack, s.first_seen, '
+            's.last_seen, s.run_count, s.leak_count FROM occurrences o '
+            'JOIN signatures s ON s.id = o.signature WHERE o.run = ? '
+            'ORDER BY o.count DESC, s.signature', (previous[0],))
+        fixed = [KnownLeak(row[1], row[2].split('\n'), *row[3:])
+                 for row in rows if row[0] not in signatures]
+    except sqlite3.Error as e:
+      raise Error('Cannot read the leak history: %s' % e)
+    return Classification(known, fixed, previous and previous[1])
+
+  def Record(self, run_id, leaks):
+    """Records the leaks of a run.
+
+    Args:
+      run_id: str, identifies the run, e.g., the CI build number; must not
+          have been recorded before.
+      leaks: [(str, [str], int)], the class name, the allocation stack and
+          the number of leaking objects of each leak of the run.
+    Raises:
+      Error: The run has already been recorded, or the database cannot be
+          written.
+    """
+    now = self._clock()
+    counts = {}
+    for class_name, stack, count in leaks:
+      signature = Signature(class_name, stack)
+      if signature in counts:
+        counts[signature][2] += count
+      else:
+        counts[signature] = [class_name, stack, count]
+    try:
+      with self._db:
+        run = self._db.execute('INSERT INTO runs (run_id, time) VALUES (?, ?)',
+                               (run_id, now)).lastrowid
+        for signature in sorted(counts):
+          class_name, stack, count = counts[signature]
+          self._db.execute(
+              'INSERT INTO signatures (signature, class_name, stack, '
+              'first_seen, last_seen, run_count, leak_count, last_run) '
+              'VALUES (?, ?, ?, ?, ?, 1, ?, ?) '
+              'ON CONFLICT (signature) DO UPDATE SET '
+              'last_seen = excluded.last_seen, run_count = run_count + 1, '
+              'leak_count = leak_count + excluded.leak_count, '
+              'last_run = excluded.last_run',
+              (signature, class_name,
+               '\n'.join(NormalizeFrame(frame) for frame in stack), now, now,
+               count, run))
+          self._db.execute(
+              'INSERT INTO occurrences (run, signature, count) '
+              'SELECT ?, id, ? FROM signatures WHERE signature = ?',
+              (run, count, signature))
+    except sqlite3.IntegrityError:
+      raise Error('Run %s has already been recorded' % run_id)
+    except sqlite3.Error as e:
+      raise Error('Cannot record run %s: %s' % (run_id, e))
+
+  def RunIds(self, signature):
+    """Returns the ids of the runs a leak was seen in, the earliest first.
+
+    Args:
+      signature: str, the signature of the leak.
+    Returns:
+      [str], the run ids.
+    """
+    rows = self._db.execute(
+        'SELECT r.run_id FROM signatures s '
+        'JOIN occurrences o ON o.signature = s.id '
+        'JOIN runs r ON r.id = o.run WHERE s.signature = ? ORDER BY r.id',
+        (signature,))
+    return [row[0] for row in rows]
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests LeakHistory."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import leak_history
+
+
+class LeakHistoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+    self._filename = os.path.join(self._directory, 'history.db')
+    self._now = 100.0
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _Open(self):
+    return leak_history.LeakHistory(self._filename, clock=lambda: self._now)
+
+  def testSignature(self):
+    self.assertEqual(leak_history.Signature('A', ['f (a.js:1:2)', ' g ']),
+                     leak_history.Signature('A', ['f  (a.js:3:4)', 'g']))
+    self.assertNotEqual(leak_history.Signature('A', ['f']),
+                        leak_history.Signature('B', ['f']))
+    self.assertNotEqual(leak_history.Signature('A', ['f', 'g']),
+                        leak_history.Signature('A', ['g', 'f']))
+    self.assertEqual('f (a.js)', leak_history.NormalizeFrame('f (a.js:1:2)'))
+
+  def testClassify(self):
+    history = self._Open()
+    a = leak_history.Signature('A', ['f'])
+    b = leak_history.Signature('B', ['g'])
+    c = leak_history.Signature('C', ['h'])
+    classification = history.Classify([a, b])
+    self.assertTrue(classification.IsNew(a))
+    self.assertEqual([], classification.fixed)
+    self.assertEqual(None, classification.previous_run)
+    history.Record('1', [('A', ['f'], 2), ('B', ['g'], 1)])
+
+    self._now = 200.0
+    history.Record('2', [('A', ['f'], 3), ('A', ['f'], 1)])
+    history.Close()
+
+    # The history persists.
+    history = self._Open()
+    classification = history.Classify([a, c])
+    self.assertEqual('2', classification.previous_run)
+    self.assertTrue(classification.IsNew(c))
+    known = classification.known[a]
+    self.assertEqual(('A', ['f'], 100.0, 200.0, 2, 6),
+                     (known.class_name, known.stack, known.first_seen,
+                      known.last_seen, known.run_count, known.leak_count))
+    # B was not found by the previous run, so it is not fixed now.
+    self.assertEqual([], classification.fixed)
+
+    classification = history.Classify([c])
+    self.assertEqual(['A'], [known.class_name
+                             for known in classification.fixed])
+    self.assertEqual(['1', '2'], history.RunIds(a))
+    self.assertEqual(['1'], history.RunIds(b))
+    history.Close()
+
+  def testErrors(self):
+    history = self._Open()
+    history.Record('1', [])
+    self.assertRaises(leak_history.Error, history.Record, '1', [])
+    history.Close()
+
+    db = sqlite3.connect(self._filename)
+    db.execute('PRAGMA user_version = 99')
+    db.close()
+    self.assertRaises(leak_history.Error, self._Open)
+
+    with open(self._filename, 'w') as f:
+      f.write('not a database' * 10)
+    self.assertRaises(leak_history.Error, self._Open)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Progress reporting and cancellation of long analyses.
+
+The long loops of the analysis (decoding and parsing the snapshot, linking the
+graph, classifying the container elements, retrieving the stack traces) report
+their progress to a ProgressReporter. The reporter passes Progress records to
+a callback at most once per interval, and checks its CancellationToken on
+every update; when the token has been cancelled, the update raises Cancelled,
+which unwinds the analysis through its clean-up code.
+
+Example:
+
+  token = progress.CancellationToken()
+  reporter = progress.ProgressReporter(lambda p: logging.info('%s', p), token)
+  checker = jsleakcheck.JSLeakCheck(definition, progress_reporter=reporter)
+  # From another thread, e.g., a signal handler:
+  token.Cancel()
+"""
+
+import threading
+import time
+
+
+_DEFAULT_INTERVAL = 1.0
+
+
+class Cancelled(Exception):
+  """Raised when the analysis notices that it has been cancelled."""
+
+
+class CancellationToken(object):
+  """Tells an analysis to stop; can be cancelled from any thread."""
+
+  def __init__(self):
+    self._event = threading.Event()
+
+  def Cancel(self):
+    self._event.set()
+
+  def IsCancelled(self):
+    return self._event.is_set()
+
+  def Wait(self, timeout):
+    """Waits until the token is cancelled or the timeout passes.
+
+    Args:
+      timeout: float, the number of seconds to wait at most.
+    Returns:
+      bool, whether the token has been cancelled.
+    """
+    return self._event.wait(timeout)
+
+  def Check(self):
+    """Raises Cancelled if the token has been cancelled."""
+    if self._event.is_set():
+      raise Cancelled('The analysis was cancelled')
+
+
+class Progress(object):
+  """The progress of a phase of the analysis.
+
+  Attributes:
+    phase: str, the phase, e.g., 'parse'.
+    done: int, the number of units processed so far.
+    total: int, the total number of units, or None if unknown.
+    unit: str, what is counted, e.g., 'nodes' or 'bytes'.
+    elapsed: float, the seconds since the phase started.
+    rate: float, the units processed per second, or None if unknown.
+    eta: float, the estimated seconds until the phase is done, or None if
+        unknown.
+    finished: bool, whether the phase is done.
+  """
+
+  def __init__(self, phase, done, total, unit, elapsed, finished=False):
+    self.phase = phase
+    self.done = done
+    self.total = total
+    self.unit = unit
+    self.elapsed = elapsed
+    self.finished = finished
+    self.rate = None
+    self.eta = None
+    if elapsed > 0:
+      self.rate = done / elapsed
+    if self.rate and total is not None:
+      self.eta = max(0, total - done) / self.rate
+
+  def __str__(self):
+    if self.total is not None:
+      text = '%s: %d/%d %s' % (self.phase, self.done, self.total, self.unit)
+      if self.total:
+        text += ' (%d%%)' % (100 * self.done // self.total)
+    else:
+      text = '%s: %d %s' % (self.phase, self.done, self.unit)
+    if self.finished:
+      return '%s, done in %.1fs' % (text, self.elapsed)
+    if self.rate is not None:
+      text += ', %d %s/s' % (self.rate, self.unit)
+    if self.eta is not None:
+      text += ', ETA %.0fs' % self.eta
+    return text
+
+
+class ProgressReporter(object):
+  """Passes the progress of the analysis phases to a callback.
+
+  A reporter without a callback and a token does nothing, so the loops can
+  report unconditionally.
+
+  Attributes:
+    _callback: function(Progress), called with the progress, or None.
+    _token: CancellationToken, checked on every update, or None.
+    _interval: float, the minimum number of seconds between the callbacks
+        within a phase.
+    _clock: function, returns the current time in seconds.
+    _phase: str, the current phase.
+    _total: int, the total number of units of the current phase, or None.
+    _unit: str, what the current phase counts.
+    _done: int, the units of the current phase processed so far.
+    _start_time: float, when the current phase started.
+    _last_report: float, when the callback was last called.
+  """
+
+  def __init__(self, callback=None, token=None, interval=_DEFAULT_INTERVAL,
+               clock=time.time):
+    """Initializes the ProgressReporter object.
+
+    Args:
+      callback: function(Progress), called with the progress at most once per
+          interval, and when a phase finishes.
+      token: CancellationToken, if given, the analysis is stopped by raising
+          Cancelled from the first update after it has been cancelled.
+      interval: float, the minimum number of seconds between the callbacks
+          within a phase.
+      clock: function, returns the current time in seconds.
+    """
+    self._callback = callback
+    self._token = token
+    self._interval = interval
+    self._clock = clock
+    self._phase = None
+    self._total = None
+    self._unit = None
+    self._done = 0
+    self._start_time = 0
+    self._last_report = 0
+
+  def Start(self, phase, total=None, unit='items'):
+    """Starts a phase.
+
+    Args:
+      phase: str, the phase, e.g., 'parse'.
+      total: int, the total number of units, or None if unknown.
+      unit: str, what is counted, e.g., 'nodes'.
+    Raises:
+      Cancelled: The token has been cancelled.
+    """
+    if self._token:
+      self._token.Check()
+    self._phase = phase
+    self._total = total
+    self._unit = unit
+    self._done = 0
+    self._start_time = self._last_report = self._clock()
+
+  def Check(self):
+    """Raises Cancelled if the token has been cancelled.
+
+    For checking within a long step of a phase, between the updates.
+    """
+    if self._token:
+      self._token.Check()
+
+  def Update(self, done):
+    """Records the progress of the current phase.
+
+    Args:
+      done: int, the number of units processed so far.
+    Raises:
+      Cancelled: The token has been cancelled.
+    """
+    if self._token:
+      self._token.Check()
+    self._done = done
+    if not self._callback:
+      return
+    now = self._clock()
+    if now - self._last_report >= self._interval:
+      self._last_report = now
+      self._callback(Progress(self._phase, done, self._total, self._unit,
+                              now - self._start_time))
+
+  def Finish(self, done=None):
+    """Finishes the current phase.
+
+    Args:
+      done: int, the number of units processed if the phase stopped early;
+          by default, the total if known, otherwise the last update.
+    Raises:
+      Cancelled: The token has been cancelled.
+    """
+    if self._token:
+      self._token.Check()
+    if done is None:
+      done = self._done
+      if self._total is not None:
+        done = self._total
+    self._done = done
+    if self._callback:
+      self._callback(Progress(self._phase, done, self._total, self._unit,
+                              self._clock() - self._start_time,
+                              finished=True))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests the progress reporting and cancellation."""
+
+import json
+import unittest
+
+import leak_finder
+import progress
+import snapshot_testdata
+
+
+class FakeClock(object):
+  """A clock which only advances when told to."""
+
+  def __init__(self):
+    self.now = 100.0
+
+  def __call__(self):
+    return self.now
+
+
+class ProgressTest(unittest.TestCase):
+
+  def testReporterThrottlesAndEstimates(self):
+    clock = FakeClock()
+    reports = []
+    reporter = progress.ProgressReporter(reports.append, interval=1.0,
+                                         clock=clock)
+    reporter.Start('parse', 1000, 'nodes')
+    reporter.Update(100)
+    self.assertEqual([], reports)
+    clock.now += 2
+    reporter.Update(250)
+    self.assertEqual(1, len(reports))
+    self.assertEqual(('parse', 250, 1000), (reports[0].phase, reports[0].done,
+                                            reports[0].total))
+    self.assertEqual(125, reports[0].rate)
+    self.assertEqual(6, reports[0].eta)
+    self.assertEqual('parse: 250/1000 nodes (25%), 125 nodes/s, ETA 6s',
+                     str(reports[0]))
+    clock.now += 0.5
+    reporter.Update(300)
+    self.assertEqual(1, len(reports))
+    reporter.Finish()
+    self.assertEqual('parse: 1000/1000 nodes (100%), done in 2.5s',
+                     str(reports[1]))
+
+    reporter.Start('dominators')
+    clock.now += 3
+    reporter.Finish()
+    self.assertEqual('dominators: 0 items, done in 3.0s', str(reports[2]))
+
+  def testCancellation(self):
+    token = progress.CancellationToken()
+    reporter = progress.ProgressReporter(token=token)
+    reporter.Start('parse', 10)
+    reporter.Update(1)
+    self.assertFalse(token.IsCancelled())
+    token.Cancel()
+    self.assertTrue(token.IsCancelled())
+    self.assertRaises(progress.Cancelled, reporter.Update, 2)
+    self.assertRaises(progress.Cancelled, reporter.Finish)
+
+  def testAnalysisReportsPhases(self):
+    reports = []
+    reporter = progress.ProgressReporter(reports.append, interval=0)
+    snapshotter = leak_finder.Snapshotter(progress_reporter=reporter)
+    data = json.dumps(snapshot_testdata.LeakSnapshotData(stack=False))
+    data = data.encode('utf-8')
+    nodes = snapshotter.GetSnapshotFromHeap(snapshotter._DecodeHeap(data))
+    finder = leak_finder.LeakFinder(['lib.container'], [], '', '',
+                                    progress_reporter=reporter)
+    self.assertEqual(1, len(list(finder.FindLeaks(nodes))))
+
+    finished = [(report.phase, report.done, report.total, report.unit)
+                for report in reports if report.finished]
+    self.assertEqual([('decode', len(data), len(data), 'bytes'),
+                      ('parse', 4, 4, 'nodes'), ('link', 4, 4, 'nodes'),
+                      ('classify', 1, 1, 'elements')], finished)
+
+  def testCancelledParsing(self):
+    token = progress.CancellationToken()
+
+    def CancelAfterDecoding(report):
+      if report.phase == 'decode' and report.finished:
+        token.Cancel()
+
+    reporter = progress.ProgressReporter(CancelAfterDecoding, token)
+    snapshotter = leak_finder.Snapshotter(progress_reporter=reporter)
+    data = json.dumps(snapshot_testdata.LeakSnapshotData(stack=False))
+    data = data.encode('utf-8')
+    heap = snapshotter._DecodeHeap(data)
+    self.assertRaises(progress.Cancelled, snapshotter.GetSnapshotFromHeap,
+                      heap)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Cache of leak analysis reports.
+
+Analyzing the same saved heap snapshot with the same leak definition and
+suppressions always gives the same report, so the report can be stored and
+replayed. The reports are keyed by a fingerprint of everything the analysis
+depends on: the content of the snapshot file, the leak definition, the content
+of the suppressions file and the analysis options.
+
+The cache is a directory with one JSON file per report. The modification time
+of a file is the time it was last used; the least recently used reports are
+evicted when the cache grows too large, and reports unused for too long are
+evicted regardless of the size.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+# Changes whenever the report format or the analysis changes, so that reports
+# of older versions are not replayed.
+_CACHE_VERSION = 3
+
+_READ_CHUNK_SIZE = 1 << 20
+
+_REPORT_SUFFIX = '.json'
+
+
+def FileFingerprint(filename):
+  """Returns a hash of the content of a file.
+
+  Args:
+    filename: str, the file.
+  Returns:
+    str, the hex SHA-1 of the content.
+  Raises:
+    IOError: The file cannot be read.
+  """
+  sha1 = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    while True:
+      chunk = f.read(_READ_CHUNK_SIZE)
+      if not chunk:
+        break
+      sha1.update(chunk)
+  return sha1.hexdigest()
+
+
+def Fingerprint(snapshot_fingerprint, definition, suppressions_fingerprint,
+                options):
+  """Combines everything an analysis depends on into a cache key.
+
+  Args:
+    snapshot_fingerprint: str, the fingerprint of the heap snapshot.
+    definition: {}, the fields of the leak definition, JSON serializable.
+    suppressions_fingerprint: str, the fingerprint of the suppressions, or
+        None if there are none.
+    options: {}, the analysis options which affect the report, JSON
+        serializable.
+  Returns:
+    str, the cache key.
+  """
+  key = json.dumps([_CACHE_VERSION, snapshot_fingerprint, definition,
+                    suppressions_fingerprint, options], sort_keys=True)
+  return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+  """A directory of cached analysis reports.
+
+  Attributes:
+    _directory: str, the cache directory.
+    _max_age: float, the number of seconds after which an unused report is
+        evicted, or None for no limit.
+    _max_size: int, the maximum total size of the reports in bytes, or None
+        for no limit.
+  """
+
+  def __init__(self, directory, max_age=None, max_size=None):
+    """Initializes the ResultCache object.
+
+    Args:
+      directory: str, the cache directory. It is created if needed.
+      max_age: float, the number of seconds after which an unused report is
+          evicted, or None for no limit.
+      max_size: int, the maximum total size of the reports in bytes, or None
+          for no limit.
+    """
+    self._directory = directory
+    self._max_age = max_age
+    self._max_size = max_size
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def _ReportPath(self, key):
+    return os.path.join(self._directory, key + _REPORT_SUFFIX)
+
+  def Get(self, key):
+    """Returns a cached report.
+
+    Args:
+      key: str, the cache key, see Fingerprint.
+    Returns:
+      {}, the report, or None if it is not cached.
+    """
+    path = self._ReportPath(key)
+    try:
+      with open(path) as f:
+        report = json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+    if self._max_age is not None and (
+        os.path.getmtime(path) < time.time() - self._max_age):
+      self._Remove(path)
+      return None
+    # Record the use for the eviction.
+    os.utime(path, None)
+    return report
+
+  def Put(self, key, report):
+    """Stores a report and evicts old reports if needed.
+
+    Args:
+      key: str, the cache key, see Fingerprint.
+      report: {}, the report, JSON serializable.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump(report, f)
+      os.rename(temp_path, self._ReportPath(key))
+    except BaseException:
+      os.remove(temp_path)
+      raise
+    self.Evict()
+
+  def _Remove(self, path):
+    try:
+      os.remove(path)
+    except OSError:
+      # Removed by another process.
+      pass
+
+  def Evict(self):
+    """Evicts reports from the cache.
+
+    First the reports unused for longer than the maximum age are removed, then
+    the least recently used reports until the total size is within the limit.
+    """
+    reports = []
+    for name in os.listdir(self._directory):
+      if not name.endswith(_REPORT_SUFFIX):
+        continue
+      path = os.path.join(self._directory, name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      reports.append((stat.st_mtime, stat.st_size, path))
+    reports.sort()
+
+    deadline = None
+    if self._max_age is not None:
+      deadline = time.time() - self._max_age
+    total_size = sum(size for _, size, _ in reports)
+    for mtime, size, path in reports:
+      too_old = deadline is not None and mtime < deadline
+      too_large = self._max_size is not None and total_size > self._max_size
+      if not too_old and not too_large:
+        break
+      self._Remove(path)
+      total_size -= size
+
+  def Size(self):
+    """Returns the total size of the cached reports in bytes."""
+    return sum(os.path.getsize(os.path.join(self._directory, name))
+               for name in os.listdir(self._directory)
+               if name.endswith(_REPORT_SUFFIX))
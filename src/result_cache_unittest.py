@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests ResultCache."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import result_cache
+
+
+class ResultCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _SetAge(self, key, age):
+    """Makes a cached report look unused for age seconds."""
+    path = os.path.join(self._directory, key + '.json')
+    used = time.time() - age
+    os.utime(path, (used, used))
+
+  def testFingerprint(self):
+    filename = os.path.join(self._directory, 'snapshot')
+    with open(filename, 'w') as f:
+      f.write('{}')
+    snapshot = result_cache.FileFingerprint(filename)
+    key = result_cache.Fingerprint(snapshot, {'containers': ['a']}, None, {})
+    self.assertEqual(key, result_cache.Fingerprint(
+        snapshot, {'containers': ['a']}, None, {}))
+    self.assertNotEqual(key, result_cache.Fingerprint(
+        snapshot, {'containers': ['b']}, None, {}))
+    self.assertNotEqual(key, result_cache.Fingerprint(
+        snapshot, {'containers': ['a']}, 'suppressions', {}))
+    self.assertNotEqual(key, result_cache.Fingerprint(
+        snapshot, {'containers': ['a']}, None, {'max_leaks': 1}))
+
+  def testGetAndPut(self):
+    cache = result_cache.ResultCache(self._directory)
+    self.assertEqual(None, cache.Get('key'))
+    cache.Put('key', {'new_leaks': [1]})
+    self.assertEqual({'new_leaks': [1]}, cache.Get('key'))
+
+  def testEvictBySize(self):
+    cache = result_cache.ResultCache(self._directory, max_size=120)
+    cache.Put('first', {'data': 'x' * 40})
+    cache.Put('second', {'data': 'x' * 40})
+    self._SetAge('first', 20)
+    self._SetAge('second', 10)
+    # Using the first report makes the second one the least recently used.
+    self.assertTrue(cache.Get('first'))
+    cache.Put('third', {'data': 'x' * 40})
+    self.assertEqual(None, cache.Get('second'))
+    self.assertTrue(cache.Get('first'))
+    self.assertTrue(cache.Get('third'))
+    self.assertTrue(cache.Size() <= 120)
+
+  def testEvictByAge(self):
+    cache = result_cache.ResultCache(self._directory, max_age=60)
+    cache.Put('old', {})
+    cache.Put('new', {})
+    self._SetAge('old', 120)
+    cache.Evict()
+    self.assertEqual(None, cache.Get('old'))
+    self.assertEqual({}, cache.Get('new'))
+
+
+if __name__ == '__main__':
+  unittest.main()
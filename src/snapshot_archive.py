@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Content-addressed archive of heap snapshots.
+
+Consecutive heap snapshots of the same application share most of their string
+tables and large parts of their node and edge data. The archive splits each
+snapshot into chunks and stores every distinct chunk only once:
+
+- The string table is split at content-defined boundaries: a chunk ends after a
+  string whose hash has certain bits set. Inserting or removing strings only
+  changes the chunks around the change.
+- The node and edge arrays are split into columns (one per field) and into
+  ranges of nodes (with their edges) at boundaries defined by the node ids,
+  which V8 keeps stable for the same object between snapshots. The edge
+  targets are stored as node ids instead of node indices for the same reason.
+  Each column chunk is delta-encoded, which makes e.g. the id column very
+  compressible.
+
+The layout of the archive directory is:
+
+  objects/<hh>/<hash>  the chunks, zlib compressed, named by their SHA-1
+  snapshots/<name>     the manifests listing the chunks of each snapshot
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+
+import json_backends
+import leak_finder
+
+
+# The bits of a string hash which must be zero for a string chunk to end.
+_STRING_CHUNK_MASK = 0xff
+_MIN_STRING_CHUNK = 16
+_MAX_STRING_CHUNK = 4096
+
+# The bits of a node id hash which must be zero for a node chunk to end.
+_NODE_CHUNK_MASK = 0xfff
+_MIN_NODE_CHUNK = 256
+_MAX_NODE_CHUNK = 65536
+
+_ARCHIVE_VERSION = 1
+
+
+class Error(Exception):
+  """Base class for exceptions thrown by this module."""
+
+
+def _DeltaEncode(values):
+  """Returns the differences between consecutive values."""
+  previous = 0
+  deltas = []
+  for value in values:
+    deltas.append(value - previous)
+    previous = value
+  return deltas
+
+
+def _DeltaDecode(deltas):
+  """Inverse of _DeltaEncode."""
+  value = 0
+  values = []
+  for delta in deltas:
+    value += delta
+    values.append(value)
+  return values
+
+
+def _ChunkBoundaries(keys, mask, min_length, max_length):
+  """Splits a sequence into chunks at content-defined boundaries.
+
+  Args:
+    keys: [int], a hash for each item of the sequence.
+    mask: int, a chunk ends after an item whose hash & mask is zero.
+    min_length: int, the minimum number of items in a chunk.
+    max_length: int, the maximum number of items in a chunk.
+  Returns:
+    [int], the end indices (exclusive) of the chunks.
+  """
+  boundaries = []
+  start = 0
+  for ix, key in enumerate(keys):
+    length = ix + 1 - start
+    if length >= max_length or (length >= min_length and not key & mask):
+      boundaries.append(ix + 1)
+      start = ix + 1
+  if start < len(keys) or not boundaries:
+    boundaries.append(len(keys))
+  return boundaries
+
+
+def _IdHash(node_id):
+  """Scrambles a node id, since V8 node ids are not evenly distributed."""
+  return (node_id * 2654435761) >> 16
+
+
+class SnapshotArchive(object):
+  """A directory storing heap snapshots as content-addressed chunks."""
+
+  def __init__(self, directory):
+    """Initializes the SnapshotArchive object.
+
+    Args:
+      directory: str, the archive directory. It is created if needed.
+    """
+    self._directory = directory
+    self._objects_dir = os.path.join(directory, 'objects')
+    self._snapshots_dir = os.path.join(directory, 'snapshots')
+    for d in (self._objects_dir, self._snapshots_dir):
+      if not os.path.isdir(d):
+        os.makedirs(d)
+
+  def _ManifestPath(self, name):
+    """Returns the path of the manifest of a snapshot.
+
+    Raises:
+      Error: The name cannot be used as a file name.
+    """
+    if not name or os.sep in name or name.startswith('.'):
+      raise Error('Invalid snapshot name: %r' % name)
+    return os.path.join(self._snapshots_dir, name)
+
+  def _ObjectPath(self, object_hash):
+    return os.path.join(self._objects_dir, object_hash[:2], object_hash)
+
+  def _WriteAtomically(self, path, data):
+    """Writes a file so that readers never see a partially written file."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+      os.rename(temp_path, path)
+    except BaseException:
+      os.remove(temp_path)
+      raise
+
+  def _PutObject(self, value):
+    """Stores a JSON-serializable value as a chunk, unless already stored.
+
+    Returns:
+      str, the hash of the chunk.
+    """
+    data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    object_hash = hashlib.sha1(data).hexdigest()
+    path = self._ObjectPath(object_hash)
+    if not os.path.exists(path):
+      self._WriteAtomically(path, zlib.compress(data))
+    return object_hash
+
+  def _GetObject(self, object_hash):
+    """Reads a chunk stored by _PutObject.
+
+    Raises:
+      Error: The chunk is missing or corrupt.
+    """
+    try:
+      with open(self._ObjectPath(object_hash), 'rb') as f:
+        data = f.read()
+    except IOError:
+      raise Error('Missing chunk %s in the archive' % object_hash)
+    try:
+      return json.loads(zlib.decompress(data).decode('utf-8'))
+    except (zlib.error, ValueError):
+      raise Error('Corrupt chunk %s in the archive' % object_hash)
+
+  def _PutColumns(self, data, field_count, boundaries):
+    """Stores the columns of a node or edge array as delta-encoded chunks.
+
+    Args:
+      data: [int], the array; field_count values per item.
+      field_count: int, number of fields per item.
+      boundaries: [int], the end indices (in items) of the chunks.
+    Returns:
+      [[str]], the chunk hashes of each column.
+    """
+    columns = []
+    for field in range(field_count):
+      column = data[field::field_count]
+      hashes = []
+      start = 0
+      for end in boundaries:
+        hashes.append(self._PutObject(_DeltaEncode(column[start:end])))
+        start = end
+      columns.append(hashes)
+    return columns
+
+  def _GetColumns(self, columns, item_count):
+    """Inverse of _PutColumns."""
+    field_count = len(columns)
+    data = [0] * (item_count * field_count)
+    for field, hashes in enumerate(columns):
+      column = []
+      for object_hash in hashes:
+        column.extend(_DeltaDecode(self._GetObject(object_hash)))
+      data[field::field_count] = column
+    return data
+
+  def Add(self, name, heap):
+    """Adds a decoded heap snapshot into the archive.
+
+    Args:
+      name: str, the name of the snapshot; an existing snapshot with the same
+          name is replaced.
+      heap: {}, the decoded heap snapshot JSON.
+    Raises:
+      KeyError: The snapshot doesn't contain the required data fields.
+      Error: The snapshot format is not supported.
+    """
+    meta = heap['snapshot']['meta']
+    node_fields = meta['node_fields']
+    edge_fields = meta['edge_fields']
+    node_field_count = len(node_fields)
+    edge_field_count = len(edge_fields)
+    nodes = heap['nodes']
+    edges = heap['edges']
+    strings = heap['strings']
+    node_count = len(nodes) // node_field_count
+    if 'id' not in node_fields or 'to_node' not in edge_fields:
+      raise Error('Unsupported snapshot format')
+    id_ix = node_fields.index('id')
+    to_node_ix = edge_fields.index('to_node')
+    node_ids = nodes[id_ix::node_field_count]
+
+    # Chunk the nodes at boundaries defined by their ids, and the edges at the
+    # boundaries of the nodes they belong to.
+    node_boundaries = _ChunkBoundaries([_IdHash(i) for i in node_ids],
+                                       _NODE_CHUNK_MASK, _MIN_NODE_CHUNK,
+                                       _MAX_NODE_CHUNK)
+    if 'edge_count' in node_fields:
+      edge_counts = nodes[node_fields.index('edge_count')::node_field_count]
+      edge_starts = [0]
+      for edge_count in edge_counts:
+        edge_starts.append(edge_starts[-1] + edge_count * edge_field_count)
+    else:
+      edge_starts = list(
+          nodes[node_fields.index('edges_index')::node_field_count])
+      edge_starts.append(len(edges))
+    edge_boundaries = [edge_starts[end] // edge_field_count
+                       for end in node_boundaries]
+
+    # Store the edge targets as node ids, if they are unambiguous.
+    to_node_ids = len(set(node_ids)) == node_count
+    if to_node_ids:
+      edges = list(edges)
+      for ix in range(to_node_ix, len(edges), edge_field_count):
+        edges[ix] = node_ids[edges[ix] // node_field_count]
+
+    string_boundaries = _ChunkBoundaries(
+        [zlib.crc32(s.encode('utf-8')) for s in strings], _STRING_CHUNK_MASK,
+        _MIN_STRING_CHUNK, _MAX_STRING_CHUNK)
+    string_chunks = []
+    start = 0
+    for end in string_boundaries:
+      string_chunks.append(self._PutObject(strings[start:end]))
+      start = end
+
+    manifest = {
+        'version': _ARCHIVE_VERSION,
+        'node_count': node_count,
+        'edge_count': len(edges) // edge_field_count,
+        'string_count': len(strings),
+        'to_node_ids': to_node_ids,
+        'nodes': self._PutColumns(nodes, node_field_count, node_boundaries),
+        'edges': self._PutColumns(edges, edge_field_count, edge_boundaries),
+        'strings': string_chunks,
+        'other': {},
+    }
+    for key, value in heap.items():
+      if key not in ('nodes', 'edges', 'strings'):
+        manifest['other'][key] = self._PutObject(value)
+
+    self._WriteAtomically(self._ManifestPath(name),
+                         json.dumps(manifest).encode('utf-8'))
+
+  def AddFile(self, name, filename):
+    """Adds a heap snapshot file into the archive.
+
+    Args:
+      name: str, the name of the snapshot.
+      filename: str, the heap snapshot file, possibly compressed.
+    Raises:
+      IOError: The file cannot be read.
+      KeyError: The snapshot doesn't contain the required data fields.
+      Error: The snapshot format is not supported.
+    """
+    f = leak_finder.OpenSnapshotFile(filename)
+    try:
+      heap = json_backends.GetBackend().Load(f)
+    finally:
+      f.close()
+    self.Add(name, heap)
+
+  def Names(self):
+    """Returns the names of the archived snapshots, sorted."""
+    return sorted(os.listdir(self._snapshots_dir))
+
+  def _ReadManifest(self, name):
+    """Reads the manifest of a snapshot.
+
+    Raises:
+      Error: The snapshot is not in the archive, has a corrupt manifest or
+          has an unknown version.
+    """
+    try:
+      with open(self._ManifestPath(name)) as f:
+        manifest = json.load(f)
+    except IOError:
+      raise Error('Snapshot %s is not in the archive' % name)
+    except ValueError:
+      raise Error('Snapshot %s has a corrupt manifest' % name)
+    if manifest.get('version') != _ARCHIVE_VERSION:
+      raise Error('Snapshot %s has an unsupported archive version' % name)
+    return manifest
+
+  def GetHeap(self, name):
+    """Reconstructs an archived heap snapshot.
+
+    Args:
+      name: str, the name of the snapshot.
+    Returns:
+      {}, the decoded heap snapshot JSON, equal to the one added.
+    Raises:
+      Error: The snapshot is not in the archive or the archive is corrupt.
+    """
+    manifest = self._ReadManifest(name)
+    heap = {}
+    for key, object_hash in manifest['other'].items():
+      heap[key] = self._GetObject(object_hash)
+    meta = heap['snapshot']['meta']
+    node_field_count = len(meta['node_fields'])
+    edge_field_count = len(meta['edge_fields'])
+
+    nodes = self._GetColumns(manifest['nodes'], manifest['node_count'])
+    edges = self._GetColumns(manifest['edges'], manifest['edge_count'])
+    if manifest['to_node_ids']:
+      id_ix = meta['node_fields'].index('id')
+      to_node_ix = meta['edge_fields'].index('to_node')
+      node_ixs = dict((node_id, ix * node_field_count) for ix, node_id in
+                      enumerate(nodes[id_ix::node_field_count]))
+      for ix in range(to_node_ix, len(edges), edge_field_count):
+        edges[ix] = node_ixs[edges[ix]]
+
+    strings = []
+    for object_hash in manifest['strings']:
+      strings.extend(self._GetObject(object_hash))
+
+    heap['nodes'] = nodes
+    heap['edges'] = edges
+    heap['strings'] = strings
+    return heap
+
+  def GetSnapshot(self, name, snapshotter=None):
+    """Loads an archived heap snapshot for analysis.
+
+    Args:
+      name: str, the name of the snapshot.
+      snapshotter: leak_finder.Snapshotter, used for parsing the snapshot. If
+          None, a new one is created.
+    Returns:
+      set(Node), the Node objects in the snapshot.
+    Raises:
+      Error: The snapshot is not in the archive or the archive is corrupt.
+      leak_finder.Error: The snapshot cannot be parsed.
+    """
+    snapshotter = snapshotter or leak_finder.Snapshotter()
+    return snapshotter.GetSnapshotFromHeap(self.GetHeap(name))
+
+  def Remove(self, name):
+    """Removes a snapshot and the chunks no other snapshot refers to.
+
+    Args:
+      name: str, the name of the snapshot.
+    Raises:
+      Error: The snapshot is not in the archive, or the manifest of another
+          snapshot cannot be read. The archive is then left unchanged.
+    """
+    self._ReadManifest(name)
+
+    # All the other manifests are read before removing anything, so that an
+    # unreadable one doesn't leave the removal half done.
+    referenced = set()
+    for other_name in self.Names():
+      if other_name == name:
+        continue
+      manifest = self._ReadManifest(other_name)
+      for hashes in manifest['nodes'] + manifest['edges']:
+        referenced.update(hashes)
+      referenced.update(manifest['strings'])
+      referenced.update(manifest['other'].values())
+
+    os.remove(self._ManifestPath(name))
+    for directory, _, filenames in os.walk(self._objects_dir):
+      for filename in filenames:
+        if filename not in referenced:
+          os.remove(os.path.join(directory, filename))
+
+  def DiskUsage(self):
+    """Returns the number of bytes the archive files take."""
+    size = 0
+    for directory, _, filenames in os.walk(self._directory):
+      for filename in filenames:
+        size += os.path.getsize(os.path.join(directory, filename))
+    return size
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests SnapshotArchive."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import snapshot_archive
+
+
+class SnapshotArchiveTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+    self._archive = snapshot_archive.SnapshotArchive(self._directory)
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _HeapSnapshotData(self, node_count, first_id=1):
+    """Helper for creating heap snapshot data.
+
+    Creates a chain of objects, each with a property pointing to the next one
+    and a property pointing to a string.
+
+    Args:
+      node_count: int, the number of objects.
+      first_id: int, the id of the first object.
+    Returns:
+      The heap snapshot data.
+    """
+    nodes = []
+    edges = []
+    strings = ['Object', 'next', 'text']
+    for i in range(node_count):
+      edge_count = 2 if i + 1 < node_count else 1
+      nodes.extend([0, 0, first_id + 2 * i, 16, edge_count])
+      strings.append('string %d' % (first_id + 2 * i))
+      nodes.extend([1, len(strings) - 1, first_id + 2 * i + 1, 32, 0])
+      edges.extend([0, 2, (2 * i + 1) * 5])
+      if edge_count == 2:
+        edges.extend([0, 1, (2 * i + 2) * 5])
+    return {'snapshot': {'meta': {'node_types': [['object', 'string']],
+                                  'edge_types': [['property']],
+                                  'node_fields': ['type', 'name', 'id',
+                                                  'self_size', 'edge_count'],
+                                  'edge_fields': ['type', 'name_or_index',
+                                                  'to_node']},
+                         'node_count': 2 * node_count,
+                         'edge_count': len(edges) // 3},
+            'nodes': nodes,
+            'edges': edges,
+            'strings': strings}
+
+  def testRoundTrip(self):
+    heap = self._HeapSnapshotData(1000)
+    self._archive.Add('first', heap)
+    self.assertEqual(['first'], self._archive.Names())
+    self.assertEqual(heap, self._archive.GetHeap('first'))
+
+    nodes = self._archive.GetSnapshot('first')
+    self.assertEqual(2000, len(nodes))
+
+  def testDeduplication(self):
+    heap = self._HeapSnapshotData(5000)
+    self._archive.Add('first', heap)
+    size = self._archive.DiskUsage()
+
+    # A snapshot which has a few objects more.
+    heap = self._HeapSnapshotData(5050)
+    self._archive.Add('second', heap)
+    self.assertTrue(self._archive.DiskUsage() - size < size / 2)
+    self.assertEqual(heap, self._archive.GetHeap('second'))
+
+    self._archive.Remove('second')
+    self.assertEqual(['first'], self._archive.Names())
+    self.assertEqual(size, self._archive.DiskUsage())
+    self.assertEqual(self._HeapSnapshotData(5000),
+                     self._archive.GetHeap('first'))
+
+  def testAddFile(self):
+    heap = self._HeapSnapshotData(10)
+    filename = os.path.join(self._directory, 'snapshot.heapsnapshot')
+    with open(filename, 'w') as f:
+      json.dump(heap, f)
+    self._archive.AddFile('file', filename)
+    self.assertEqual(heap, self._archive.GetHeap('file'))
+
+  def testErrors(self):
+    self.assertRaises(snapshot_archive.Error, self._archive.GetHeap, 'missing')
+    self.assertRaises(snapshot_archive.Error, self._archive.Add, '../x',
+                      self._HeapSnapshotData(1))
+
+  def testCorruptChunk(self):
+    self._archive.Add('first', self._HeapSnapshotData(10))
+    for directory, _, filenames in os.walk(
+        os.path.join(self._directory, 'objects')):
+      for filename in filenames:
+        with open(os.path.join(directory, filename), 'wb') as f:
+          f.write(b'corrupt')
+    self.assertRaises(snapshot_archive.Error, self._archive.GetHeap, 'first')
+
+  def testRemoveWithCorruptManifest(self):
+    heap = self._HeapSnapshotData(10)
+    self._archive.Add('first', heap)
+    self._archive.Add('second', self._HeapSnapshotData(20))
+    with open(os.path.join(self._directory, 'snapshots', 'third'), 'w') as f:
+      f.write('{')
+    size = self._archive.DiskUsage()
+
+    # Nothing is removed, since the chunks of the third snapshot are unknown.
+    self.assertRaises(snapshot_archive.Error, self._archive.Remove, 'second')
+    self.assertEqual(['first', 'second', 'third'], self._archive.Names())
+    self.assertEqual(size, self._archive.DiskUsage())
+    self.assertEqual(heap, self._archive.GetHeap('first'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Exports the leak-relevant part of a heap snapshot as a small snapshot.
+
+The heap snapshots of large applications are too big to be loaded into
+DevTools comfortably. The exported snapshot only contains the leaking objects,
+their shortest retaining paths to the Window objects and the bad stop nodes,
+and the objects near the leaks, with all the edges between these objects. It
+is in the V8 heap snapshot format, so DevTools can load it. The objects keep
+their ids; a synthetic root node retains the objects which are not retained by
+other exported objects.
+
+Example:
+
+  snapshot_export.ExportLeaks(leaks, finder.windows, finder.bad_stop_nodes,
+                              'leaks.heapsnapshot')
+"""
+
+import collections
+import json
+
+import leak_finder
+
+
+# The node and edge types of V8; the exported snapshot uses all of them, so
+# that the type indices are the usual ones.
+_NODE_TYPES = ['hidden', 'array', 'string', 'object', 'code', 'closure',
+               'regexp', 'number', 'native', 'synthetic', 'concatenated string',
+               'sliced string', 'symbol', 'bigint']
+_EDGE_TYPES = ['context', 'element', 'property', 'internal', 'hidden',
+               'shortcut', 'weak']
+
+_NODE_FIELDS = ['type', 'name', 'id', 'self_size', 'edge_count',
+                'trace_node_id']
+_EDGE_FIELDS = ['type', 'name_or_index', 'to_node']
+
+# The edge types whose name_or_index is a number instead of a string index.
+_INDEX_EDGE_TYPES = ('element', 'hidden')
+
+_DEFAULT_MAX_DEPTH = 30
+_DEFAULT_NEIGHBORHOOD_DEPTH = 1
+_DEFAULT_MAX_NEIGHBORS = 100
+
+
+def CollectSubgraph(leaked_nodes, windows, bad_stop_nodes,
+                    max_depth=_DEFAULT_MAX_DEPTH,
+                    neighborhood_depth=_DEFAULT_NEIGHBORHOOD_DEPTH,
+                    max_neighbors=_DEFAULT_MAX_NEIGHBORS):
+  """Finds the nodes to export.
+
+  The retaining paths are searched breadth first from all the leaked nodes at
+  once, so each Window object and bad stop node is connected to the nearest
+  leak by a shortest path. The paths end at the Window objects, but continue
+  through the bad stop nodes, so that it is visible how they are retained.
+
+  Args:
+    leaked_nodes: [leak_finder.Node], the leaking objects.
+    windows: set(leak_finder.Node), the Window objects.
+    bad_stop_nodes: set(leak_finder.Node), the bad stop nodes, including the
+        containers.
+    max_depth: int, the maximum length of the retaining paths.
+    neighborhood_depth: int, how many edges away from a leaked node the
+        objects it refers to are exported.
+    max_neighbors: int, the maximum number of neighbors exported per leaked
+        node.
+  Returns:
+    set(leak_finder.Node), the nodes to export.
+  """
+  selected = set(leaked_nodes)
+
+  # Maps the visited nodes to the edge leading towards the nearest leak.
+  toward_leak = dict((node, None) for node in leaked_nodes)
+  frontier = list(leaked_nodes)
+  for _ in range(max_depth):
+    next_frontier = []
+    for node in frontier:
+      for edge in node.edges_to:
+        retainer = edge.from_node
+        if retainer in toward_leak:
+          continue
+        toward_leak[retainer] = edge
+        if retainer in windows or retainer in bad_stop_nodes:
+          # Add the path from the retainer to the nearest leak.
+          path_node = retainer
+          while path_node not in selected:
+            selected.add(path_node)
+            path_node = toward_leak[path_node].to_node
+        if retainer not in windows:
+          next_frontier.append(retainer)
+    frontier = next_frontier
+
+  for node in leaked_nodes:
+    neighbors = set()
+    frontier = [node]
+    for _ in range(neighborhood_depth):
+      next_frontier = []
+      for from_node in frontier:
+        for edge in from_node.edges_from:
+          if len(neighbors) >= max_neighbors:
+            break
+          if edge.to_node not in neighbors and edge.to_node is not node:
+            neighbors.add(edge.to_node)
+            next_frontier.append(edge.to_node)
+      frontier = next_frontier
+    selected.update(neighbors)
+  return selected
+
+
+def _NodeName(node):
+  """Returns the name of a node in the V8 format."""
+  if node.type_string == 'string':
+    return node.string
+  if node.type_string == 'object':
+    return node.class_name
+  return ''
+
+
+def BuildSnapshot(nodes, root_nodes=()):
+  """Builds a V8 heap snapshot of some nodes.
+
+  Only the edges between the given nodes are included. The strings are
+  collected into a new string table. The synthetic root node retains
+  root_nodes, and all the nodes without retainers, so that DevTools doesn't
+  show them as unreachable.
+
+  Args:
+    nodes: set(leak_finder.Node), the nodes to include.
+    root_nodes: set(leak_finder.Node), the nodes retained by the root, e.g.,
+        the Window objects.
+  Returns:
+    {}, the heap snapshot JSON.
+  """
+  strings = ['']
+  string_ixs = {'': 0}
+
+  def StringIndex(value):
+    ix = string_ixs.get(value)
+    if ix is None:
+      ix = string_ixs[value] = len(strings)
+      strings.append(value)
+    return ix
+
+  ordered = sorted(nodes, key=lambda node: node.node_id)
+  node_ixs = dict((node, (ix + 1) * len(_NODE_FIELDS))
+                  for ix, node in enumerate(ordered))
+  retained = set(edge.to_node for node in ordered for edge in node.edges_from
+                 if edge.to_node in node_ixs)
+
+  root_id = max([node.node_id for node in ordered] + [0]) + 1
+  roots = [node for node in ordered
+           if node not in retained or node in root_nodes]
+  node_list = [_NODE_TYPES.index('synthetic'), StringIndex(''), root_id, 0,
+               len(roots), 0]
+  edge_list = []
+  for ix, node in enumerate(roots):
+    edge_list.extend([_EDGE_TYPES.index('element'), ix + 1, node_ixs[node]])
+
+  for node in ordered:
+    edges = [edge for edge in node.edges_from if edge.to_node in node_ixs]
+    type_string = node.type_string
+    if type_string not in _NODE_TYPES:
+      type_string = 'hidden'
+    node_list.extend([_NODE_TYPES.index(type_string),
+                      StringIndex(_NodeName(node)), node.node_id,
+                      node.self_size, len(edges), 0])
+    for edge in edges:
+      if edge.type_string in _INDEX_EDGE_TYPES and edge.name_string.isdigit():
+        name_or_index = int(edge.name_string)
+      else:
+        name_or_index = StringIndex(edge.name_string)
+      type_string = edge.type_string
+      if type_string not in _EDGE_TYPES:
+        type_string = 'internal'
+      edge_list.extend([_EDGE_TYPES.index(type_string), name_or_index,
+                        node_ixs[edge.to_node]])
+
+  meta = collections.OrderedDict([
+      ('node_fields', _NODE_FIELDS),
+      ('node_types', [_NODE_TYPES, 'string', 'number', 'number', 'number',
+                      'number']),
+      ('edge_fields', _EDGE_FIELDS),
+      ('edge_types', [_EDGE_TYPES, 'string_or_number', 'node']),
+      ('trace_function_info_fields', ['function_id', 'name', 'script_name',
+                                      'script_id', 'line', 'column']),
+      ('trace_node_fields', ['id', 'function_info_index', 'count', 'size',
+                             'children']),
+      ('sample_fields', ['timestamp_us', 'last_assigned_id']),
+      ('location_fields', ['object_index', 'script_id', 'line', 'column'])])
+  # The string table must come last, as in the snapshots V8 writes; it is
+  # decoded lazily based on that (see leak_finder.Snapshotter._DecodeHeap).
+  return collections.OrderedDict([
+      ('snapshot', collections.OrderedDict([
+          ('meta', meta),
+          ('node_count', len(ordered) + 1),
+          ('edge_count', len(edge_list) // len(_EDGE_FIELDS)),
+          ('trace_function_count', 0)])),
+      ('nodes', node_list),
+      ('edges', edge_list),
+      ('trace_function_infos', []),
+      ('trace_tree', []),
+      ('samples', []),
+      ('locations', []),
+      ('strings', strings)])
+
+
+def ExportLeaks(leaks, windows, bad_stop_nodes, filename,
+                max_depth=_DEFAULT_MAX_DEPTH,
+                neighborhood_depth=_DEFAULT_NEIGHBORHOOD_DEPTH,
+                max_neighbors=_DEFAULT_MAX_NEIGHBORS):
+  """Writes the leaks and their retaining paths into a heap snapshot file.
+
+  Args:
+    leaks: [leak_finder.LeakNode], the leaks to export.
+    windows: set(leak_finder.Node), the Window objects.
+    bad_stop_nodes: set(leak_finder.Node), the bad stop nodes, including the
+        containers.
+    filename: str, the file to write; compressed if the name ends in .gz,
+        .bz2 or .xz.
+    max_depth: int, the maximum length of the retaining paths.
+    neighborhood_depth: int, how many edges away from a leaked node the
+        objects it refers to are exported.
+    max_neighbors: int, the maximum number of neighbors exported per leaked
+        node.
+  Returns:
+    int, the number of exported nodes.
+  Raises:
+    IOError: The file cannot be written.
+    leak_finder.Error: The compression format is not supported by this Python.
+  """
+  nodes = CollectSubgraph([leak.node for leak in leaks], windows,
+                          bad_stop_nodes, max_depth, neighborhood_depth,
+                          max_neighbors)
+  snapshot = BuildSnapshot(nodes, windows)
+  leak_finder.SaveSnapshotFile(json.dumps(snapshot, separators=(',', ':')),
+                               filename)
+  return len(nodes)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Tests the heap snapshot export."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import leak_finder
+import snapshot_export
+import snapshot_testdata
+
+
+class SnapshotExportTest(unittest.TestCase):
+
+  def setUp(self):
+    self._directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self._directory)
+
+  def _SnapshotData(self):
+    """Helper for creating heap snapshot data.
+
+    (window) - lib -> (lib) - container -> (array) - [0] -> (leaked)
+       |                                                       |
+       `- other -> (unrelated)                       stack -> ('Error...')
+
+    Returns:
+      The heap snapshot data.
+    """
+    strings = ['Window', 'Lib', 'Array', 'Leaked', snapshot_testdata.LEAK_STACK,
+               'lib', 'container', 'stack', 'Unrelated', 'other']
+    node_list = [0, 0, 1, 10, 2,   # 0: window
+                 0, 1, 2, 10, 1,   # 5: lib
+                 2, 2, 3, 10, 1,   # 10: array
+                 0, 3, 4, 10, 1,   # 15: leaked
+                 1, 4, 5, 10, 0,   # 20: stack string
+                 0, 8, 6, 10, 0]   # 25: unrelated
+    edge_list = [0, 5, 5,          # window.lib
+                 0, 9, 25,         # window.other
+                 0, 6, 10,         # lib.container
+                 1, 0, 15,         # array[0]
+                 0, 7, 20]         # leaked.stack
+    return snapshot_testdata.HeapSnapshotData(
+        ['object', 'string', 'array'], ['property', 'element'],
+        ['type', 'name', 'id', 'self_size', 'edge_count'],
+        ['type', 'name_or_index', 'to_node'], node_list, edge_list, strings)
+
+  def testExportLeaks(self):
+    nodes = leak_finder.Snapshotter().GetSnapshotFromHeap(self._SnapshotData())
+    finder = leak_finder.LeakFinder(['lib.container'], [], '', '.stack')
+    leaks = list(finder.FindLeaks(nodes))
+    self.assertEqual(1, len(leaks))
+
+    filename = os.path.join(self._directory, 'leaks.heapsnapshot')
+    self.assertEqual(5, snapshot_export.ExportLeaks(
+        leaks, finder.windows, finder.bad_stop_nodes, filename))
+
+    snapshotter = leak_finder.Snapshotter()
+    exported = dict((node.node_id, node)
+                    for node in snapshotter.GetSnapshotFromFile(filename))
+    self.assertEqual([1, 2, 3, 4, 5], sorted(exported))
+    self.assertEqual('Window', exported[1].class_name)
+    self.assertEqual(snapshot_testdata.LEAK_STACK, exported[5].string)
+    self.assertEqual(['lib'],
+                     [edge.name_string for edge in exported[1].edges_from])
+    self.assertEqual([('element', '0', 4)],
+                     [(edge.type_string, edge.name_string, edge.to_node_id)
+                      for edge in exported[3].edges_from])
+
+    # The exported snapshot has the same leak.
+    finder = leak_finder.LeakFinder(['lib.container'], [], '', '.stack')
+    leaks = list(finder.FindLeaks(exported.values()))
+    self.assertEqual([4], [leak.node.node_id for leak in leaks])
+    leaks[0].RetrieveStackTrace()
+    self.assertEqual(['createLeak'], leaks[0].stack.frames)
+
+  def testRootRetainsUnretainedNodes(self):
+    window = leak_finder.Node(1, 'object', 'Window')
+    leaked = leak_finder.Node(2, 'object', 'Leaked')
+    snapshot = snapshot_export.BuildSnapshot([leaked, window], [window])
+    # The root comes first, with a new id; the nodes are ordered by id.
+    self.assertEqual([3, 1, 2], snapshot['nodes'][2::6])
+    self.assertEqual(['', 'Window', 'Leaked'], snapshot['strings'])
+    # The root refers to both nodes.
+    self.assertEqual(2, snapshot['nodes'][4])
+    self.assertEqual([1, 1, 6, 1, 2, 12], snapshot['edges'])
+    self.assertEqual(3, snapshot['snapshot']['node_count'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Copyright 2012 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License."
+
+"""Heap snapshot data shared by the unit tests."""
+
+# The stack trace of the leaked object in LeakSnapshotData.
+LEAK_STACK = 'Error\n    at createLeak (a.js:1:1)'
+
+
+def HeapSnapshotData(node_types, edge_types, node_fields, edge_fields,
+                     node_list, edge_list, strings):
+  """Helper for creating heap snapshot data."""
+  return {'snapshot': {'meta': {'node_types': [node_types],
+                                'edge_types': [edge_types],
+                                'node_fields': node_fields,
+                                'edge_fields': edge_fields}},
+          'nodes': node_list,
+          'edges': edge_list,
+          'strings': strings}
+
+
+def LeakSnapshotData(leaking=True, stack=True):
+  """Helper for creating heap snapshot data with a leak.
+
+  (window) - lib -> (lib) - container -> (array) - [0] -> (leaked)
+                                                               |
+                                                     stack -> ('Error...')
+
+  Args:
+    leaking: bool, if False, the array is empty.
+    stack: bool, if False, the leaked object has no stack property.
+  Returns:
+    The heap snapshot data.
+  """
+  strings = ['Window', 'Lib', 'Array', 'Leaked', 'lib', 'container', 'stack',
+             LEAK_STACK]
+  node_list = [0, 0, 1, 10, 1,              # 0: window
+               0, 1, 2, 10, 1,              # 5: lib
+               2, 2, 3, 10, int(leaking),   # 10: array
+               0, 3, 4, 10, int(stack)]     # 15: leaked
+  edge_list = [0, 4, 5,                     # window.lib
+               0, 5, 10]                    # lib.container
+  if leaking:
+    edge_list.extend([1, 0, 15])            # array[0]
+  if stack:
+    node_list.extend([1, 7, 5, 10, 0])      # 20: stack string
+    edge_list.extend([0, 6, 20])            # leaked.stack
+  return HeapSnapshotData(['object', 'string', 'array'],
+                          ['property', 'element'],
+                          ['type', 'name', 'id', 'self_size', 'edge_count'],
+                          ['type', 'name_or_index', 'to_node'], node_list,
+                          edge_list, strings)
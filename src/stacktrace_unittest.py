@@ -18,12 +18,12 @@
 
 import textwrap
 
-import googletest
+import unittest
 
 import stacktrace
 
 
-class ParseV8FrameTest(googletest.TestCase):
+class ParseV8FrameTest(unittest.TestCase):
   def _ParseV8Frame(self, frame):
     return stacktrace.Stack('Error\n%s' % frame).frames[0]
 
@@ -71,7 +71,7 @@ class ParseV8FrameTest(googletest.TestCase):
     self.assertEqual('*', fun)
 
 
-class ParseJSCFrameTest(googletest.TestCase):
+class ParseJSCFrameTest(unittest.TestCase):
   def _ParseJSCFrame(self, frame):
     return stacktrace.Stack('--> Stack trace:\n%s' % frame).frames[0]
 
@@ -104,7 +104,7 @@ class ParseJSCFrameTest(googletest.TestCase):
     self.assertEqual('*', fun)
 
 
-class StackTest(googletest.TestCase):
+class StackTest(unittest.TestCase):
   def testJSCStack(self):
     jsc_trace = """--> Stack trace:
     0   frame@somefile:42
@@ -141,4 +141,4 @@ class StackTest(googletest.TestCase):
 
 
 if __name__ == '__main__':
-  googletest.main()
+  unittest.main()
@@ -16,15 +16,15 @@
 
 """Tests Suppressions."""
 
-import StringIO
+import io
 import textwrap
 
-import googletest
+import unittest
 
 import suppressions
 
 
-class SuppressionTest(googletest.TestCase):
+class SuppressionTest(unittest.TestCase):
   def testEmpty(self):
     supp = suppressions.Suppression('', '', [])
     self.assertFalse(supp.Match('', []))
@@ -55,7 +55,7 @@ class SuppressionTest(googletest.TestCase):
     self.assertFalse(supp.Match('foo', ['1', '2', 'bar']))
 
 
-class ReadSuppressionsFromFileTest(googletest.TestCase):
+class ReadSuppressionsFromFileTest(unittest.TestCase):
   def testReadFile(self):
     test_file = textwrap.dedent("""\
       # some comment
@@ -77,7 +77,7 @@ class ReadSuppressionsFromFileTest(googletest.TestCase):
       }
       """)
 
-    dummy_open = lambda x: StringIO.StringIO(test_file)
+    dummy_open = lambda x: io.StringIO(test_file)
     result = suppressions.ReadSuppressionsFromFile('', open=dummy_open)
 
     self.assertEqual(2, len(result))
@@ -99,7 +99,7 @@ class ReadSuppressionsFromFileTest(googletest.TestCase):
         frame
         ...
       """)
-    dummy_open = lambda x: StringIO.StringIO(test_file_early_eof)
+    dummy_open = lambda x: io.StringIO(test_file_early_eof)
     with self.assertRaises(suppressions.UnexpectedEofError):
       suppressions.ReadSuppressionsFromFile('', open=dummy_open)
 
@@ -115,10 +115,10 @@ class ReadSuppressionsFromFileTest(googletest.TestCase):
 
       this doesn't parse
       """)
-    dummy_open = lambda x: StringIO.StringIO(test_file_unparsable)
+    dummy_open = lambda x: io.StringIO(test_file_unparsable)
     with self.assertRaises(suppressions.ParseError):
       suppressions.ReadSuppressionsFromFile('', open=dummy_open)
 
 
 if __name__ == '__main__':
-  googletest.main()
+  unittest.main()